@@ -1,31 +1,21 @@
 import pathlib
-from uuid import uuid4
+import uuid
 
-import os
-import glob
-import ladybug_geometry.geometry2d
-import ladybug_geometry.geometry3d
 import streamlit as st
-from ladybug.epw import EPW
-from ladybug.wea import Wea
-import ladybug_geometry
-from honeybee.room import Room
-from honeybee.model import Model, Face, Aperture
-from honeybee_radiance.properties.model import ModelRadianceProperties
 from honeybee_vtk.model import DisplayMode
-from honeybee_vtk.model import Model as VTKModel
-from honeybee_vtk.vtkjs.schema import SensorGridOptions
-from honeybee_radiance.sensorgrid import SensorGrid
 from visualize_model import generate_vtk_model
+from room_geometry import artifact_store, geometry_cache
+from weather import download_cache, weather_cache, write_upload
 from streamlit_vtkjs import st_vtkjs
 from pollination_io.api.client import ApiClient
 from pollination_io.interactors import Job, NewJob, Recipe, Run
+from jobs import LocalJob, LocalNewJob, LocalRecipe, local_client
+from uploads import artifact_uploader
+from tracker import job_tracker
+from run_results import run_results_cache
 from queenbee.job.job import JobStatusEnum
+from queenbee.job.run import RunStatusEnum
 from streamlit_autorefresh import st_autorefresh
-import dload
-import zipfile
-from ladybug_vtk._extend_visualization_set import vs_to_vtkjs
-from honeybee_display.model import VisualizationSet
 
 
 #### CONFIGURE PAGE
@@ -49,6 +39,16 @@ if 'study_inputs' not in st.session_state:
 if 'model_var' not in st.session_state:
     st.session_state['model_var'] = []
 
+if 'tracked_jobs' not in st.session_state:
+    st.session_state['tracked_jobs'] = []
+
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+
+# the saved models stay pinned in the artifact store while the session is open
+artifact_store(pathlib.Path(__file__).parent).touch(
+    st.session_state['session_id'], st.session_state['models'])
+
 model_name = []
 baseline_model = []
 hor_num = 0
@@ -81,6 +81,10 @@ api_key = st.sidebar.text_input(
 
 owner = st.sidebar.text_input('Project Owner', value="justinshultz")
 project = st.sidebar.text_input('Project Name', value="hacksimbuild-2024")
+run_local = st.sidebar.checkbox(
+    'Run Studies Locally', value=False,
+    help='Run the studies on this machine instead of Pollination. This '
+    'needs lbt-recipes and Radiance to be installed.')
 
 
 
@@ -172,43 +176,12 @@ with tab1:
 
 
         #### create honeybee room
-        room = Room.from_box(
-            identifier=str(uuid4()),
-            width=room_width,
-            depth=room_depth,
-            height=room_height)
-        
-        point_origin = ladybug_geometry.geometry3d.Point3D(x=room_width/2, y=room_depth/2 ,z=0)
-        
-        room.rotate_xy(-1*room_orient,point_origin)
-
-        grid = SensorGrid.from_mesh3d(str(uuid4()), room.generate_grid(x_dim=2, offset=2.5))
-        faces: Face = room.faces[1]
-
-        faces.apertures_by_ratio(wwr)
-        apertures: Aperture = faces.apertures[0]
-
-
-        aperture_height = (apertures.max - apertures.min).z
-        aperture_width = (apertures.max.x - apertures.min.x)
-
-
-        if horizontal:
-            apertures.louvers_by_distance_between(distance=aperture_height/hor_num, depth=hor_depth, base_name='shade_hor',contour_vector=ladybug_geometry.geometry2d.Vector2D(0, 1))
-        if vertical:
-            apertures.louvers_by_distance_between(distance=aperture_width/vert_num, depth=vert_depth, contour_vector=ladybug_geometry.geometry2d.Vector2D(1, 0), base_name='shade_vert')
-
-
-        simple_model = Model.from_objects(
-            identifier=f'model_{room_width}_{room_depth}_{room_height}_{wwr}_{room_orient}_{hor_depth}_{hor_num}_{vert_depth}_{vert_num}',
-            objects=[room],
+        simple_model = geometry_cache(pathlib.Path(__file__).parent).model(
+            width=room_width, depth=room_depth, height=room_height,
+            orientation=room_orient, wwr=wwr,
+            hor_num=hor_num, hor_depth=hor_depth,
+            vert_num=vert_num, vert_depth=vert_depth,
             units=units)
-        
-        # st.write(simple_model)
-        simple_model._properties._radiance = ModelRadianceProperties(simple_model, [grid])
-
-        model_path = simple_model.to_hbjson(name=simple_model.identifier, folder='data')
-        vtk_path = pathlib.Path('data', f'{simple_model.identifier}.vtkjs')
 
 
         if model_name in st.session_state['model_names']:
@@ -247,7 +220,10 @@ with tab1:
 
                         # st.write(model_path)
 
+                        model_path = geometry_cache(pathlib.Path(__file__).parent).hbjson(simple_model)
                         st.session_state['models'].append(model_path)
+                        artifact_store(pathlib.Path(__file__).parent).pin(
+                            model_path, st.session_state['session_id'])
                         # st.write(st.session_state['models'])
 
                         st.session_state['model_var'].append({
@@ -265,14 +241,14 @@ with tab1:
                         st.warning("Enter text")
 
 
-    if not vtk_path.is_file():
-        VTKModel.from_hbjson(model_path, SensorGridOptions.Sensors).to_vtkjs(
-            folder='data', name=simple_model.identifier)
+    vtk_content = geometry_cache(pathlib.Path(__file__).parent).vtkjs(simple_model)
 
     with col2_con:
+        # a fixed key keeps the same viewer mounted across changes to the room
+        # such that only the new content is sent to it instead of a new viewer
         st_vtkjs(
-            content=vtk_path.read_bytes(),
-            key=simple_model.identifier, subscribe=False
+            content=vtk_content,
+            key='room_preview', subscribe=False
         )
 
 
@@ -285,7 +261,12 @@ with tab1:
             clear_models = col3_body2.button('X CLEAR')
 
             if clear_models:
+                for mod in st.session_state['models']:
+                    artifact_store(pathlib.Path(__file__).parent).unpin(
+                        mod, st.session_state['session_id'])
                 st.session_state['model_names']=[]
+                st.session_state['models']=[]
+                st.session_state['model_var']=[]
 
             baseline_model = col3_body1.radio('Select Baseline Model:', options=st.session_state['model_names'])
             st.write(baseline_model)
@@ -295,21 +276,12 @@ with tab1:
             st.write("Launch [EPW Map](%s)" % url)
             epw_url = st.text_input('EPW URL')
 
-            files = glob.glob('data/epw/*')
-            for f in files:
-                os.remove(f)
-
-            dload.save_unzip(epw_url, 'data/epw/', delete_after=True,)
-
-
-            
-            for file_name in os.listdir('data/epw/'):
-                if file_name.endswith(".epw"):
-                    epw_urlfile = 'data/epw/' + file_name
-
-                    epw_filepath = epw_urlfile
-            
+            if epw_url:
+                try:
+                    epw_filepath = download_cache(pathlib.Path(__file__).parent).epw_path(epw_url)
                     st.write(epw_filepath)
+                except (OSError, ValueError) as e:
+                    st.error('Failed to download the EPW: {}'.format(e))
 
 
 
@@ -317,12 +289,12 @@ with tab1:
             epw_upload =  st.file_uploader("EPW File", type=['epw'], key='epw_upload', accept_multiple_files=False)
             # st.write(epw_upload)
 
-            if epw_upload:
-                epw_filepath = pathlib.Path(f'./data/{epw_upload.name}')
+            if epw_upload:  # only written again if the upload changed
+                epw_filepath = write_upload(epw_upload, './data')
                 # st.write(epw_filepath)
 
             if epw_filepath:
-                epw_data = EPW(epw_filepath)
+                epw_data = weather_cache(pathlib.Path(__file__).parent).get(epw_filepath)
 
         # st.write(epw_data)
         if epw_data != 0:
@@ -340,28 +312,41 @@ with tab1:
             # epw_file.write_bytes(epw_data.read())
 
             # epw_obj = EPW(epw_file)
-            wea_obj = Wea.from_epw_file(epw_filepath)
-            wea_file = wea_obj.write(f'./data/weather_file.wea')
+            wea_file = epw_data.wea_path
             # st.write(wea_file)
             # .to_wea(file_path=epw_file)
 
             if run_simulation:
                 job_id = None
 
-                recipe = Recipe(
+                # the local backend mirrors the interface of the Pollination interactors
+                if run_local:
+                    job_client = local_client(pathlib.Path(__file__).parent)
+                    recipe_type, new_job_type, job_type = LocalRecipe, LocalNewJob, LocalJob
+                else:
+                    job_client = api_client
+                    recipe_type, new_job_type, job_type = Recipe, NewJob, Job
+
+                recipe = recipe_type(
                     owner = 'ladybug-tools',
                     name = 'annual-daylight',
                     tag = 'latest', 
-                    client = api_client
+                    client = job_client
                     )
                 
-                new_job = NewJob(
+                new_job = new_job_type(
                     owner=owner, 
                     project=project, 
                     recipe=recipe, 
                     name=study_name,
-                    client=api_client)
-                wea_project_path = new_job.upload_artifact(pathlib.Path(wea_file), 'streamlit-job')
+                    client=job_client)
+                # files that were uploaded to the project before are not uploaded again
+                upload_bar = st.progress(0.0, text='Uploading study files...')
+                wea_project_path, *model_project_paths = artifact_uploader(pathlib.Path(__file__).parent).upload(
+                    new_job, [wea_file] + st.session_state['models'], 'streamlit-job',
+                    host=getattr(job_client, 'host', ''),
+                    progress=lambda done, total: upload_bar.progress(
+                        done / total, text=f'Uploaded {done} of {total} study files'))
                 
                 recipe_inputs = {
                     'wea': wea_project_path
@@ -370,8 +355,7 @@ with tab1:
                 index = 0
                 for mod in st.session_state['models']:
                     # st.write(mod)
-                    model_project_path = new_job.upload_artifact(
-                        pathlib.Path(mod), 'streamlit-job')
+                    model_project_path = model_project_paths[index]
                     
                     inputs = dict(recipe_inputs)
 
@@ -406,22 +390,15 @@ with tab1:
 
                 if job_id is not None and owner is not None and project is not None:
 
-                    job = Job(owner, project, job_id, client=api_client)
+                    job = job_type(owner, project, job_id, client=job_client)
+                    st.session_state['tracked_jobs'].append(
+                        job_tracker().track(job, host=getattr(job_client, 'host', '')))
 
-                    st.write(
-                        f'Checkout your job [here](https://app.pollination.cloud/{owner}/projects/{project}/jobs/{job_id})')
-
-                    if job.status.status in [
-                            JobStatusEnum.pre_processing,
-                            JobStatusEnum.running,
-                            JobStatusEnum.created,
-                            JobStatusEnum.unknown]:
-                        with st.spinner(text="Simulation in Progres..."):
-                            st.warning(f'Simulation is {job.status.status.value}...')
-                            # st_autorefresh(interval=2000, limit=100)
-
-                    elif job.status.status in [JobStatusEnum.failed, JobStatusEnum.cancelled]:
-                        st.warning(f'Simulation is {job.status.status.value}')
+                    if run_local:
+                        st.write(f'Your job is running locally in `{job.folder}`')
+                    else:
+                        st.write(
+                            f'Checkout your job [here](https://app.pollination.cloud/{owner}/projects/{project}/jobs/{job_id})')
                     # else:
                     #     job.runs_dataframe.parameters
                     #     res_model_path = view_results(
@@ -431,175 +408,218 @@ with tab1:
                     #         subscribe=False
                     #     )
 
+            # job statuses are checked in the background once for all sessions
+            tracker = job_tracker()
+            for job_key in st.session_state['tracked_jobs']:
+                job_status = tracker.status(job_key)
+                if job_status is None:
+                    continue
+                if job_status.status in [
+                        JobStatusEnum.pre_processing,
+                        JobStatusEnum.running,
+                        JobStatusEnum.created,
+                        JobStatusEnum.unknown]:
+                    with st.spinner(text="Simulation in Progres..."):
+                        st.warning(f'Simulation {job_key[-1][:8]} is {job_status.status.value}...')
+
+                elif job_status.status in [JobStatusEnum.failed, JobStatusEnum.cancelled]:
+                    st.warning(f'Simulation {job_key[-1][:8]} is {job_status.status.value}')
+            if tracker.active(st.session_state['tracked_jobs']):
+                st_autorefresh(interval=5000, key='job_status_refresh')
+
 with tab2:
-    from pollination_streamlit.selectors import get_api_client
-    from pollination_streamlit_io import (select_account, select_cloud_artifact,
-                                        select_project, select_study, select_run)
     from pollination_streamlit_viewer import viewer
 
-    # in this tutorial, the api_client is taken from app.py
-    # typically you would create the api_client as shown below
+    if run_local:
+        # studies of the local backend are read from their folders instead of the API
+        job_client = local_client(pathlib.Path(__file__).parent)
+        local_jobs = job_client.jobs(owner, project)
+        if not local_jobs:
+            st.info(f'No local studies were found in {owner}/{project}.')
+        else:
+            st.subheader(f'Select a study of {owner}/{project}:')
+            study = st.selectbox(
+                'Study', local_jobs,
+                format_func=lambda job: job.api_object.get('name') or job.id)
+            runs = [run for run in study.runs
+                    if run.status.status == RunStatusEnum.succeeded]
+            if not runs:
+                st.info('No run of this study has finished yet.')
+            else:
+                st.subheader('Select a run:')
+                run = st.selectbox(
+                    'Run', runs, format_func=lambda run: '{} ({})'.format(
+                        run.id[:8], pathlib.Path(run.api_object['inputs']['model']).name))
+                # the output is only zipped and parsed the first time a run is opened
+                try:
+                    vtkjs_content = run_results_cache(pathlib.Path(__file__).parent).vtkjs(
+                        run.id, lambda: run.download_zipped_output('visualization'))
+                except ValueError as e:  # the recipe did not write a visualization
+                    st.warning(str(e))
+                else:
+                    viewer('results_viewer', content=vtkjs_content)
+
+    else:
+        from pollination_streamlit.selectors import get_api_client
+        from pollination_streamlit_io import (select_account, select_cloud_artifact,
+                                            select_project, select_study, select_run)
+
+        # in this tutorial, the api_client is taken from app.py
+        # typically you would create the api_client as shown below
     
-    api_client = get_api_client()
-
-    account = select_account('select-account', api_client)
-    study = None
-    if account:
-        # if it is an organization it uses account_name otherwise username
-        project_owner = account.get('username') or account.get('account_name')
-        st.subheader(f'Hi {project_owner}! Select a project:')
-
-        pcol1, pcol2 = st.columns(2)
-
-        with pcol1:
-            project = select_project(
-                'select-project',
-                api_client,
-                project_owner=project_owner
-            )
-        with pcol2:
-            st.json(project or '{}', expanded=False)
-
-        if project:
-            # get project name
-            project_name = project.get('name')
-            st.subheader('Select a study:')
-
-            scol1, scol2 = st.columns(2)
-
-            with scol1:
-                study = select_study(
-                    'select-study',
-                    api_client,
-                    project_name=project_name,
-                    project_owner=project_owner,
-                )
-            with scol2:
-                st.json(study or '{}', expanded=False)
-        
-        if study: 
-            #get run name
-            study_name = study.get('name')
-            # st.write(study.get('id'))
-            st.subheader('Select a run:')
+        api_client = get_api_client()
 
-            scol1, scol2 = st.columns(2)
+        account = select_account('select-account', api_client)
+        study = None
+        if account:
+            # if it is an organization it uses account_name otherwise username
+            project_owner = account.get('username') or account.get('account_name')
+            st.subheader(f'Hi {project_owner}! Select a project:')
 
-            with scol1:
-                run = select_run(
-                    'select-run',
+            pcol1, pcol2 = st.columns(2)
+
+            with pcol1:
+                project = select_project(
+                    'select-project',
                     api_client,
-                    project_name=project_name,
-                    project_owner=project_owner,
-                    job_id=study.get('id'),
+                    project_owner=project_owner
                 )
-                # print(run.keys())
+            with pcol2:
+                st.json(project or '{}', expanded=False)
+
+            if project:
+                # get project name
+                project_name = project.get('name')
+                st.subheader('Select a study:')
+
+                scol1, scol2 = st.columns(2)
+
+                with scol1:
+                    study = select_study(
+                        'select-study',
+                        api_client,
+                        project_name=project_name,
+                        project_owner=project_owner,
+                    )
+                with scol2:
+                    st.json(study or '{}', expanded=False)
+        
+            if study: 
+                #get run name
+                study_name = study.get('name')
+                # st.write(study.get('id'))
+                st.subheader('Select a run:')
+
+                scol1, scol2 = st.columns(2)
+
+                with scol1:
+                    run = select_run(
+                        'select-run',
+                        api_client,
+                        project_name=project_name,
+                        project_owner=project_owner,
+                        job_id=study.get('id'),
+                    )
+                    # print(run.keys())
 
-                # assert False, run['owner']['name']
-                    # project = project_name, 
-                    # job_id = study.get('id'), 
-                    # id = run.get('id'), 
-                    # client = api_client)
+                    # assert False, run['owner']['name']
+                        # project = project_name, 
+                        # job_id = study.get('id'), 
+                        # id = run.get('id'), 
+                        # client = api_client)
                 
-                run_io = Run(
-                    owner = run['owner']['name'], 
-                    project = project_name, 
-                    job_id = study.get('id'), 
-                    id = run.get('id'), 
-                    client = api_client)
-                data = run_io.download_zipped_output('visualization')
-                out_file = pathlib.Path('data', 'results', 'visualization.vsf')
-                with zipfile.ZipFile(data) as zip_folder:
-                    zip_folder.extractall(out_file.parent)
-                
-                vs = VisualizationSet.from_file(out_file.as_posix())
-                vtkjs_file = out_file.parent.joinpath(f'{run.get("id")}.vtkjs')
-
-            with scol2:
-                st.json(run or '{}', expanded=False)
+                    # the output is only downloaded and parsed the first time a run is opened
+                    vtkjs_content = run_results_cache(pathlib.Path(__file__).parent).vtkjs(
+                        run.get('id'), lambda: Run(
+                            owner = run['owner']['name'], 
+                            project = project_name, 
+                            job_id = study.get('id'), 
+                            id = run.get('id'), 
+                            client = api_client).download_zipped_output('visualization'))
+
+                with scol2:
+                    st.json(run or '{}', expanded=False)
         
-            if not vtkjs_file.is_file():
-                vs_to_vtkjs(vs, out_file.parent, run.get('id'))
-            viewer('results_viewer', content=vtkjs_file.read_bytes())
-
-        # if study:
-        #     study_id = study.get('id')
-        #     st.subheader('Select an artifact:')
-        #     st.info('It returns the name of the file \
-        #             and the binary data to save.')
-
-        #     acol1, acol2 = st.columns(2)
-
-        #     with acol1:
-        #         artifact = select_cloud_artifact(
-        #             'sel-artifact',
-        #             api_client,
-        #             project_name=project_name,
-        #             project_owner=project_owner,
-        #             study_id=study_id,
-        #             file_name_match=".*"
-        #         )
-        #     with acol2:
-        #         st.json(artifact or {}, expanded=False)
+                viewer('results_viewer', content=vtkjs_content)
+
+            # if study:
+            #     study_id = study.get('id')
+            #     st.subheader('Select an artifact:')
+            #     st.info('It returns the name of the file \
+            #             and the binary data to save.')
+
+            #     acol1, acol2 = st.columns(2)
+
+            #     with acol1:
+            #         artifact = select_cloud_artifact(
+            #             'sel-artifact',
+            #             api_client,
+            #             project_name=project_name,
+            #             project_owner=project_owner,
+            #             study_id=study_id,
+            #             file_name_match=".*"
+            #         )
+            #     with acol2:
+            #         st.json(artifact or {}, expanded=False)
         
-        # name, value, type = artifact
+            # name, value, type = artifact
 
 
-        # st.write(name)
+            # st.write(name)
 
-        # if artifact:
-        #     st.info('Click on visualization card.')
-        #     if name and name.endswith('vtkjs'):
-        #         viewer(key='my-vsf', content=value)
+            # if artifact:
+            #     st.info('Click on visualization card.')
+            #     if name and name.endswith('vtkjs'):
+            #         viewer(key='my-vsf', content=value)
 
-        # st.write(artifact.file)
-        # if artifact:
-        #     dload.save_unzip(artifact[0], './data/results/', delete_after=False,)
+            # st.write(artifact.file)
+            # if artifact:
+            #     dload.save_unzip(artifact[0], './data/results/', delete_after=False,)
 
-            # with zipfile.ZipFile(artifact) as zip_folder:
-            #     zip_folder.extractall('./data/results/')
+                # with zipfile.ZipFile(artifact) as zip_folder:
+                #     zip_folder.extractall('./data/results/')
             
-            # vtkjs_path = pathlib.Path(out.target_folder + out.output_name)
-        #         viewer(content=vtkjs_path.read_bytes(), key='df')
-
-        # if run and run.progress == 100:
-        #     if name and name.endswith('vtkjs'):
-        #         viewer(key='my-vsf', content=value)
-
-        # def download_output(api_key: str, owner: str, project: str, job_id: str, run_index: int,
-        #         output_name: str, target_folder: str) -> None:
-        #     """Download output from a job on Pollination.
-
-        #     Args:
-        #         api_key: The API key of the Pollination account.
-        #         owner: The owner of the Pollination account.
-        #         project: The name of the project inside which the job was created.
-        #         job_id: The id of the job.
-        #         run_index: The index of the run inside the job.
-        #         output_name: The name of the output you wish to download. You can find the names
-        #             of all the outputs either on the job page or on the recipe page.
-        #         target_folder: The folder where the output will be downloaded.
-        #     """
-        #     out_job = Job(owner, project, job_id, client=api_client)
-        #     out_run = out_job.runs[run_index]
-        #     output = out_run.download_zipped_output(output_name)
-
-        #     with zipfile.ZipFile(output) as zip_folder:
-        #         zip_folder.extractall(target_folder)
+                # vtkjs_path = pathlib.Path(out.target_folder + out.output_name)
+            #         viewer(content=vtkjs_path.read_bytes(), key='df')
+
+            # if run and run.progress == 100:
+            #     if name and name.endswith('vtkjs'):
+            #         viewer(key='my-vsf', content=value)
+
+            # def download_output(api_key: str, owner: str, project: str, job_id: str, run_index: int,
+            #         output_name: str, target_folder: str) -> None:
+            #     """Download output from a job on Pollination.
+
+            #     Args:
+            #         api_key: The API key of the Pollination account.
+            #         owner: The owner of the Pollination account.
+            #         project: The name of the project inside which the job was created.
+            #         job_id: The id of the job.
+            #         run_index: The index of the run inside the job.
+            #         output_name: The name of the output you wish to download. You can find the names
+            #             of all the outputs either on the job page or on the recipe page.
+            #         target_folder: The folder where the output will be downloaded.
+            #     """
+            #     out_job = Job(owner, project, job_id, client=api_client)
+            #     out_run = out_job.runs[run_index]
+            #     output = out_run.download_zipped_output(output_name)
+
+            #     with zipfile.ZipFile(output) as zip_folder:
+            #         zip_folder.extractall(target_folder)
         
-        # if study is not None and project_owner is not None and project_name is not None and run is not None:
-        #     out = download_output(
-        #         owner= project_owner,
-        #         project= project_name,
-        #         job_id= study.get('id'),
-        #         run_index= 1,
-        #         output_name='visualization.vtkjs',
-        #         target_folder='./data/results',
-        #         api_key=api_key
-        #     )
-
-        #     st.write(out)
-
-        #     if out is not None:
-        #         vtkjs_path = pathlib.Path(out.target_folder + out.output_name)
-        #         viewer(content=vtkjs_path.read_bytes(), key='df')
\ No newline at end of file
+            # if study is not None and project_owner is not None and project_name is not None and run is not None:
+            #     out = download_output(
+            #         owner= project_owner,
+            #         project= project_name,
+            #         job_id= study.get('id'),
+            #         run_index= 1,
+            #         output_name='visualization.vtkjs',
+            #         target_folder='./data/results',
+            #         api_key=api_key
+            #     )
+
+            #     st.write(out)
+
+            #     if out is not None:
+            #         vtkjs_path = pathlib.Path(out.target_folder + out.output_name)
+            #         viewer(content=vtkjs_path.read_bytes(), key='df')
\ No newline at end of file
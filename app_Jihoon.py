@@ -1,19 +1,9 @@
-import pathlib
-from uuid import uuid4
-
 import streamlit as st
 import honeybee
 import ladybug
-from ladybug.epw import EPW
-from ladybug.wea import Wea
-from honeybee.room import Room
-from honeybee.model import Model, Face
-from honeybee_radiance.properties.model import ModelRadianceProperties
 from honeybee_vtk.model import DisplayMode
-from honeybee_vtk.model import Model as VTKModel
-from honeybee_vtk.vtkjs.schema import SensorGridOptions
-from honeybee_radiance.sensorgrid import SensorGrid
 from visualize_model import generate_vtk_model
+from room_geometry import geometry_cache
 from streamlit_vtkjs import st_vtkjs
 # from pollination_io.api.client import ApiClient
 # from pollination_io.interactors import Job, NewJob, Recipe
@@ -57,18 +47,27 @@ wwr = col1.slider("WWR", max_value=95, min_value=10, step=5)/100
 vlt = col1.slider("VLT", max_value=90, min_value=10, step=5)/100
 shgc = col1.slider("SHGC", max_value=90, min_value=10, step=5)/100
 
-def create_room(width, depth, height):
-    room = Room.from_box('room',width,depth,height)
-
-    return room
-
-room = Room.from_box(
-    identifier=str(uuid4()),
-    width=room_width,
-    depth=room_depth,
-    height=room_height)
+# Jihoon
+from inputs import initialize
+from simulation import run_energy_simulation
+from outputs import display_results
+from weather import weather_cache, write_upload
+from pathlib import Path
 
+# initialize the app and load up all of the inputs
+initialize()
 
+# get the room from the geometry cache, which builds it with a fixed identifier
+# such that identical inputs reuse the same model and simulation results
+room_params = dict(
+    width=room_width, depth=room_depth, height=room_height,
+    orientation=0, wwr=wwr, units='Meters')
+if room_params != st.session_state.room_params:
+    st.session_state.room_params = room_params
+    st.session_state.sql_results = None  # reset to show the new estimate
+simple_model = geometry_cache(st.session_state.target_folder).model(**room_params)
+simple_model = simple_model.duplicate()  # do not edit the cached model
+room = simple_model.rooms[0]
 
 # Create a construction set
 construction_set = generic_construction_set
@@ -82,27 +81,15 @@ hvac_system = IdealAirSystem("HVAC")
 # Assign the HVAC system to the room
 room.properties.hvac = hvac_system
 
-grid = SensorGrid.from_mesh3d(str(uuid4()), room.generate_grid(x_dim=2, offset=2.5))
-faces: Face = room.faces[1]
-faces.apertures_by_ratio(wwr)
+faces = room.faces[1]
 st.write(faces)
 
-
-simple_model = Model.from_objects(f'model_{room_width}_{room_depth}_{room_height}_{wwr}',[room],units='Meters')
-
-simple_model._properties._radiance = ModelRadianceProperties(simple_model, [grid])
-
-model_path = simple_model.to_hbjson(name=simple_model.identifier, folder='data')
-vtk_path = pathlib.Path('data', f'{simple_model.identifier}.vtkjs')
-
-if not vtk_path.is_file():
-    VTKModel.from_hbjson(model_path, SensorGridOptions.Sensors).to_vtkjs(
-        folder='data', name=simple_model.identifier)
+vtk_content = geometry_cache(st.session_state.target_folder).vtkjs(simple_model)
 
 with col2_con:
     st_vtkjs(
-        content=vtk_path.read_bytes(),
-        key=simple_model.identifier, subscribe=False
+        content=vtk_content,
+        key='room_preview', subscribe=False
     )
 
 
@@ -178,22 +165,11 @@ st.checkbox("Select Faces", room.faces)
 
 
 
-# Jihoon
-from inputs import initialize
-from simulation import run_energy_simulation
-from outputs import display_results
-from pathlib import Path
-
 # Run simulation
-# initialize the app and load up all of the inputs
-initialize()
-
 epw_data = st.file_uploader("EPW File", type=['epw'], key='epw_data')
 if epw_data:
-    epw_file = pathlib.Path(f'./data/{epw_data.name}')
+    epw_file = write_upload(epw_data, './data')  # only written again if it changed
     st.write(epw_file)
-    epw_file.parent.mkdir(parents=True, exist_ok=True)
-    epw_file.write_bytes(epw_data.read())
 
 # if epw_file:
     # save EPW in data folder
@@ -201,19 +177,15 @@ if epw_data:
     # epw_path.parent.mkdir(parents=True, exist_ok=True)
     # epw_path.write_bytes(epw_path.read())
     # create a DDY file from the EPW
-    ddy_file = epw_file.as_posix().replace('.epw', '.ddy')
-    epw_obj = EPW(epw_file.as_posix())
-    epw_obj.to_ddy(ddy_file)
-    ddy_path = Path(ddy_file)
+    weather_data = weather_cache(st.session_state.target_folder).get(epw_file)
     # set the session state variables
-    st.session_state.epw_path = epw_file
-    st.session_state.ddy_path = ddy_path
+    st.session_state.epw_path = Path(weather_data.epw_path)
+    st.session_state.ddy_path = Path(weather_data.ddy_path)
 
     # epw_filename = 'boston'
     # epw_file = f'./data/{epw_filename}.epw'
     # #epw_obj = EPW(epw_file)
-    wea_obj = Wea.from_epw_file(epw_file)
-    wea_file = wea_obj.write(f'./data/weather_file.wea')
+    wea_file = weather_data.wea_path
     st.write(wea_file)
 else:
     st.session_state.epw_path = None
@@ -256,7 +228,8 @@ st.session_state.hb_model = simple_model
 run_energy_simulation(
     st.session_state.target_folder,
     st.session_state.hb_model,
-    st.session_state.epw_path, st.session_state.ddy_path, st.session_state.north
+    st.session_state.epw_path, st.session_state.ddy_path, st.session_state.north,
+    room_params
 )
 
 # create the resulting charts
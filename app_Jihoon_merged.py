@@ -1,35 +1,29 @@
 import pathlib
-from uuid import uuid4
+import uuid
 
-import os
-import glob
-import ladybug_geometry.geometry2d
-import ladybug_geometry.geometry3d
 import streamlit as st
 import honeybee
 import ladybug
-from ladybug.epw import EPW
-from ladybug.wea import Wea
-import ladybug_geometry
-from honeybee.room import Room
-from honeybee.model import Model, Face, Aperture
-from honeybee_radiance.properties.model import ModelRadianceProperties
 from honeybee_vtk.model import DisplayMode
-from honeybee_vtk.model import Model as VTKModel
-from honeybee_vtk.vtkjs.schema import SensorGridOptions
-from honeybee_radiance.sensorgrid import SensorGrid
 from visualize_model import generate_vtk_model
+from room_geometry import artifact_store, geometry_cache
+from weather import download_cache, weather_cache, write_upload
 from streamlit_vtkjs import st_vtkjs
 from pollination_io.api.client import ApiClient
 from pollination_io.interactors import Job, NewJob, Recipe
+from jobs import LocalJob, LocalNewJob, LocalRecipe, local_client
+from uploads import artifact_uploader
+from tracker import job_tracker
 from queenbee.job.job import JobStatusEnum
 from streamlit_autorefresh import st_autorefresh
-import dload
 
 # Jihoon: Modules to implement an EnergyPlus simulations
 from inputs import initialize
 from simulation import run_energy_simulation
-from outputs import display_results
+from outputs import display_hourly_results, display_results
+from comparison import comparison_cache
+from results_store import results_store
+from batch import run_batch_simulation
 
 #### CONFIGURE PAGE
 app_title = 'ROOMBOX - HACKSIMBUILD 2024'
@@ -52,9 +46,22 @@ if 'study_inputs' not in st.session_state:
 if 'model_var' not in st.session_state:
     st.session_state['model_var'] = []
 
+if 'model_params' not in st.session_state:
+    st.session_state['model_params'] = {}
+
+if 'tracked_jobs' not in st.session_state:
+    st.session_state['tracked_jobs'] = []
+
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+
 # Jihoon: initialize the app and load up all of the inputs
 initialize()
 
+# the saved models stay pinned in the artifact store while the session is open
+artifact_store(st.session_state.target_folder).touch(
+    st.session_state['session_id'], st.session_state['models'])
+
 model_name = []
 baseline_model = []
 hor_num = 0
@@ -87,6 +94,10 @@ api_key = st.sidebar.text_input(
 
 owner = st.sidebar.text_input('Project Owner', value="justinshultz")
 project = st.sidebar.text_input('Project Name', value="hacksimbuild-2024")
+run_local = st.sidebar.checkbox(
+    'Run Studies Locally', value=False,
+    help='Run the studies on this machine instead of Pollination. This '
+    'needs lbt-recipes and Radiance to be installed.')
 
 
 
@@ -182,43 +193,16 @@ with tab1:
 
 
         #### create honeybee room
-        room = Room.from_box(
-            identifier=str(uuid4()),
-            width=room_width,
-            depth=room_depth,
-            height=room_height)
-        
-        point_origin = ladybug_geometry.geometry3d.Point3D(x=room_width/2, y=room_depth/2 ,z=0)
-        
-        room.rotate_xy(-1*room_orient,point_origin)
-
-        grid = SensorGrid.from_mesh3d(str(uuid4()), room.generate_grid(x_dim=2, offset=2.5))
-        faces: Face = room.faces[1]
-
-        faces.apertures_by_ratio(wwr)
-        apertures: Aperture = faces.apertures[0]
-
-
-        aperture_height = (apertures.max - apertures.min).z
-        aperture_width = (apertures.max.x - apertures.min.x)
-
-
-        if horizontal:
-            apertures.louvers_by_distance_between(distance=aperture_height/hor_num, depth=hor_depth, base_name='shade_hor',contour_vector=ladybug_geometry.geometry2d.Vector2D(0, 1))
-        if vertical:
-            apertures.louvers_by_distance_between(distance=aperture_width/vert_num, depth=vert_depth, contour_vector=ladybug_geometry.geometry2d.Vector2D(1, 0), base_name='shade_vert')
-
-
-        simple_model = Model.from_objects(
-            identifier=f'model_{room_width}_{room_depth}_{room_height}_{wwr}_{room_orient}_{hor_depth}_{hor_num}_{vert_depth}_{vert_num}',
-            objects=[room],
+        room_params = dict(
+            width=room_width, depth=room_depth, height=room_height,
+            orientation=room_orient, wwr=wwr,
+            hor_num=hor_num, hor_depth=hor_depth,
+            vert_num=vert_num, vert_depth=vert_depth,
             units=units)
-        
-        # st.write(simple_model)
-        simple_model._properties._radiance = ModelRadianceProperties(simple_model, [grid])
-
-        model_path = simple_model.to_hbjson(name=simple_model.identifier, folder='data')
-        vtk_path = pathlib.Path('data', f'{simple_model.identifier}.vtkjs')
+        if room_params != st.session_state.room_params:
+            st.session_state.room_params = room_params
+            st.session_state.sql_results = None  # reset to show the new estimate
+        simple_model = geometry_cache(st.session_state.target_folder).model(**room_params)
 
 
         if model_name in st.session_state['model_names']:
@@ -227,6 +211,7 @@ with tab1:
                 if over_button:
                     if len(model_name) > 0:
                         st.session_state['model_names'].append(model_name)
+                        st.session_state['model_params'][model_name] = dict(room_params)
                         # st.write(st.session_state['model_names'])
 
                         # st.write(model_path)
@@ -257,7 +242,11 @@ with tab1:
 
                         # st.write(model_path)
 
+                        model_path = geometry_cache(st.session_state.target_folder).hbjson(simple_model)
                         st.session_state['models'].append(model_path)
+                        artifact_store(st.session_state.target_folder).pin(
+                            model_path, st.session_state['session_id'])
+                        st.session_state['model_params'][model_name] = dict(room_params)
                         # st.write(st.session_state['models'])
 
                         st.session_state['model_var'].append({
@@ -284,14 +273,14 @@ with tab1:
         if in_cool_cop != st.session_state.cool_cop:
             st.session_state.cool_cop = in_cool_cop
 
-    if not vtk_path.is_file():
-        VTKModel.from_hbjson(model_path, SensorGridOptions.Sensors).to_vtkjs(
-            folder='data', name=simple_model.identifier)
+    vtk_content = geometry_cache(st.session_state.target_folder).vtkjs(simple_model)
 
     with col2_con:
+        # a fixed key keeps the same viewer mounted across changes to the room
+        # such that only the new content is sent to it instead of a new viewer
         st_vtkjs(
-            content=vtk_path.read_bytes(),
-            key=simple_model.identifier, subscribe=False
+            content=vtk_content,
+            key='room_preview', subscribe=False
         )
         
         # Jihoon: get the inputs that only affect the display and do not require re-simulation
@@ -314,31 +303,45 @@ with tab1:
             clear_models = col3_body2.button('X CLEAR')
 
             if clear_models:
+                for mod in st.session_state['models']:
+                    artifact_store(st.session_state.target_folder).unpin(
+                        mod, st.session_state['session_id'])
                 st.session_state['model_names']=[]
+                st.session_state['models']=[]
+                st.session_state['model_var']=[]
+                st.session_state['model_params']={}
 
             baseline_model = col3_body1.radio('Select Baseline Model:', options=st.session_state['model_names'])
             st.write(baseline_model)
 
+            # compare all of the saved models that were simulated against the baseline
+            if st.session_state.epw_path and st.session_state.ddy_path:
+                model_params = st.session_state['model_params']
+                comp_cache = comparison_cache(st.session_state.target_folder)
+                run_ids = comp_cache.run_ids(
+                    list(model_params.values()), st.session_state.epw_path,
+                    st.session_state.ddy_path)
+                comparison = comp_cache.compare(
+                    results_store(st.session_state.target_folder),
+                    list(model_params.keys()), run_ids, baseline_model)
+                if comparison is not None:
+                    table = comparison.table()[['Model', 'Rank', 'Total', 'Savings (%)']]
+                    st.dataframe(table.set_index('Model'))
+                if comparison is None or comparison.missing:
+                    st.caption('Run the energy simulation of each saved model to '
+                               'compare it to the baseline.')
+
         with st.expander('5 - Project Location', expanded=False):
             url = "https://www.ladybug.tools/epwmap/"
             st.write("Launch [EPW Map](%s)" % url)
             epw_url = st.text_input('EPW URL')
 
-            files = glob.glob('data/epw/*')
-            for f in files:
-                os.remove(f)
-
-            dload.save_unzip(epw_url, 'data/epw/', delete_after=True,)
-
-
-            
-            for file_name in os.listdir('data/epw/'):
-                if file_name.endswith(".epw"):
-                    epw_urlfile = 'data/epw/' + file_name
-
-                    epw_filepath = epw_urlfile
-            
+            if epw_url:
+                try:
+                    epw_filepath = download_cache(st.session_state.target_folder).epw_path(epw_url)
                     st.write(epw_filepath)
+                except (OSError, ValueError) as e:
+                    st.error('Failed to download the EPW: {}'.format(e))
 
 
 
@@ -346,19 +349,14 @@ with tab1:
             epw_upload =  st.file_uploader("EPW File", type=['epw'], key='epw_upload', accept_multiple_files=False)
             # st.write(epw_upload)
 
-            if epw_upload:
-                epw_filepath = pathlib.Path(f'./data/{epw_upload.name}')
+            if epw_upload:  # only written again if the upload changed
+                epw_filepath = write_upload(epw_upload, './data')
                 # st.write(epw_filepath)
-                epw_filepath.parent.mkdir(parents=True, exist_ok=True)
-                epw_filepath.write_bytes(epw_data.read())
 
             if epw_filepath:
-                ddy_file = epw_filepath.as_posix().replace('.epw', '.ddy')
-                epw_data = EPW(epw_filepath)
-                epw_data.to_ddy(ddy_file)
-                ddy_path = pathlib.Path(ddy_file)
-                st.session_state.epw_path = epw_filepath
-                st.session_state.ddy_path = ddy_path
+                epw_data = weather_cache(st.session_state.target_folder).get(epw_filepath)
+                st.session_state.epw_path = pathlib.Path(epw_data.epw_path)
+                st.session_state.ddy_path = pathlib.Path(epw_data.ddy_path)
 
         # st.write(epw_data)
         if epw_data != 0:
@@ -376,28 +374,41 @@ with tab1:
             # epw_file.write_bytes(epw_data.read())
 
             # epw_obj = EPW(epw_file)
-            wea_obj = Wea.from_epw_file(epw_filepath)
-            wea_file = wea_obj.write(f'./data/weather_file.wea')
+            wea_file = epw_data.wea_path
             # st.write(wea_file)
             # .to_wea(file_path=epw_file)
 
             if run_simulation:
                 job_id = None
 
-                recipe = Recipe(
+                # the local backend mirrors the interface of the Pollination interactors
+                if run_local:
+                    job_client = local_client(st.session_state.target_folder)
+                    recipe_type, new_job_type, job_type = LocalRecipe, LocalNewJob, LocalJob
+                else:
+                    job_client = api_client
+                    recipe_type, new_job_type, job_type = Recipe, NewJob, Job
+
+                recipe = recipe_type(
                     owner = 'ladybug-tools',
                     name = 'annual-daylight',
                     tag = 'latest', 
-                    client = api_client
+                    client = job_client
                     )
                 
-                new_job = NewJob(
+                new_job = new_job_type(
                     owner=owner, 
                     project=project, 
                     recipe=recipe, 
                     name=study_name,
-                    client=api_client)
-                wea_project_path = new_job.upload_artifact(pathlib.Path(wea_file), 'streamlit-job')
+                    client=job_client)
+                # files that were uploaded to the project before are not uploaded again
+                upload_bar = st.progress(0.0, text='Uploading study files...')
+                wea_project_path, *model_project_paths = artifact_uploader(st.session_state.target_folder).upload(
+                    new_job, [wea_file] + st.session_state['models'], 'streamlit-job',
+                    host=getattr(job_client, 'host', ''),
+                    progress=lambda done, total: upload_bar.progress(
+                        done / total, text=f'Uploaded {done} of {total} study files'))
                 
                 recipe_inputs = {
                     'wea': wea_project_path
@@ -406,8 +417,7 @@ with tab1:
                 index = 0
                 for mod in st.session_state['models']:
                     # st.write(mod)
-                    model_project_path = new_job.upload_artifact(
-                        pathlib.Path(mod), 'streamlit-job')
+                    model_project_path = model_project_paths[index]
                     
                     inputs = dict(recipe_inputs)
 
@@ -442,22 +452,15 @@ with tab1:
 
                 if job_id is not None and owner is not None and project is not None:
 
-                    job = Job(owner, project, job_id, client=api_client)
+                    job = job_type(owner, project, job_id, client=job_client)
+                    st.session_state['tracked_jobs'].append(
+                        job_tracker().track(job, host=getattr(job_client, 'host', '')))
 
-                    st.write(
-                        f'Checkout your job [here](https://app.pollination.cloud/{owner}/projects/{project}/jobs/{job_id})')
-
-                    if job.status.status in [
-                            JobStatusEnum.pre_processing,
-                            JobStatusEnum.running,
-                            JobStatusEnum.created,
-                            JobStatusEnum.unknown]:
-                        with st.spinner(text="Simulation in Progres..."):
-                            st.warning(f'Simulation is {job.status.status.value}...')
-                            # st_autorefresh(interval=2000, limit=100)
-
-                    elif job.status.status in [JobStatusEnum.failed, JobStatusEnum.cancelled]:
-                        st.warning(f'Simulation is {job.status.status.value}')
+                    if run_local:
+                        st.write(f'Your job is running locally in `{job.folder}`')
+                    else:
+                        st.write(
+                            f'Checkout your job [here](https://app.pollination.cloud/{owner}/projects/{project}/jobs/{job_id})')
                     # else:
                     #     job.runs_dataframe.parameters
                     #     res_model_path = view_results(
@@ -466,6 +469,25 @@ with tab1:
                     #         content=pathlib.Path(res_model_path).read_bytes(), key='results',
                     #         subscribe=False
                     #     )
+
+            # job statuses are checked in the background once for all sessions
+            tracker = job_tracker()
+            for job_key in st.session_state['tracked_jobs']:
+                job_status = tracker.status(job_key)
+                if job_status is None:
+                    continue
+                if job_status.status in [
+                        JobStatusEnum.pre_processing,
+                        JobStatusEnum.running,
+                        JobStatusEnum.created,
+                        JobStatusEnum.unknown]:
+                    with st.spinner(text="Simulation in Progres..."):
+                        st.warning(f'Simulation {job_key[-1][:8]} is {job_status.status.value}...')
+
+                elif job_status.status in [JobStatusEnum.failed, JobStatusEnum.cancelled]:
+                    st.warning(f'Simulation {job_key[-1][:8]} is {job_status.status.value}')
+            if tracker.active(st.session_state['tracked_jobs']):
+                st_autorefresh(interval=5000, key='job_status_refresh')
     
 
 
@@ -477,7 +499,8 @@ with tab1:
     run_energy_simulation(
         st.session_state.target_folder,
         st.session_state.hb_model,
-        st.session_state.epw_path, st.session_state.ddy_path, st.session_state.north
+        st.session_state.epw_path, st.session_state.ddy_path, st.session_state.north,
+        room_params
     )
 
     # create the resulting charts
@@ -486,6 +509,16 @@ with tab1:
         st.session_state.heat_cop, st.session_state.cool_cop,
         st.session_state.ip_units, st.session_state.normalize
     )
+    display_hourly_results(
+        out_container, st.session_state.sql_results,
+        st.session_state.heat_cop, st.session_state.cool_cop, st.session_state.ip_units
+    )
+
+    # Run a parametric batch of variants around the current room
+    run_batch_simulation(
+        st.container(), st.session_state.target_folder, room_params,
+        st.session_state.epw_path, st.session_state.ddy_path
+    )
 
 with tab2:
     if baseline_model:
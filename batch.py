@@ -0,0 +1,204 @@
+"""Functions for simulating parametric batches of Room Creation variants."""
+import math
+import itertools
+from pathlib import Path
+from concurrent.futures import as_completed
+
+import pandas as pd
+import streamlit as st
+
+from room_geometry import build_room_model
+from scheduler import clean_run_directory, run_directory, submit
+from simulation import energy_idf_string, simulate_model, simulation_cache, \
+    simulation_key
+from results_store import results_store
+from surrogate import surrogate_model
+from weather import weather_cache
+
+# Room Creation inputs that can be varied in a batch with their label, min, max and step
+BATCH_PARAMETERS = {
+    'width': ('Room Width', 5, 50, 5),
+    'depth': ('Room Depth', 5, 50, 5),
+    'height': ('Room Height', 10, 30, 5),
+    'orientation': ('Room Orientation', 0, 355, 15),
+    'wwr': ('WWR', 0.1, 0.9, 0.1),
+    'hor_num': ('Number of Overhangs', 0, 5, 1),
+    'hor_depth': ('Overhang Depth', 0.0, 6.0, 0.5),
+    'vert_num': ('Number of Fins', 0, 5, 1),
+    'vert_depth': ('Fin Depth', 0.0, 6.0, 0.5)
+}
+# Maximum number of variants in a batch, which keeps a small step from queuing
+# more simulations than the workers could ever finish
+MAX_BATCH_VARIANTS = 500
+
+
+def parameter_range(start, stop, step):
+    """Get a list of values from a start to a stop value (inclusive) with a step.
+
+    Args:
+        start: Number for the first value of the range.
+        stop: Number for the last value of the range.
+        step: Number for the increment between values of the range.
+    """
+    if step <= 0 or stop < start:
+        return [start]
+    count = int(round((stop - start) / step, 6)) + 1
+    return [round(start + i * step, 6) for i in range(count)]
+
+
+def variant_count(ranges):
+    """Get the number of variants of a set of ranges without creating them.
+
+    Args:
+        ranges: A dictionary where each key is the name of a room input and each
+            value is a list of the values to be used for that input.
+    """
+    return math.prod(len(values) for values in ranges.values())
+
+
+def batch_variants(base_params, ranges):
+    """Get the room inputs of every combination of values in a set of ranges.
+
+    Args:
+        base_params: A dictionary of room inputs for build_room_model, which will
+            be used for all of the inputs that are not varied.
+        ranges: A dictionary where each key is the name of a room input and each
+            value is a list of the values to be used for that input.
+
+    Returns:
+        A generator of dictionaries of room inputs, one for each variant.
+    """
+    names = list(ranges.keys())
+    for values in itertools.product(*ranges.values()):
+        params = dict(base_params)
+        params.update(zip(names, values))
+        yield params
+
+
+def result_row(params, sql_results):
+    """Get a row for the results table from the inputs and results of a variant.
+
+    Args:
+        params: A dictionary of the room inputs of the variant.
+        sql_results: A dictionary of results output from load_sql_data.
+    """
+    row = {name: params[name] for name in BATCH_PARAMETERS}
+    for data in sql_results['load_terms']:
+        row[data.header.metadata['type']] = data.total
+    row['Total'] = sum(data.total for data in sql_results['load_terms'])
+    return row
+
+
+def run_batch(target_folder, variants, epw_path, ddy_path):
+    """Simulate a list of room variants in parallel and yield results as they finish.
+
+    Variants that were already simulated are taken from the simulation cache and
+    all others are submitted together to the pool of simulation workers. The
+    results of every variant are added to the results store and the surrogate model.
+    A variant that fails does not stop the others and any simulations that have
+    not started are cancelled if the generator is closed before it finishes.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        variants: An iterable of dictionaries of room inputs for build_room_model.
+        epw_path: Path to an EPW file to be used in the simulations.
+        ddy_path: Path to a DDY file to be used in the simulations.
+
+    Returns:
+        A generator of (params, sql_results) tuples in the order that the
+        simulations finish. sql_results is None if a simulation failed to
+        produce results.
+    """
+    sim_cache = simulation_cache(target_folder)
+    surrogate = surrogate_model(target_folder)
+    store = results_store(target_folder)
+    weather = weather_cache(target_folder).get(epw_path)
+    futures = {}
+    try:
+        for params in variants:
+            hb_model = build_room_model(**params)
+            idf_str = energy_idf_string(hb_model, ddy_path, params['orientation'])
+            sim_key = simulation_key(idf_str, epw_path, ddy_path)
+            sql_results = sim_cache.get(sim_key)
+            if sql_results is not None:
+                store.add(sim_key, sql_results, params, weather.key, weather.location)
+                surrogate.add_sample(params, weather.key, sql_results)
+                yield params, sql_results
+                continue
+            directory = run_directory(target_folder)
+            future = submit(
+                simulate_model, directory, idf_str,
+                Path(epw_path).as_posix(), hb_model.to_dict())
+            futures[future] = (params, sim_key, directory)
+
+        for future in as_completed(futures):
+            params, sim_key, directory = futures[future]
+            try:
+                sql_results = future.result()
+                clean_run_directory(directory)
+            except Exception as e:  # EnergyPlus failed; keep going with the others
+                print('Batch variant {} failed: {}'.format(params, e))
+                clean_run_directory(directory, keep_log=True)
+                sql_results = None
+            if sql_results is not None:
+                sim_cache.set(sim_key, sql_results)
+                store.add(sim_key, sql_results, params, weather.key, weather.location)
+                surrogate.add_sample(params, weather.key, sql_results)
+            yield params, sql_results
+    finally:  # do not leave queued simulations running when the batch is abandoned
+        for future, (_, _, directory) in futures.items():
+            if future.cancel():
+                clean_run_directory(directory)
+            else:  # runs that already started are cleaned up once they finish
+                future.add_done_callback(lambda f, d=directory: clean_run_directory(
+                    d, keep_log=f.exception() is not None))
+
+
+def run_batch_simulation(container, target_folder, base_params, epw_path, ddy_path):
+    """Get the ranges of a parametric batch from the App and run it on button press.
+
+    Args:
+        container: The streamlit container to which the batch inputs will be added.
+        target_folder: Text for the target folder out of which simulations run.
+        base_params: A dictionary of the current room inputs, which will be used
+            for all of the inputs that are not varied.
+        epw_path: Path to an EPW file to be used in the simulations.
+        ddy_path: Path to a DDY file to be used in the simulations.
+    """
+    with container.expander('Parametric Batch', expanded=False):
+        sweep = st.multiselect(
+            'Inputs to Vary', options=list(BATCH_PARAMETERS.keys()),
+            format_func=lambda name: BATCH_PARAMETERS[name][0])
+        ranges = {}
+        for name in sweep:
+            label, low, high, step = BATCH_PARAMETERS[name]
+            col1, col2, col3 = st.columns(3)
+            start = col1.number_input('{} From'.format(label), value=low)
+            stop = col2.number_input('{} To'.format(label), value=high)
+            step = col3.number_input('{} Step'.format(label), value=step)
+            ranges[name] = parameter_range(start, stop, step)
+        if not sweep or not epw_path or not ddy_path:
+            st.info('Select inputs to vary and add a Project EPW file to run a batch.')
+            return
+        count = variant_count(ranges)
+        if count > MAX_BATCH_VARIANTS:
+            st.warning('The batch has {:,} variants, which is more than the limit of '
+                       '{}. Increase the steps or vary fewer inputs.'.format(
+                           count, MAX_BATCH_VARIANTS))
+            return
+
+        if st.button('Run Batch of {} Variants'.format(count)):
+            progress = st.progress(0.0)
+            table = st.empty()
+            rows, failed = [], 0
+            variants = batch_variants(base_params, ranges)
+            for i, (params, sql_results) in enumerate(
+                    run_batch(target_folder, variants, epw_path, ddy_path)):
+                if sql_results is not None:
+                    rows.append(result_row(params, sql_results))
+                    table.dataframe(pd.DataFrame(rows))
+                else:
+                    failed += 1
+                progress.progress((i + 1) / count)
+            if failed != 0:
+                st.caption('{} of {} variants failed to simulate.'.format(failed, count))
@@ -0,0 +1,415 @@
+"""Content-addressed caches used to avoid repeating expensive work in the app."""
+import os
+import time
+import pickle
+import shutil
+import hashlib
+import threading
+
+
+def content_hash(*items):
+    """Get a SHA-256 hex digest for a sequence of text or bytes.
+
+    Args:
+        items: Any number of strings or bytes to be hashed together. Each item
+            is separated from the next one so that ('ab', 'c') and ('a', 'bc')
+            do not produce the same hash. None values are allowed and hashed
+            as an empty item.
+    """
+    sha = hashlib.sha256()
+    for item in items:
+        if item is not None:
+            sha.update(item.encode('utf-8') if isinstance(item, str) else item)
+        sha.update(b'\x00')
+    return sha.hexdigest()
+
+
+def file_hash(file_path, chunk_size=1048576):
+    """Get a SHA-256 hex digest of the contents of a file.
+
+    Args:
+        file_path: Path to the file to be hashed.
+        chunk_size: Number of bytes to read at a time. (Default: 1 MB).
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class DiskCache(object):
+    """A size-bounded, least-recently-used cache of pickled objects on disk.
+
+    Each entry is stored as its own file in the cache folder and the modified
+    time of the file is used to track when it was last used. This way, the cache
+    survives restarts of the app and the least recently used entries are the
+    first to be removed once the max_size is exceeded.
+
+    Args:
+        folder: Path to a folder where the cached entries will be written.
+            It will be created if it does not exist.
+        max_size: Integer for the maximum number of bytes that all entries of
+            the cache can occupy on disk. (Default: 500 MB).
+        on_evict: An optional function that is called with the key of each entry
+            that is removed from the cache, which can be used to remove any files
+            that belong to the entry. (Default: None).
+
+    Properties:
+        * folder
+        * max_size
+        * size
+        * hits
+        * misses
+    """
+    EXTENSION = '.pkl'
+
+    def __init__(self, folder, max_size=500000000, on_evict=None):
+        self._folder = os.path.abspath(str(folder))
+        if not os.path.isdir(self._folder):
+            os.makedirs(self._folder)
+        self._max_size = int(max_size)
+        self._on_evict = on_evict
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._size = sum(os.path.getsize(fp) for _, fp in self._entries())
+
+    @property
+    def folder(self):
+        """Get the path to the folder where the cached entries are written."""
+        return self._folder
+
+    @property
+    def max_size(self):
+        """Get the maximum number of bytes the cached entries can occupy."""
+        return self._max_size
+
+    @property
+    def size(self):
+        """Get the number of bytes currently occupied by the cached entries."""
+        return self._size
+
+    @property
+    def hits(self):
+        """Get the number of lookups that found an entry in the cache."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of lookups that did not find an entry in the cache."""
+        return self._misses
+
+    def get(self, key, default=None):
+        """Get a cached object, returning the default if it is not in the cache.
+
+        Args:
+            key: Text for the key of the cached object (typically a content hash).
+            default: The value to be returned if the key is not in the cache.
+        """
+        entry = self._entry_path(key)
+        with self._lock:
+            try:
+                with open(entry, 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(entry)  # mark the entry as the most recently used
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self._misses += 1
+                return default
+            self._hits += 1
+            return value
+
+    def set(self, key, value):
+        """Write an object to the cache and remove any least recently used entries.
+
+        Args:
+            key: Text for the key of the cached object (typically a content hash).
+            value: Any picklable object to be cached.
+        """
+        entry = self._entry_path(key)
+        temp_entry = '{}.{}.tmp'.format(entry, os.getpid())
+        with self._lock:
+            with open(temp_entry, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.isfile(entry):
+                self._size -= os.path.getsize(entry)
+            os.replace(temp_entry, entry)  # atomic so readers never see partial data
+            self._size += os.path.getsize(entry)
+            if self._size > self._max_size:
+                self._evict()
+
+    def clear(self):
+        """Remove all entries from the cache and reset the hit and miss counters."""
+        with self._lock:
+            for key, entry in self._entries():
+                os.remove(entry)
+                if self._on_evict is not None:
+                    self._on_evict(key)
+            self._size, self._hits, self._misses = 0, 0, 0
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the cache."""
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries()),
+            'size': self._size,
+            'max_size': self._max_size,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups != 0 else 0
+        }
+
+    def _entry_path(self, key):
+        """Get the path to the file of a given cache key."""
+        return os.path.join(self._folder, key + self.EXTENSION)
+
+    def _entries(self):
+        """Get a list of (key, path) tuples for all entries in the cache folder."""
+        return [
+            (f[:-len(self.EXTENSION)], os.path.join(self._folder, f))
+            for f in os.listdir(self._folder) if f.endswith(self.EXTENSION)
+        ]
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits in max_size."""
+        entries = sorted(self._entries(), key=lambda e: os.path.getmtime(e[1]))
+        for key, entry in entries:
+            if self._size <= self._max_size:
+                break
+            self._size -= os.path.getsize(entry)
+            os.remove(entry)
+            if self._on_evict is not None:
+                self._on_evict(key)
+
+    def __contains__(self, key):
+        return os.path.isfile(self._entry_path(key))
+
+
+class ArtifactStore(object):
+    """A size-bounded, least-recently-used store of files generated by the app.
+
+    Artifacts are files like HBJSON and vtkjs that are addressed by a name
+    relative to the store folder. The modified time of each file is used to
+    track when it was last used and the least recently used files are removed
+    once the store exceeds max_size. Files that are pinned are never removed,
+    which is used to keep the models that sessions have saved for a study.
+    Each pin belongs to an owner like an app session, and the pins of owners
+    that have not been seen for pin_ttl seconds are dropped such that closed
+    sessions do not keep their artifacts forever.
+
+    Args:
+        folder: Path to the folder where the artifacts are written.
+            It will be created if it does not exist.
+        max_size: Integer for the maximum number of bytes that all artifacts of
+            the store can occupy on disk. (Default: 1 GB).
+        pin_ttl: Number of seconds after which the pins of an owner that has not
+            been seen are dropped. (Default: 3600, one hour).
+
+    Properties:
+        * folder
+        * max_size
+        * size
+        * hits
+        * misses
+        * pinned
+    """
+
+    def __init__(self, folder, max_size=1000000000, pin_ttl=3600):
+        self._folder = os.path.abspath(str(folder))
+        if not os.path.isdir(self._folder):
+            os.makedirs(self._folder)
+        self._max_size = int(max_size)
+        self._pin_ttl = pin_ttl
+        self._lock = threading.Lock()
+        self._pins = {}  # owner to a dictionary of artifact path to pin count
+        self._seen = {}  # owner to the time that it was last seen
+        self._hits = 0
+        self._misses = 0
+        self._size = sum(os.path.getsize(fp) for fp in self._entries())
+
+    @property
+    def folder(self):
+        """Get the path to the folder where the artifacts are written."""
+        return self._folder
+
+    @property
+    def max_size(self):
+        """Get the maximum number of bytes the artifacts can occupy."""
+        return self._max_size
+
+    @property
+    def size(self):
+        """Get the number of bytes currently occupied by the artifacts."""
+        return self._size
+
+    @property
+    def hits(self):
+        """Get the number of lookups that found an artifact in the store."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of lookups that did not find an artifact in the store."""
+        return self._misses
+
+    @property
+    def pinned(self):
+        """Get a list of the paths to the artifacts that are pinned."""
+        with self._lock:
+            return sorted(self._pinned())
+
+    def path(self, name):
+        """Get the full path of an artifact whether it exists or not.
+
+        Args:
+            name: Text for the name of the artifact relative to the store folder
+                (eg. "feet/model.hbjson").
+        """
+        return os.path.join(self._folder, os.path.normpath(name))
+
+    def get(self, name):
+        """Get the full path of an artifact, returning None if it is not in the store.
+
+        Args:
+            name: Text for the name of the artifact relative to the store folder.
+        """
+        artifact = self.path(name)
+        with self._lock:
+            try:
+                os.utime(artifact)  # mark the artifact as the most recently used
+            except OSError:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return artifact
+
+    def put(self, name, write_function):
+        """Write an artifact to the store and remove any least recently used artifacts.
+
+        Args:
+            name: Text for the name of the artifact relative to the store folder.
+            write_function: A function that accepts the path to an empty, temporary
+                folder, writes the artifact into it, and returns the path to the
+                written file. The file is then moved into the store such that
+                readers never see a partially-written artifact.
+
+        Returns:
+            The full path to the artifact in the store.
+        """
+        artifact = self.path(name)
+        temp_folder = '{}.{}.{}.tmp'.format(
+            artifact, os.getpid(), threading.get_ident())
+        os.makedirs(temp_folder)
+        try:
+            written = write_function(temp_folder)
+            with self._lock:
+                if os.path.isfile(artifact):
+                    self._size -= os.path.getsize(artifact)
+                os.replace(written, artifact)
+                self._size += os.path.getsize(artifact)
+                if self._size > self._max_size:
+                    self._evict(keep=artifact)
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+        return artifact
+
+    def pin(self, artifact, owner):
+        """Pin an artifact such that it is not removed by eviction.
+
+        Pins are counted so an artifact that was pinned several times stays
+        pinned until all of its pins have been removed.
+
+        Args:
+            artifact: Text for the full path to an artifact in the store.
+            owner: Text for the owner of the pin, like the ID of an app session.
+        """
+        artifact = os.path.abspath(str(artifact))
+        with self._lock:
+            pins = self._pins.setdefault(owner, {})
+            pins[artifact] = pins.get(artifact, 0) + 1
+            self._seen[owner] = time.time()
+
+    def unpin(self, artifact, owner):
+        """Remove one pin of an owner from an artifact such that it can be evicted again.
+
+        Args:
+            artifact: Text for the full path to an artifact in the store.
+            owner: Text for the owner of the pin, like the ID of an app session.
+        """
+        artifact = os.path.abspath(str(artifact))
+        with self._lock:
+            pins = self._pins.get(owner, {})
+            count = pins.get(artifact, 0) - 1
+            if count > 0:
+                pins[artifact] = count
+            else:
+                pins.pop(artifact, None)
+
+    def touch(self, owner, artifacts=None):
+        """Mark an owner as seen such that its pins do not expire.
+
+        Args:
+            owner: Text for the owner of the pins, like the ID of an app session.
+            artifacts: An optional list of the full paths to all of the artifacts
+                that the owner has pinned, which replaces its pins. This restores
+                the pins of an owner that was not seen for longer than pin_ttl.
+        """
+        with self._lock:
+            if artifacts is not None:
+                pins = {}
+                for artifact in artifacts:
+                    artifact = os.path.abspath(str(artifact))
+                    pins[artifact] = pins.get(artifact, 0) + 1
+                self._pins[owner] = pins
+            if owner in self._pins:
+                self._seen[owner] = time.time()
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the store."""
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries()),
+            'size': self._size,
+            'max_size': self._max_size,
+            'pinned': len(self.pinned),
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups != 0 else 0
+        }
+
+    def _entries(self):
+        """Get a list of the paths to all artifacts in the store folder."""
+        entries = []
+        for root, _, files in os.walk(self._folder):
+            rel_folders = os.path.relpath(root, self._folder).split(os.sep)
+            if not any(fold.endswith('.tmp') for fold in rel_folders):
+                entries.extend(os.path.join(root, f) for f in files)
+        return entries
+
+    def _pinned(self):
+        """Get a set of the pinned artifacts after dropping the pins of absent owners."""
+        cutoff = time.time() - self._pin_ttl
+        for owner in [o for o, seen in self._seen.items() if seen < cutoff]:
+            del self._seen[owner]
+            self._pins.pop(owner, None)
+        return {artifact for pins in self._pins.values() for artifact in pins}
+
+    def _evict(self, keep=None):
+        """Remove the least recently used artifacts until the store fits in max_size.
+
+        Args:
+            keep: Optional path to an artifact that should not be removed, which
+                is typically the artifact that was just written.
+        """
+        pinned = self._pinned()
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        for artifact in entries:
+            if self._size <= self._max_size:
+                break
+            if artifact in pinned or artifact == keep:
+                continue
+            self._size -= os.path.getsize(artifact)
+            os.remove(artifact)
+
+    def __repr__(self):
+        return 'ArtifactStore: {}'.format(self._folder)
@@ -0,0 +1,291 @@
+"""Comparison of the energy use of saved analysis models against a baseline model."""
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from cache import content_hash, file_hash
+from room_geometry import geometry_cache, room_key
+from simulation import energy_idf_string, simulation_key
+from weather import weather_cache
+
+# number of comparisons kept in memory
+COMPARISON_CACHE_SIZE = 32
+
+
+@st.cache_resource
+def comparison_cache(target_folder):
+    """Get the cache of model comparisons shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+    """
+    return ComparisonCache(target_folder)
+
+
+class ModelComparison(object):
+    """The monthly energy use of a set of models compared against a baseline model.
+
+    All values are computed at once with array operations over the models rather
+    than one model at a time. End uses and balance terms that a model does not
+    have are counted as zero.
+
+    Args:
+        names: A list of the names of the models that have results.
+        baseline: Integer for the index of the baseline model in the names.
+        end_uses: A list of the names of the end uses of the eui.
+        balance_terms: A list of the names of the terms of the balance.
+        eui: An array of the monthly EUI of each end use in kWh/m2 with the
+            shape (models, 12, end uses).
+        balance: An array of the monthly EUI of each balance term in kWh/m2
+            with the shape (models, 12, balance terms).
+        missing: A list of the names of the models that do not have results.
+
+    Properties:
+        * names
+        * baseline
+        * end_uses
+        * balance_terms
+        * eui
+        * balance
+        * missing
+        * annual
+        * total
+        * delta
+        * balance_delta
+        * savings
+        * total_savings
+        * rank
+    """
+
+    def __init__(self, names, baseline, end_uses, balance_terms, eui, balance,
+                 missing=()):
+        self._names = list(names)
+        self._baseline = baseline
+        self._end_uses = list(end_uses)
+        self._balance_terms = list(balance_terms)
+        self._eui = np.nan_to_num(np.asarray(eui, dtype=np.float64))
+        self._balance = np.nan_to_num(np.asarray(balance, dtype=np.float64))
+        self._missing = list(missing)
+
+        # compare every model to the baseline with broadcast operations
+        self._annual = self._eui.sum(axis=1)
+        self._total = self._annual.sum(axis=1)
+        self._delta = self._eui - self._eui[baseline]
+        self._balance_delta = self._balance - self._balance[baseline]
+        base_annual, base_total = self._annual[baseline], self._total[baseline]
+        self._savings = np.divide(
+            (base_annual - self._annual) * 100, base_annual,
+            out=np.zeros_like(self._annual), where=base_annual != 0)
+        self._total_savings = (base_total - self._total) * 100 / base_total \
+            if base_total != 0 else np.zeros_like(self._total)
+        self._rank = np.empty(len(self._total), dtype=int)
+        self._rank[np.argsort(self._total, kind='stable')] = \
+            np.arange(1, len(self._total) + 1)
+
+    @property
+    def names(self):
+        """Get a list of the names of the models that have results."""
+        return self._names
+
+    @property
+    def baseline(self):
+        """Get the index of the baseline model."""
+        return self._baseline
+
+    @property
+    def end_uses(self):
+        """Get a list of the names of the end uses."""
+        return self._end_uses
+
+    @property
+    def balance_terms(self):
+        """Get a list of the names of the balance terms."""
+        return self._balance_terms
+
+    @property
+    def eui(self):
+        """Get an array of the monthly EUI with the shape (models, 12, end uses)."""
+        return self._eui
+
+    @property
+    def balance(self):
+        """Get an array of the monthly balance with the shape (models, 12, terms)."""
+        return self._balance
+
+    @property
+    def missing(self):
+        """Get a list of the names of the models that do not have results."""
+        return self._missing
+
+    @property
+    def annual(self):
+        """Get an array of the annual EUI with the shape (models, end uses)."""
+        return self._annual
+
+    @property
+    def total(self):
+        """Get an array of the total annual EUI of each model."""
+        return self._total
+
+    @property
+    def delta(self):
+        """Get an array of the monthly EUI minus that of the baseline."""
+        return self._delta
+
+    @property
+    def balance_delta(self):
+        """Get an array of the monthly balance minus that of the baseline."""
+        return self._balance_delta
+
+    @property
+    def savings(self):
+        """Get an array of the percent of the baseline EUI saved for each end use."""
+        return self._savings
+
+    @property
+    def total_savings(self):
+        """Get an array of the percent of the total baseline EUI saved by each model."""
+        return self._total_savings
+
+    @property
+    def rank(self):
+        """Get an array of the rank of each model from 1 for the lowest total EUI."""
+        return self._rank
+
+    def table(self):
+        """Get a DataFrame with the annual EUI and savings of each model by rank."""
+        table = pd.DataFrame({'Model': self._names, 'Rank': self._rank})
+        for i, end_use in enumerate(self._end_uses):
+            table[end_use] = self._annual[:, i]
+        table['Total'] = self._total
+        table['Delta'] = self._total - self._total[self._baseline]
+        table['Savings (%)'] = self._total_savings
+        return table.sort_values('Rank').reset_index(drop=True)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return 'ModelComparison: {} models against {}'.format(
+            len(self._names), self._names[self._baseline])
+
+
+class ComparisonCache(object):
+    """Cache of the comparisons of saved analysis models against a baseline.
+
+    The results of each model are found in the results store through the key of
+    its annual simulation, which is memoized for the room inputs and weather files
+    so that the IDF of a model is only written once. Like the app and the batch
+    engine, each model is simulated with its own orientation as the north angle. Comparisons
+    are memoized for the keys of their models such that a comparison is only
+    computed again when one of its models changes or gets simulated.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        max_entries: Integer for the maximum number of comparisons that are
+            kept in memory. (Default: 32).
+
+    Properties:
+        * target_folder
+        * max_entries
+        * hits
+        * misses
+    """
+
+    def __init__(self, target_folder, max_entries=COMPARISON_CACHE_SIZE):
+        self._target_folder = target_folder
+        self._max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._run_ids = {}  # hash of the simulation inputs to the simulation key
+        self._comparisons = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def target_folder(self):
+        """Get the target folder out of which simulations run."""
+        return self._target_folder
+
+    @property
+    def max_entries(self):
+        """Get the maximum number of comparisons that are kept in memory."""
+        return self._max_entries
+
+    @property
+    def hits(self):
+        """Get the number of comparisons that were found in memory."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of comparisons that had to be computed."""
+        return self._misses
+
+    def run_ids(self, model_params, epw_path, ddy_path):
+        """Get the key of the annual simulation of each model in the results store.
+
+        Args:
+            model_params: A list of dictionaries of room inputs for build_room_model.
+                The orientation of each model is used as the north angle of
+                its simulation.
+            epw_path: Path to the EPW file of the simulations.
+            ddy_path: Path to the DDY file of the simulations.
+        """
+        weather_key = weather_cache(self._target_folder).key(epw_path)
+        ddy_key = file_hash(ddy_path)
+        run_ids = []
+        for params in model_params:
+            north = params['orientation']
+            inputs_key = content_hash(
+                room_key(**params), weather_key, ddy_key, json.dumps(float(north)))
+            run_id = self._run_ids.get(inputs_key)
+            if run_id is None:
+                hb_model = geometry_cache(self._target_folder).model(**params)
+                idf_str = energy_idf_string(hb_model, ddy_path, north)
+                run_id = self._run_ids[inputs_key] = \
+                    simulation_key(idf_str, epw_path, ddy_path)
+            run_ids.append(run_id)
+        return run_ids
+
+    def compare(self, store, names, run_ids, baseline):
+        """Compare the results of a set of models against a baseline model.
+
+        Args:
+            store: The ResultsStore with the results of the models.
+            names: A list of the names of the models.
+            run_ids: A list of the key of each model in the results store.
+            baseline: Text for the name of the baseline model.
+
+        Returns:
+            A ModelComparison of the models that have results or None if the
+            baseline model does not have results.
+        """
+        rows, eui, balance = store.gather(run_ids)
+        key = content_hash(json.dumps(
+            [list(names), list(run_ids), rows.tolist(), baseline]))
+        with self._lock:
+            comparison = self._comparisons.get(key)
+            if comparison is not None:
+                self._comparisons.move_to_end(key)
+                self._hits += 1
+                return comparison
+            self._misses += 1
+        found = [name for name, row in zip(names, rows) if row >= 0]
+        if baseline not in found:
+            return None
+        comparison = ModelComparison(  # end uses and terms are only ever appended
+            found, found.index(baseline), store.end_uses[:eui.shape[2]],
+            store.balance_terms[:balance.shape[2]], eui, balance,
+            [name for name, row in zip(names, rows) if row < 0])
+        with self._lock:
+            self._comparisons[key] = comparison
+            while len(self._comparisons) > self._max_entries:
+                self._comparisons.popitem(last=False)
+        return comparison
+
+    def __repr__(self):
+        return 'ComparisonCache: {} comparisons'.format(len(self._comparisons))
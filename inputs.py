@@ -1,15 +1,12 @@
 """Functions for initializing inputs and formatting them for simulation"""
-import os
 import uuid
 from pathlib import Path
 
 import streamlit as st
 
-from ladybug.epw import EPW
 from honeybee.model import Model
-from honeybee_vtk.model import Model as VTKModel
-
-from pollination_streamlit_viewer import viewer
+from visualize_model import generate_vtk_model
+from weather import weather_cache
 # from pollination_streamlit_io import get_hbjson
 
 
@@ -23,8 +20,8 @@ def initialize():
     # sim session
     if 'hb_model' not in st.session_state:
         st.session_state.hb_model = None
-    if 'vtk_path' not in st.session_state:
-        st.session_state.vtk_path = None
+    if 'vtk_content' not in st.session_state:
+        st.session_state.vtk_content = None
     if 'valid_report' not in st.session_state:
         st.session_state.valid_report = None
     if 'epw_path' not in st.session_state:
@@ -33,6 +30,8 @@ def initialize():
         st.session_state.ddy_path = None
     if 'north' not in st.session_state:
         st.session_state.north = None
+    if 'room_params' not in st.session_state:
+        st.session_state.room_params = None
     # output session
     if 'heat_cop' not in st.session_state:
         st.session_state.heat_cop = None
@@ -44,6 +43,10 @@ def initialize():
         st.session_state.normalize = True
     if 'sql_results' not in st.session_state:
         st.session_state.sql_results = None
+    if 'sim_job' not in st.session_state:
+        st.session_state.sim_job = None
+    if 'sim_progress' not in st.session_state:
+        st.session_state.sim_progress = None
 
 
 def new_weather_file():
@@ -59,14 +62,11 @@ def new_weather_file():
         )
         epw_path.parent.mkdir(parents=True, exist_ok=True)
         epw_path.write_bytes(epw_file.read())
-        # create a DDY file from the EPW
-        ddy_file = epw_path.as_posix().replace('.epw', '.ddy')
-        epw_obj = EPW(epw_path.as_posix())
-        epw_obj.to_ddy(ddy_file)
-        ddy_path = Path(ddy_file)
+        # get the DDY file derived from the EPW, which is only created once per EPW
+        weather_data = weather_cache(st.session_state.target_folder).get(epw_path)
         # set the session state variables
-        st.session_state.epw_path = epw_path
-        st.session_state.ddy_path = ddy_path
+        st.session_state.epw_path = Path(weather_data.epw_path)
+        st.session_state.ddy_path = Path(weather_data.ddy_path)
     else:
         st.session_state.epw_path = None
         st.session_state.ddy_path = None
@@ -85,7 +85,7 @@ def get_weather_file(column):
 def new_model():
     """Process a newly-uploaded Honeybee Model file."""
     # reset the simulation results and get the file data
-    st.session_state.vtk_path = None
+    st.session_state.vtk_content = None
     st.session_state.valid_report = None
     st.session_state.sql_results = None
     # load the model object from the file data
@@ -104,24 +104,6 @@ def new_model():
 #         st.session_state.hb_model = Model.from_dict(hbjson_data['hbjson'])
 
 
-def generate_vtk_model(hb_model: Model, container):
-    """Generate a VTK preview of an input model."""
-    if not st.session_state.vtk_path:
-        directory = os.path.join(
-            st.session_state.target_folder.as_posix(),
-            'data'#, st.session_state.user_id
-        )
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        hbjson_path = hb_model.to_hbjson(hb_model.identifier, directory)
-        vtk_model = VTKModel.from_hbjson(hbjson_path)
-        vtk_path = vtk_model.to_vtkjs(folder=directory, name=hb_model.identifier)
-        st.session_state.vtk_path = vtk_path
-    vtk_path = st.session_state.vtk_path
-    with container:
-        viewer(content=Path(vtk_path).read_bytes(), key='vtk_preview_model')
-
-
 def generate_model_validation(hb_model: Model, container):
     """Generate a Model validation report from an input model."""
     if not st.session_state.valid_report:
@@ -0,0 +1,519 @@
+"""Local job backend with the interface of the pollination_io Recipe, NewJob, Job and Run.
+
+Studies that are created through this backend run on the pool of worker processes
+of the scheduler instead of the Pollination cloud such that they can be run and
+benchmarked without network access. Every job and run is kept as a folder with a
+JSON status file so that any session of the app can follow its progress.
+"""
+import os
+import json
+import uuid
+import shutil
+import zipfile
+import pathlib
+import datetime
+from io import BytesIO
+
+import streamlit as st
+from queenbee.job.job import JobStatus, JobStatusEnum
+from queenbee.job.run import RunStatus, RunStatusEnum
+
+from scheduler import submit
+
+try:
+    from lbt_recipes.recipe import Recipe as LBTRecipe
+except ImportError:  # recipes can then only run on the Pollination cloud
+    LBTRecipe = None
+
+
+def annual_daylight(inputs, folder):
+    """Run the annual-daylight recipe of lbt-recipes on this machine.
+
+    This requires lbt-recipes and Radiance to be installed. Each run uses a single
+    Radiance worker since several runs of a job already execute in parallel.
+
+    Args:
+        inputs: A dictionary of the run inputs with full paths for the artifacts.
+            Inputs that are not inputs of the recipe, like the room dimensions
+            of a study, are ignored.
+        folder: Path to the folder in which the recipe runs.
+
+    Returns:
+        A dictionary of the path of each recipe output.
+    """
+    if LBTRecipe is None:
+        raise ImportError(
+            'lbt-recipes must be installed to run annual-daylight studies locally.')
+    recipe = LBTRecipe('annual-daylight')
+    for recipe_input in recipe.inputs:
+        if recipe_input.name in inputs:
+            recipe.input_value_by_name(recipe_input.name, inputs[recipe_input.name])
+    project_folder = recipe.run(
+        '--folder {} --workers 1'.format(folder), radiance_check=True, silent=True)
+    return {out.name: recipe.output_value_by_name(out.name, project_folder)
+            for out in recipe.outputs}
+
+
+# recipes that can run locally with the function that runs them and the names
+# of their inputs that are artifacts (files uploaded to the project folder)
+# other recipes can be added with any function importable from a module of the app
+LOCAL_RECIPES = {
+    'annual-daylight': {
+        'function': annual_daylight,
+        'artifacts': ('model', 'wea'),
+        'required': ('model', 'wea')
+    }
+}
+
+
+def _utc_now():
+    """Get the current time in UTC as ISO-formatted text."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _read_json(file_path):
+    """Read a JSON file, returning None if it does not exist yet."""
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(file_path, data):
+    """Write a JSON file atomically so that readers never see partial data."""
+    temp_path = '{}.{}.tmp'.format(file_path, uuid.uuid4().hex)
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, file_path)
+
+
+def _update_status(run_folder, **fields):
+    """Update the fields of the status file of a run."""
+    status_path = os.path.join(run_folder, 'run.json')
+    status = _read_json(status_path)
+    status.update(fields)
+    _write_json(status_path, status)
+
+
+def run_local_recipe(run_folder, function, inputs):
+    """Run a local recipe for a single run of a job.
+
+    This function is intended to be run in one of the worker processes of the
+    scheduler. The status of the run is written to its run.json file such that
+    it can be followed from any session of the app.
+
+    Args:
+        run_folder: Path to the folder of the run, which has a run.json file.
+        function: The function of a recipe in LOCAL_RECIPES.
+        inputs: A dictionary of the run inputs with full paths for the artifacts.
+
+    Returns:
+        A dictionary of the path of each output relative to the run workspace.
+    """
+    workspace = os.path.join(run_folder, 'workspace')
+    os.makedirs(workspace, exist_ok=True)
+    _update_status(run_folder, status=RunStatusEnum.running.value, started_at=_utc_now())
+    try:
+        outputs = function(inputs, workspace)
+    except Exception as e:
+        _update_status(run_folder, status=RunStatusEnum.failed.value,
+                       message=str(e), finished_at=_utc_now())
+        raise
+    outputs = {name: os.path.relpath(path, workspace)
+               for name, path in outputs.items() if path is not None}
+    _update_status(run_folder, status=RunStatusEnum.succeeded.value,
+                   outputs=outputs, finished_at=_utc_now())
+    return outputs
+
+
+@st.cache_resource
+def local_client(target_folder):
+    """Get the client of the local job backend shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    return LocalClient(os.path.join(str(target_folder), 'data', 'jobs'))
+
+
+class LocalClient(object):
+    """Stand-in for the pollination_io ApiClient that keeps projects in a local folder.
+
+    Args:
+        folder: Path to the folder in which the projects of each owner are kept.
+
+    Properties:
+        * folder
+        * host
+    """
+
+    def __init__(self, folder):
+        self._folder = folder
+
+    @property
+    def folder(self):
+        """Get the path to the folder in which the projects are kept."""
+        return self._folder
+
+    @property
+    def host(self):
+        """Get text for the host of the projects like the host of an ApiClient."""
+        return pathlib.Path(os.path.abspath(self._folder)).as_uri()
+
+    def project_folder(self, owner, project):
+        """Get the path to the folder of a project, which holds its artifacts."""
+        return os.path.join(self._folder, owner, project)
+
+    def job_folder(self, owner, project, job_id):
+        """Get the path to the folder of a job."""
+        return os.path.join(self.project_folder(owner, project), 'jobs', job_id)
+
+    def run_folder(self, owner, project, job_id, run_id):
+        """Get the path to the folder of a run of a job."""
+        return os.path.join(self.job_folder(owner, project, job_id), 'runs', run_id)
+
+    def jobs(self, owner, project):
+        """Get a list of the LocalJobs of a project with the most recent job first."""
+        jobs_folder = os.path.join(self.project_folder(owner, project), 'jobs')
+        if not os.path.isdir(jobs_folder):
+            return []
+        jobs = [LocalJob(owner, project, job_id, self) for job_id in os.listdir(jobs_folder)
+                if os.path.isfile(os.path.join(jobs_folder, job_id, 'job.json'))]
+        return sorted(jobs, key=lambda job: job.api_object['started_at'], reverse=True)
+
+    def submit_run(self, run_folder, recipe_name, inputs):
+        """Submit a run to the pool of workers.
+
+        If the worker stops before it can update the status of the run, like when
+        the worker process crashes, the status is updated once the run is done.
+
+        Args:
+            run_folder: Path to the folder of the run, which has a run.json file.
+            recipe_name: Text for the name of a recipe in LOCAL_RECIPES.
+            inputs: A dictionary of the run inputs with full paths for the artifacts.
+
+        Returns:
+            A concurrent.futures.Future for the outputs of the run.
+        """
+        future = submit(
+            run_local_recipe, run_folder, LOCAL_RECIPES[recipe_name]['function'], inputs)
+
+        def update_unfinished(done_future):
+            status = _read_json(os.path.join(run_folder, 'run.json')) or {}
+            if status.get('status') in (RunStatusEnum.failed.value,
+                                        RunStatusEnum.succeeded.value):
+                return
+            if done_future.cancelled():
+                _update_status(run_folder, status=RunStatusEnum.cancelled.value,
+                               finished_at=_utc_now())
+            elif done_future.exception() is not None:
+                _update_status(run_folder, status=RunStatusEnum.failed.value,
+                               message=str(done_future.exception()),
+                               finished_at=_utc_now())
+
+        future.add_done_callback(update_unfinished)
+        return future
+
+    def __repr__(self):
+        return 'LocalClient: {}'.format(self._folder)
+
+
+class LocalRecipe(object):
+    """A recipe that runs on the local job backend like a pollination_io Recipe.
+
+    Args:
+        owner: Text for the owner of the recipe (eg. ladybug-tools).
+        name: Text for the name of the recipe, which must be in LOCAL_RECIPES.
+        tag: Text for the version of the recipe. (Default: latest).
+        client: The LocalClient of the backend.
+
+    Properties:
+        * owner
+        * name
+        * tag
+        * source_url
+        * input_artifacts
+        * inputs_required
+    """
+
+    def __init__(self, owner, name, tag='latest', client=None):
+        if name not in LOCAL_RECIPES:
+            raise ValueError('Recipe "{}" cannot run locally. Choose from: {}'.format(
+                name, ', '.join(LOCAL_RECIPES)))
+        self.owner = owner
+        self.name = name
+        self.tag = tag
+        self._client = client
+
+    @property
+    def source_url(self):
+        """Get text for the source of the recipe."""
+        return 'local://{}/{}:{}'.format(self.owner, self.name, self.tag)
+
+    @property
+    def input_artifacts(self):
+        """Get a list of the names of the inputs that are artifacts."""
+        return list(LOCAL_RECIPES[self.name]['artifacts'])
+
+    @property
+    def inputs_required(self):
+        """Get a list of the names of the inputs that every run must have."""
+        return list(LOCAL_RECIPES[self.name]['required'])
+
+    def __repr__(self):
+        return 'LocalRecipe: {}'.format(self.source_url)
+
+
+class LocalNewJob(object):
+    """A job to be created on the local job backend like a pollination_io NewJob.
+
+    Args:
+        owner: Text for the owner of the project.
+        project: Text for the name of the project.
+        recipe: A LocalRecipe to be run by the job.
+        arguments: A list of dictionaries with the inputs of each run of the job.
+        name: Optional text for the name of the job.
+        description: Optional text for the description of the job.
+        client: The LocalClient of the backend.
+    """
+
+    def __init__(self, owner, project, recipe, arguments=None, name=None,
+                 description=None, client=None):
+        self.owner = owner
+        self.project = project
+        self.recipe = recipe
+        self.arguments = arguments or []
+        self.name = name
+        self.description = description
+        self._client = client
+
+    def upload_artifact(self, fp, target_folder=''):
+        """Copy a file into the project folder.
+
+        Args:
+            fp: A pathlib.Path to the file to be uploaded.
+            target_folder: Text for the folder in the project to which the
+                file is copied. (Default: '').
+
+        Returns:
+            Text for the path of the file in the project, which can be used as
+            the value of an artifact input.
+        """
+        artifact_path = os.path.join(target_folder, fp.name).replace('\\', '/')
+        project_path = os.path.join(
+            self._client.project_folder(self.owner, self.project), artifact_path)
+        os.makedirs(os.path.dirname(project_path), exist_ok=True)
+        shutil.copyfile(str(fp), project_path)
+        return artifact_path
+
+    def create(self):
+        """Create the job and submit all of its runs to the pool of workers.
+
+        Returns:
+            A LocalJob for the created job.
+        """
+        self._check_arguments()
+        job_id = uuid.uuid4().hex
+        client = self._client
+        job_folder = client.job_folder(self.owner, self.project, job_id)
+        project_folder = client.project_folder(self.owner, self.project)
+        run_ids = [uuid.uuid4().hex for _ in self.arguments]
+        os.makedirs(job_folder)
+        _write_json(os.path.join(job_folder, 'job.json'), {
+            'id': job_id, 'name': self.name, 'description': self.description,
+            'source': self.recipe.source_url, 'arguments': self.arguments,
+            'runs': run_ids, 'started_at': _utc_now()
+        })
+
+        for run_id, args in zip(run_ids, self.arguments):
+            run_folder = client.run_folder(self.owner, self.project, job_id, run_id)
+            os.makedirs(run_folder)
+            _write_json(os.path.join(run_folder, 'run.json'), {
+                'id': run_id, 'job_id': job_id, 'inputs': args,
+                'status': RunStatusEnum.scheduled.value, 'started_at': _utc_now()
+            })
+            inputs = {
+                name: os.path.join(project_folder, value)
+                if name in self.recipe.input_artifacts else value
+                for name, value in args.items()
+            }
+            client.submit_run(run_folder, self.recipe.name, inputs)
+        return LocalJob(self.owner, self.project, job_id, client)
+
+    def _check_arguments(self):
+        """Check that every run has all of the required inputs of the recipe."""
+        if self.arguments == []:
+            raise ValueError('No job arguments specified')
+        for i, run_args in enumerate(self.arguments):
+            for ri in self.recipe.inputs_required:
+                if ri not in run_args.keys():
+                    raise ValueError(
+                        'Missing required input {} in arguments[{}]'.format(ri, i))
+
+
+class LocalJob(object):
+    """A job on the local job backend like a pollination_io Job.
+
+    Args:
+        owner: Text for the owner of the project.
+        project: Text for the name of the project.
+        id: Text for the ID of the job.
+        client: The LocalClient of the backend.
+
+    Properties:
+        * folder
+        * api_object
+        * status
+        * runs
+    """
+
+    def __init__(self, owner, project, id, client=None):
+        self.owner = owner
+        self.project = project
+        self.id = id
+        self._client = client
+        self._api_object = None
+
+    @property
+    def folder(self):
+        """Get the path to the folder of the job."""
+        return self._client.job_folder(self.owner, self.project, self.id)
+
+    def refresh(self):
+        """Read the job again such that the status is up to date."""
+        self._api_object = None
+
+    @property
+    def api_object(self):
+        """Get a dictionary of the job that was written when it was created."""
+        if self._api_object is None:
+            self._api_object = _read_json(os.path.join(self.folder, 'job.json'))
+            if self._api_object is None:
+                raise ValueError('Job "{}" does not exist.'.format(self.id))
+        return self._api_object
+
+    @property
+    def status(self):
+        """Get a queenbee JobStatus summarizing the status of all of the runs."""
+        job = self.api_object
+        counts = {status: 0 for status in RunStatusEnum}
+        finished_at = None
+        for run in self.runs:
+            status = run.status
+            counts[status.status] += 1
+            if status.finished_at is not None:
+                finished_at = max(finished_at or status.finished_at, status.finished_at)
+        pending = counts[RunStatusEnum.created] + counts[RunStatusEnum.scheduled]
+        running = counts[RunStatusEnum.running] + counts[RunStatusEnum.post_processing]
+        if pending + running == 0:
+            job_status = JobStatusEnum.completed
+        elif running == 0 and pending == len(job['runs']):
+            job_status = JobStatusEnum.pre_processing
+        else:
+            job_status = JobStatusEnum.running
+            finished_at = None
+        return JobStatus(
+            id=self.id, status=job_status, source=job['source'],
+            started_at=job['started_at'], finished_at=finished_at,
+            runs_pending=pending, runs_running=running,
+            runs_completed=counts[RunStatusEnum.succeeded],
+            runs_failed=counts[RunStatusEnum.failed],
+            runs_cancelled=counts[RunStatusEnum.cancelled])
+
+    @property
+    def runs(self):
+        """Get a list of the LocalRuns of the job."""
+        return [LocalRun(self.owner, self.project, self.id, run_id, self._client)
+                for run_id in self.api_object['runs']]
+
+    def download_artifact(self, path):
+        """Get a BytesIO with the content of a file in the folder of the job."""
+        with open(os.path.join(self.folder, path), 'rb') as f:
+            return BytesIO(f.read())
+
+    def __str__(self):
+        return '<LocalJob {}/{}/{}>'.format(self.owner, self.project, self.id)
+
+
+class LocalRun(object):
+    """A run of a job on the local job backend like a pollination_io Run.
+
+    Args:
+        owner: Text for the owner of the project.
+        project: Text for the name of the project.
+        job_id: Text for the ID of the job of the run.
+        id: Text for the ID of the run.
+        client: The LocalClient of the backend.
+
+    Properties:
+        * folder
+        * api_object
+        * status
+    """
+
+    def __init__(self, owner, project, job_id, id, client=None):
+        self.owner = owner
+        self.project = project
+        self.job_id = job_id
+        self.id = id
+        self._client = client
+        self._api_object = None
+
+    @property
+    def folder(self):
+        """Get the path to the folder of the run."""
+        return self._client.run_folder(self.owner, self.project, self.job_id, self.id)
+
+    def refresh(self):
+        """Read the run again such that the status is up to date."""
+        self._api_object = None
+
+    @property
+    def api_object(self):
+        """Get a dictionary of the run as it was last written by its worker."""
+        if self._api_object is None:
+            self._api_object = _read_json(os.path.join(self.folder, 'run.json'))
+            if self._api_object is None:
+                raise ValueError('Run "{}" does not exist.'.format(self.id))
+        return self._api_object
+
+    @property
+    def status(self):
+        """Get a queenbee RunStatus for the run."""
+        run = self.api_object
+        return RunStatus(
+            id=self.id, job_id=self.job_id, status=run['status'],
+            message=run.get('message'), started_at=run['started_at'],
+            finished_at=run.get('finished_at'), inputs=[], outputs=[])
+
+    def download_zipped_output(self, output_name):
+        """Get a BytesIO of a zip file with an output of the run.
+
+        Args:
+            output_name: Text for the name of an output of the recipe.
+        """
+        outputs = self.api_object.get('outputs') or {}
+        if output_name not in outputs:
+            raise ValueError('Run "{}" has no output "{}".'.format(self.id, output_name))
+        output_path = os.path.join(self.folder, 'workspace', outputs[output_name])
+        data = BytesIO()
+        with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            if os.path.isdir(output_path):
+                for root, _, files in os.walk(output_path):
+                    for file_name in files:
+                        file_path = os.path.join(root, file_name)
+                        zip_file.write(file_path, os.path.relpath(file_path, output_path))
+            else:
+                zip_file.write(output_path, os.path.basename(output_path))
+        data.seek(0)
+        return data
+
+    def download_artifact(self, path):
+        """Get a BytesIO with the content of a file in the workspace of the run."""
+        with open(os.path.join(self.folder, 'workspace', path), 'rb') as f:
+            return BytesIO(f.read())
+
+    def __str__(self):
+        return '<LocalRun {}/{}/{}/{}>'.format(
+            self.owner, self.project, self.job_id, self.id)
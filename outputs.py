@@ -1,4 +1,7 @@
 """Functions for creating output visualizations and changing the units of the results."""
+import os
+import calendar
+
 from ladybug.color import Colorset
 from ladybug.legend import LegendParameters
 from ladybug.monthlychart import MonthlyChart
@@ -8,6 +11,13 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+from results import HourlyResults
+from simulation import HOURLY_OUTPUTS
+
+# options for the number of rooms shown in the room summary table
+ROOM_TABLE_ROWS = (10, 50, 100, 500, 'All')
+
+
 def display_results(container, sql_results, heat_cop, cool_cop, ip_units, normalize):
     """Create the charts and metrics from the loaded sql results of the simulation.
 
@@ -24,35 +34,12 @@ def display_results(container, sql_results, heat_cop, cool_cop, ip_units, normal
     if not sql_results:
         return
     print("sql_results['load_terms']: ", list(sql_results['load_terms'][0]))
-    load_terms = sql_results['load_terms'].copy()
     load_colors = sql_results['load_colors']
-    balance = sql_results['balance'].copy()
-    room_results = sql_results['room_results']
-    floor_area = sql_results['floor_area']
-
-    # convert the data to the correct units system
-    display_units = 'kBtu/ft2' if ip_units else 'kWh/m2'
-    if load_terms[0].header.unit != display_units:
-        for data in load_terms:
-            data.convert_to_unit(display_units)
-    if balance[0].header.unit != display_units:
-        for data in balance:
-            data.convert_to_unit(display_units)
-
-    # total the data over the floor area if normalize is false
-    if not normalize:
-        if ip_units:
-            display_units, a_unit, total_area = 'kBtu', 'ft2', floor_area * 10.7639
-        else:
-            display_units, a_unit, total_area = 'kWh', 'm2', floor_area
-        load_terms = [data.aggregate_by_area(total_area, a_unit) for data in load_terms]
-        balance = [data.aggregate_by_area(total_area, a_unit) for data in balance]
-
-    # multiply the results by the COP if it is not equal to 1
-    if cool_cop != 1:
-        load_terms[0] = load_terms[0] / cool_cop
-    if heat_cop != 1:
-        load_terms[1] = load_terms[1] / heat_cop
+
+    # get the results in the display units, COPs and normalization, which are
+    # only computed the first time a combination of settings is used
+    view = sql_results['results'].view(ip_units, normalize, heat_cop, cool_cop)
+    load_terms, balance, display_units = view.load_terms, view.balance, view.units
 
     list_cooling = [0.000015,0,0.10088,0.489065,1.71742,5.052661,9.79027,7.448964,2.425744,0.301747,0.00012,1.2493e-6]
     list_heating = [8.34767,5.573583,3.553136,0.877068,0.082412,0,0,0,0,0.181832,2.573058,5.133874]
@@ -60,11 +47,24 @@ def display_results(container, sql_results, heat_cop, cool_cop, ip_units, normal
     list_elctric = [0,0,0,0,1,5,9,7,2,0,0,1]
 
     # report the total load and the breakdown into different terms
-    tot_ld = [dat.total for dat in load_terms]
+    tot_ld = view.totals.tolist()
     tot_ld = [sum(list_cooling), sum(list_heating), sum(list_lighting), sum(list_elctric)]
     val = '{:,.1f}'.format(sum(tot_ld)) if normalize else '{:,.0f}'.format(sum(tot_ld))
     container.header('Total Load: {} {}'.format(val, display_units))
 
+    # note when the results are a preview and report their error against the full year
+    if sql_results['preview']:
+        container.caption(
+            'Preview results scaled up from one representative week of each month. '
+            'Run the full year simulation for final numbers.')
+    if sql_results.get('preview_error'):
+        container.caption('Error of the preview relative to the full year simulation')
+        error_table = pd.DataFrame(
+            [(end_use, prev, annual, None if err is None else err * 100)
+             for end_use, (prev, annual, err) in sql_results['preview_error'].items()],
+            columns=['End Use', 'Preview (kWh/m2)', 'Full Year (kWh/m2)', 'Error (%)'])
+        container.dataframe(error_table)
+
     # add metrics for the individual load components
     print("load_terms: ", load_terms)
     eui_cols = container.columns(len(load_terms))
@@ -131,36 +131,63 @@ def display_results(container, sql_results, heat_cop, cool_cop, ip_units, normal
     figure = month_chart#.plot(title='Monthly Load Balance')
     #container.plotly_chart(figure)
 
-    # process all of the detailed room results into a table
-    #container.write('Room Summary ({})'.format(display_units))
-    table_data = {'Room': []}
-    load_types = [dat.header.metadata['type'] for dat in load_terms]
-    for lt in load_types:
-        table_data[lt] = []
-    for room_data in room_results.values():
-        name, fa, mult, res = room_data
-        table_data['Room'].append(name)
-        for lt in load_types:
-            try:
-                val = res[lt] if normalize else res[lt] * fa * mult
-                table_data[lt].append(val)
-            except KeyError:
-                table_data[lt].append(0.0)
-    # perform any unit conversions on the table data
-    if ip_units:
-        conv = 0.316998 if normalize else 3.41214
-        for col, dat in table_data.items():
-            if col != 'Room':
-                table_data[col] = [val * conv for val in table_data[col]]
-    if cool_cop != 1:
-        table_data['Cooling'] = [val / cool_cop for val in table_data['Cooling']]
-    if heat_cop != 1:
-        table_data['Heating'] = [val / heat_cop for val in table_data['Heating']]
-    # add a column for the total data of each room
-    totals = [0] * len(table_data['Cooling'])
-    for col, dat in table_data.items():
-        if col != 'Room':
-            for i, v in enumerate(dat):
-                totals[i] += v
-    table_data['Total'] = totals
-    #container.dataframe(table_data)
\ No newline at end of file
+    # show the detailed room results as a table of the rooms with the most energy use
+    room_summary = container.expander('Room Summary ({})'.format(display_units))
+    sort_cols = view.end_uses + ['Total']
+    sort_col, rows_col = room_summary.columns(2)
+    sort_by = sort_col.selectbox(
+        'Sort By', sort_cols, index=len(sort_cols) - 1, key='room_sort')
+    top = rows_col.selectbox('Rooms Shown', ROOM_TABLE_ROWS, index=1, key='room_top')
+    room_table = view.room_table(sort_by, True, None if top == 'All' else top)
+    room_summary.dataframe(room_table.set_index('Room'))
+
+
+def display_hourly_results(container, sql_results, heat_cop, cool_cop, ip_units):
+    """Create the charts of peak hours and daily profiles from the hourly results.
+
+    The hourly values are memory-mapped from disk and only the totals over the
+    zones that are charted get computed from them.
+
+    Args:
+        container: The streamlit container to which the charts will be added.
+        sql_results: Dictionary of the EnergyPlus SQL results (or None).
+        heat_cop: Number for the heating COP.
+        cool_cop: Number for the cooling COP.
+        ip_units: Boolean to indicate whether IP units should be used.
+    """
+    if not sql_results or not sql_results.get('hourly'):
+        return
+    if not os.path.isdir(sql_results['hourly']):
+        container.caption('The hourly results of this simulation are no longer '
+                          'on disk. Run the simulation again to see them.')
+        return
+    hourly = HourlyResults(sql_results['hourly'])
+    peaks = {output: hourly.peak(output) for output in HOURLY_OUTPUTS
+             if len(hourly.keys(output)) != 0}
+    end_uses = [(output, end_use) for output, end_use in HOURLY_OUTPUTS.items()
+                if peaks.get(output) is not None]  # outputs without any values
+    if len(end_uses) == 0:
+        return
+
+    # the energy of each hour in kWh is the average power over the hour in kW
+    p_units, conv = ('kBtu/h', 3.41214) if ip_units else ('kW', 1)
+    factors = {'Cooling': conv / cool_cop, 'Heating': conv / heat_cop}
+    container.subheader('Hourly Results')
+    peak_cols = container.columns(len(end_uses))
+    for (output, end_use), col in zip(end_uses, peak_cols):
+        month, day, hour, value = peaks[output]
+        col.metric('Peak {} ({})'.format(end_use, p_units),
+                   '{:,.1f}'.format(value * factors.get(end_use, conv)))
+        col.caption('{} {} {:02d}:00'.format(calendar.month_abbr[month], day, hour))
+
+    # plot the average profile of each hour of the day for a month
+    month = container.select_slider(
+        'Month', options=list(range(1, 13)), key='hourly_month',
+        format_func=lambda m: calendar.month_name[m])
+    profiles = pd.DataFrame({'Hour': range(24)})
+    for output, end_use in end_uses:
+        profiles[end_use] = \
+            hourly.average_day(output, month) * factors.get(end_use, conv)
+    fig = px.line(profiles, x='Hour', y=[end_use for _, end_use in end_uses],
+                  title='Average Daily Profile ({})'.format(p_units))
+    container.plotly_chart(fig, theme='streamlit')
@@ -0,0 +1,1079 @@
+"""Array-backed loading of EnergyPlus results from the SQLite output file."""
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from ladybug.sql import SQLiteResult
+from ladybug.header import Header
+from ladybug.analysisperiod import AnalysisPeriod
+from ladybug.datacollection import MonthlyCollection, HourlyContinuousCollection
+from ladybug.datatype.energy import Energy
+from ladybug.datatype.energyintensity import EnergyIntensity
+from honeybee_energy.result.loadbalance import LoadBalance
+
+# Names of all EnergyPlus outputs that are used to build a LoadBalance
+BALANCE_OUTPUTS = (
+    LoadBalance.COOLING, LoadBalance.HEATING, LoadBalance.LIGHTING,
+    LoadBalance.ELECTRIC_EQUIP, LoadBalance.GAS_EQUIP, LoadBalance.PROCESS,
+    LoadBalance.HOT_WATER, LoadBalance.PEOPLE_GAIN, LoadBalance.SOLAR_GAIN,
+    LoadBalance.INFIL_GAIN, LoadBalance.INFIL_LOSS,
+    LoadBalance.VENT_GAIN, LoadBalance.VENT_LOSS,
+    LoadBalance.NAT_VENT_GAIN, LoadBalance.NAT_VENT_LOSS,
+    LoadBalance.OPAQUE_ENERGY_FLOW, LoadBalance.WINDOW_LOSS, LoadBalance.WINDOW_GAIN
+)
+
+# index of the IntervalType column in the EnergyPlus Time table for monthly data
+MONTHLY_INTERVAL = 3
+# index of the IntervalType column in the EnergyPlus Time table for hourly data
+HOURLY_INTERVAL = 1
+# number of rows of the ReportData table that are read at a time for hourly data
+HOURLY_FETCH_SIZE = 100000
+# number of combinations of display settings whose views of results are kept
+RESULTS_VIEW_CACHE_SIZE = 16
+# factors to convert kWh/m2 to kBtu/ft2 and kWh to kBtu
+IP_INTENSITY = 0.316998
+IP_ENERGY = 3.41214
+
+
+def _output_names(output_names):
+    """Flatten a list of output names and tuples of output names into a sorted list."""
+    names = set()
+    for name in output_names:
+        if isinstance(name, str):
+            names.add(name)
+        else:
+            names.update(name)
+    return sorted(names)
+
+
+class BulkSQLResult(object):
+    """Reader that loads many EnergyPlus outputs from an SQLite file in a single pass.
+
+    All of the requested outputs are read with one query over the ReportData
+    table and are held in memory as NumPy arrays, from which data collections
+    can be built without going back to the file. This replaces calling
+    SQLiteResult.data_collections_by_output_name once per output, which opens
+    the file and queries it again for each output.
+
+    Args:
+        file_path: Full path to an SQLite file that was generated by EnergyPlus.
+        output_names: A list of the names of EnergyPlus outputs to be loaded.
+            Items of this list can also be tuples of output names, which is
+            how LoadBalance groups related outputs.
+        month_scale: An optional list of 12 numbers by which the values of each
+            month are multiplied. This is used to scale up the results of a
+            simulation that only ran representative periods of each month to
+            the full months. (Default: None).
+        frequency: Optional text for the ReportingFrequency of the outputs to be
+            loaded (eg. Monthly). This keeps the outputs that were also requested
+            at another frequency (eg. Hourly) from being loaded into memory. If
+            None, outputs of all frequencies are loaded. (Default: None).
+
+    Properties:
+        * file_path
+        * output_names
+        * month_scale
+        * frequency
+    """
+
+    def __init__(self, file_path, output_names, month_scale=None, frequency=None):
+        self._file_path = file_path
+        self._output_names = _output_names(output_names)
+        self._month_scale = None if month_scale is None else \
+            np.array(month_scale, dtype=float)
+        self._frequency = frequency
+        self._rows_by_name = {}  # output name to a list of dictionary rows
+        self._values = {}  # dictionary index to an array of values
+        self._times = {}  # dictionary index to an array of time indices
+        self._load()
+
+    @property
+    def file_path(self):
+        """Get the path to the SQLite file from which the results were loaded."""
+        return self._file_path
+
+    @property
+    def output_names(self):
+        """Get a sorted list of the names of the outputs that were requested."""
+        return list(self._output_names)
+
+    @property
+    def month_scale(self):
+        """Get an array of the factors by which the values of each month are scaled."""
+        return self._month_scale
+
+    @property
+    def frequency(self):
+        """Get text for the ReportingFrequency of the loaded outputs or None for all."""
+        return self._frequency
+
+    def data_collections(self, output_name):
+        """Get an array of Ladybug DataCollections for a specified output.
+
+        This matches the behavior of SQLiteResult.data_collections_by_output_name
+        but uses the data that was already loaded into memory.
+
+        Args:
+            output_name: The name of an EnergyPlus output. This can also be a tuple
+                of output names for which all data collections should be returned.
+                All names must be among the output_names of this object.
+
+        Returns:
+            A list of data collections of the requested output type. This will
+            be an empty list if no output of the requested name was found.
+        """
+        rows = self._matching_rows(output_name)
+        if len(rows) == 0:
+            return []
+        times = self._times[rows[0][0]]
+        if not np.all(self._interval_type[times] == MONTHLY_INTERVAL):
+            # only monthly data is parsed from memory; use ladybug for the rest
+            return SQLiteResult(self._file_path).data_collections_by_output_name(
+                output_name)
+
+        # create the header objects to be used for the resulting data collections
+        units = rows[0][5] if rows[0][5] != 'J' else 'kWh'
+        data_type, units = SQLiteResult._data_type_from_unit(units, rows[0][3])
+        months, month_index = np.unique(self._month[times], return_inverse=True)
+        year = int(self._year[times[-1]])
+        leap_year = year != 0 and year % 4 == 0
+        month_days = AnalysisPeriod.NUMOFDAYSEACHMONTHLEAP if leap_year \
+            else AnalysisPeriod.NUMOFDAYSEACHMONTH
+        run_period = AnalysisPeriod(
+            int(months[0]), 1, 0, int(months[-1]), month_days[int(months[-1]) - 1], 23,
+            is_leap_year=leap_year)
+
+        # create the final data collections, summing any months split across periods
+        data_colls = []
+        is_surface = isinstance(output_name, str) and 'Surface' in output_name
+        for row in rows:
+            obj_type = 'Surface' if is_surface else row[1]
+            meta_data = {'type': row[3], obj_type: row[2]}
+            header = Header(data_type, units, run_period, meta_data)
+            values = np.bincount(
+                month_index, weights=self._values[row[0]], minlength=len(months))
+            data = MonthlyCollection(header, values.tolist(), months.tolist())
+            data._validated_a_period = True
+            data_colls.append(data)
+        return data_colls
+
+    def monthly_array(self, output_name):
+        """Get the values of an output as a single array of monthly totals.
+
+        Args:
+            output_name: The name of an EnergyPlus output. This can also be a tuple
+                of output names for which all values should be returned.
+
+        Returns:
+            A tuple with three items.
+
+            -   keys: A list of the KeyValue of each row in the array (eg. the
+                name of the zone or system).
+
+            -   groups: A list of the IndexGroup of each row in the array (eg.
+                Zone or System).
+
+            -   values: A NumPy array with one row for each key and 12 columns for
+                the months of the year. Months that were not simulated are zero.
+        """
+        rows = self._matching_rows(output_name)
+        values = np.zeros((len(rows), 12))
+        if len(rows) == 0:
+            return [], [], values
+        dict_indices = np.array([row[0] for row in rows])
+        row_position = np.zeros(dict_indices.max() + 1, int)
+        row_position[dict_indices] = np.arange(len(rows))
+        selected = np.isin(self._data_index, dict_indices)
+        np.add.at(
+            values,
+            (row_position[self._data_index[selected]],
+             self._month[self._data_time[selected]] - 1),
+            self._data_value[selected])
+        return [row[2] for row in rows], [row[1] for row in rows], values
+
+    def _matching_rows(self, output_name):
+        """Get the dictionary rows of an output name, all of the same frequency."""
+        names = (output_name,) if isinstance(output_name, str) else output_name
+        rows = sorted(row for name in names for row in self._rows_by_name.get(name, []))
+        if len(rows) == 0:
+            return rows
+        freq = rows[0][4]
+        return [row for row in rows if row[4] == freq]
+
+    def _load(self):
+        """Load all of the requested outputs from the SQLite file."""
+        if len(self._output_names) == 0:
+            dict_rows, data, time_rows = [], [], []
+        else:
+            where = 'Name IN ({})'.format(', '.join('?' for _ in self._output_names))
+            params = list(self._output_names)
+            if self._frequency is not None:
+                where += ' AND ReportingFrequency = ?'
+                params.append(self._frequency)
+            conn = sqlite3.connect(self._file_path)
+            try:
+                c = conn.cursor()
+                c.execute(
+                    'SELECT ReportDataDictionaryIndex, IndexGroup, KeyValue, Name, '
+                    'ReportingFrequency, Units FROM ReportDataDictionary '
+                    'WHERE {}'.format(where), params)
+                dict_rows = c.fetchall()
+                c.execute(
+                    'SELECT ReportData.ReportDataDictionaryIndex, TimeIndex, Value '
+                    'FROM ReportData INNER JOIN ReportDataDictionary ON '
+                    'ReportData.ReportDataDictionaryIndex = '
+                    'ReportDataDictionary.ReportDataDictionaryIndex '
+                    'WHERE {} ORDER BY '
+                    'ReportData.ReportDataDictionaryIndex, TimeIndex'.format(where),
+                    params)
+                data = c.fetchall()
+                c.execute('SELECT TimeIndex, Year, Month, IntervalType FROM Time')
+                time_rows = c.fetchall()
+            finally:
+                conn.close()  # ensure connection is always closed
+
+        # index the rows of the data dictionary by output name
+        units_by_index = {}
+        for row in dict_rows:
+            self._rows_by_name.setdefault(row[3], []).append(row)
+            units_by_index[row[0]] = row[5]
+
+        # store the ReportData as arrays, converting energy to kWh like SQLiteResult
+        data = np.array(data, dtype=float).reshape(-1, 3)
+        self._data_index = data[:, 0].astype(int)
+        self._data_time = data[:, 1].astype(int)
+        self._data_value = data[:, 2]
+        joule_indices = [i for i, units in units_by_index.items() if units == 'J']
+        self._data_value[np.isin(self._data_index, joule_indices)] /= 3600000.
+
+        # split the arrays into views for each row of the data dictionary
+        indices, starts = np.unique(self._data_index, return_index=True)
+        for index, times, values in zip(
+                indices, np.split(self._data_time, starts[1:]),
+                np.split(self._data_value, starts[1:])):
+            self._times[index] = times
+            self._values[index] = values
+
+        # store the Time table as arrays that can be indexed with a TimeIndex
+        time_table = np.array(time_rows, dtype=int).reshape(-1, 4)
+        size = time_table[:, 0].max() + 1 if len(time_table) != 0 else 0
+        self._year, self._month, self._interval_type = \
+            np.zeros(size, int), np.zeros(size, int), np.zeros(size, int)
+        self._year[time_table[:, 0]] = time_table[:, 1]
+        self._month[time_table[:, 0]] = time_table[:, 2]
+        self._interval_type[time_table[:, 0]] = time_table[:, 3]
+
+        # scale the values of each month, which also updates the split views
+        if self._month_scale is not None:
+            self._data_value *= self._month_scale[self._month[self._data_time] - 1]
+
+    def __repr__(self):
+        return 'BulkSQLResult: {}'.format(self._file_path)
+
+
+def load_balance_from_sql(model, bulk_result):
+    """Create a LoadBalance object from the outputs already loaded in a BulkSQLResult.
+
+    This matches LoadBalance.from_sql_file without re-reading the SQLite file.
+
+    Args:
+        model: A honeybee Model, which will have its rooms matched to the
+            data collections.
+        bulk_result: A BulkSQLResult that was loaded with all of the
+            BALANCE_OUTPUTS.
+    """
+    # get all of the results relevant for gains and losses
+    get_data = bulk_result.data_collections
+    cooling = get_data(LoadBalance.COOLING)
+    heating = get_data(LoadBalance.HEATING)
+    lighting = get_data(LoadBalance.LIGHTING)
+    people_gain = get_data(LoadBalance.PEOPLE_GAIN)
+    solar_gain = get_data(LoadBalance.SOLAR_GAIN)
+    infil_gain = get_data(LoadBalance.INFIL_GAIN)
+    infil_loss = get_data(LoadBalance.INFIL_LOSS)
+    vent_loss = get_data(LoadBalance.VENT_LOSS)
+    vent_gain = get_data(LoadBalance.VENT_GAIN)
+    nat_vent_gain = get_data(LoadBalance.NAT_VENT_GAIN)
+    nat_vent_loss = get_data(LoadBalance.NAT_VENT_LOSS)
+
+    # handle the case that both total elect/gas energy and zone gain are requested
+    electric_equip = get_data(LoadBalance.ELECTRIC_EQUIP[1])
+    if len(electric_equip) == 0:
+        electric_equip = get_data(LoadBalance.ELECTRIC_EQUIP)
+    gas_equip = get_data(LoadBalance.GAS_EQUIP[1])
+    if len(gas_equip) == 0:
+        gas_equip = get_data(LoadBalance.GAS_EQUIP)
+    process = get_data(LoadBalance.PROCESS)
+    hot_water = get_data(LoadBalance.HOT_WATER[1])
+    if len(hot_water) == 0:
+        hot_water = get_data(LoadBalance.HOT_WATER)
+
+    # subtract losses from gains
+    infiltration, mech_vent, nat_vent = None, None, None
+    if len(infil_gain) == len(infil_loss):
+        infiltration = LoadBalance.subtract_loss_from_gain(infil_gain, infil_loss)
+    if len(vent_gain) == len(vent_loss) == len(cooling) == len(heating):
+        mech_vent = \
+            LoadBalance.mech_vent_loss_gain(vent_gain, vent_loss, cooling, heating)
+    if len(nat_vent_gain) == len(nat_vent_loss):
+        nat_vent = LoadBalance.subtract_loss_from_gain(nat_vent_gain, nat_vent_loss)
+
+    # get the surface energy flow
+    opaque_flow = get_data(LoadBalance.OPAQUE_ENERGY_FLOW)
+    window_loss = get_data(LoadBalance.WINDOW_LOSS)
+    window_gain = get_data(LoadBalance.WINDOW_GAIN)
+    window_flow = []
+    if len(window_gain) == len(window_loss):
+        window_flow = LoadBalance.subtract_loss_from_gain(window_gain, window_loss)
+    face_energy_flow = opaque_flow + window_flow
+
+    # create the LoadBalance object
+    bal_obj = LoadBalance(
+        model.rooms, cooling, heating, lighting, electric_equip, gas_equip, process,
+        hot_water, people_gain, solar_gain, infiltration, mech_vent, nat_vent,
+        face_energy_flow, model.units, use_all_solar=True)
+    bal_obj.floor_area = bal_obj._area_as_meters_feet(model.floor_area)
+    return bal_obj
+
+
+class LoadMatrix(object):
+    """Monthly energy use of each Room of a Model by end use, held as a NumPy array.
+
+    The array has the shape (rooms, months, end uses) and is filled one end use at
+    a time with add_end_use. Room-level intensities are computed from it with
+    broadcast operations rather than looping over data collections.
+
+    Args:
+        room_ids: A list of the upper-case identifiers of the Rooms, which is how
+            EnergyPlus reports the names of zones.
+        room_names: A list of the display names of the Rooms.
+        floor_areas: A list of the floor areas of the Rooms in square meters,
+            including the multiplier. Rooms excluded from the floor area should
+            have a floor area of zero.
+        multipliers: A list of integers for the multipliers of the Rooms.
+
+    Properties:
+        * room_ids
+        * room_names
+        * floor_areas
+        * multipliers
+        * end_uses
+        * values
+        * has_data
+    """
+
+    def __init__(self, room_ids, room_names, floor_areas, multipliers):
+        self._room_ids = list(room_ids)
+        self._room_names = list(room_names)
+        self._floor_areas = np.array(floor_areas, dtype=float)
+        self._multipliers = np.array(multipliers, dtype=float)
+        self._room_index = {r_id: i for i, r_id in enumerate(self._room_ids)}
+        self._end_uses = []
+        self._values = np.zeros((len(self._room_ids), 12, 0))
+        self._has_data = np.zeros((len(self._room_ids), 0), dtype=bool)
+
+    @property
+    def room_ids(self):
+        """Get a list of the upper-case identifiers of the Rooms."""
+        return self._room_ids
+
+    @property
+    def room_names(self):
+        """Get a list of the display names of the Rooms."""
+        return self._room_names
+
+    @property
+    def floor_areas(self):
+        """Get an array of the floor areas of the Rooms in square meters."""
+        return self._floor_areas
+
+    @property
+    def multipliers(self):
+        """Get an array of the multipliers of the Rooms."""
+        return self._multipliers
+
+    @property
+    def end_uses(self):
+        """Get a list of the names of the end uses in the last axis of the values."""
+        return self._end_uses
+
+    @property
+    def values(self):
+        """Get an array of the monthly kWh of each Room and end use.
+
+        The shape is (rooms, 12, end uses) and values are for a single Room,
+        without the multiplier applied.
+        """
+        return self._values
+
+    @property
+    def has_data(self):
+        """Get a boolean array of the (rooms, end uses) that have EnergyPlus results."""
+        return self._has_data
+
+    def room_indices(self, keys, groups):
+        """Get the index of the Room that each EnergyPlus key belongs to.
+
+        Args:
+            keys: A list of the KeyValue of EnergyPlus outputs.
+            groups: A list of the IndexGroup of EnergyPlus outputs.
+
+        Returns:
+            An array of integers with the index of the matching Room for each
+            key and -1 for keys that could not be matched to a Room.
+        """
+        indices = []
+        for key, group in zip(keys, groups):
+            if group != 'Zone':
+                if ' IDEAL LOADS AIR SYSTEM' in key:  # E+ HVAC Templates
+                    key = key.split(' IDEAL LOADS AIR SYSTEM')[0]
+                elif '..' in key:  # convention used for service hot water
+                    key = key.split('..')[-1]
+            indices.append(self._room_index.get(key, -1))
+        return np.array(indices, dtype=int)
+
+    def add_end_use(self, end_use, room_indices, values):
+        """Add the monthly values of EnergyPlus keys to the matrix under an end use.
+
+        Values of keys that belong to the same Room are summed and values are
+        added to any existing values if the end use is already in the matrix.
+
+        Args:
+            end_use: Text for the name of the end use (eg. "Cooling").
+            room_indices: An array with the Room index of each key, which is
+                typically the output of room_indices. Keys with an index of -1
+                are ignored.
+            values: An array of monthly kWh with one row for each key.
+        """
+        if end_use not in self._end_uses:
+            self._end_uses.append(end_use)
+            self._values = np.concatenate(
+                (self._values, np.zeros((len(self._room_ids), 12, 1))), axis=2)
+            self._has_data = np.concatenate(
+                (self._has_data, np.zeros((len(self._room_ids), 1), dtype=bool)), axis=1)
+        use_i = self._end_uses.index(end_use)
+        matched = room_indices >= 0
+        np.add.at(self._values[:, :, use_i], room_indices[matched], values[matched])
+        self._has_data[room_indices[matched], use_i] = True
+
+    def room_intensity(self):
+        """Get an array of the annual energy use intensity of each Room and end use.
+
+        The result has the shape (rooms, end uses) and is in kWh/m2. Rooms
+        without floor area have an intensity of zero.
+        """
+        annual = self._values.sum(axis=1) * self._multipliers[:, None]
+        areas = self._floor_areas[:, None]
+        return np.divide(
+            annual, areas, out=np.zeros_like(annual), where=areas != 0)
+
+    def room_results(self):
+        """Get a dictionary of Room results in the format used by display_results.
+
+        Each key is a Room identifier and each value is a list with the Room
+        display name, floor area, multiplier and a dictionary of the intensity
+        of each end use with results for the Room.
+        """
+        intensity = self.room_intensity()
+        room_results = {}
+        for i, r_id in enumerate(self._room_ids):
+            if self._floor_areas[i] == 0:
+                continue
+            room_eui = {
+                end_use: float(intensity[i, j])
+                for j, end_use in enumerate(self._end_uses) if self._has_data[i, j]
+            }
+            room_results[r_id] = [
+                self._room_names[i], float(self._floor_areas[i]),
+                int(self._multipliers[i]), room_eui
+            ]
+        return room_results
+
+    def __repr__(self):
+        return 'LoadMatrix: {} rooms x {} end uses'.format(
+            len(self._room_ids), len(self._end_uses))
+
+
+def write_hourly_results(sql_path, output_names, folder):
+    """Stream the hourly values of EnergyPlus outputs into a memory-mapped array on disk.
+
+    The values are read from the SQLite file one chunk at a time and written into
+    a float32 array with one row for each output and key (eg. zone) and one column
+    for each hour, such that the values are never held in memory as Python floats.
+    Energy is converted from Joules to kWh like SQLiteResult. The files are
+    written into a temporary folder that replaces the folder once they are
+    complete such that partially-written results are never read.
+
+    Args:
+        sql_path: Full path to an SQLite file that was generated by EnergyPlus.
+        output_names: A list of the names of EnergyPlus outputs that were
+            requested at an Hourly reporting frequency.
+        folder: Path to the folder into which the arrays are written. Any
+            existing folder is replaced.
+
+    Returns:
+        An HourlyResults object for the folder.
+    """
+    names = _output_names(output_names)
+    where = 'Name IN ({}) AND ReportingFrequency = ?'.format(
+        ', '.join('?' for _ in names))
+    params = names + ['Hourly']
+    folder = os.path.abspath(folder)
+    temp_folder = '{}.{}.{}.tmp'.format(folder, os.getpid(), threading.get_ident())
+    conn = sqlite3.connect(sql_path)
+    try:
+        c = conn.cursor()
+        c.execute(
+            'SELECT ReportDataDictionaryIndex, IndexGroup, KeyValue, Name, Units '
+            'FROM ReportDataDictionary WHERE {}'.format(where), params)
+        dict_rows = sorted(c.fetchall(), key=lambda row: (row[3], row[2], row[0]))
+        c.execute('SELECT TimeIndex, Month, Day, Hour FROM Time WHERE IntervalType = ? '
+                  'ORDER BY TimeIndex', (HOURLY_INTERVAL,))
+        time_table = np.array(c.fetchall(), dtype=int).reshape(-1, 4)
+
+        os.makedirs(temp_folder)
+        values = np.lib.format.open_memmap(
+            os.path.join(temp_folder, HourlyResults.VALUES_FILE), mode='w+',
+            dtype=np.float32, shape=(len(dict_rows), len(time_table)))
+        if len(dict_rows) != 0 and len(time_table) != 0:
+            # look up the position of each dictionary index and time index
+            dict_indices = np.array([row[0] for row in dict_rows])
+            row_position = np.zeros(dict_indices.max() + 1, int)
+            row_position[dict_indices] = np.arange(len(dict_rows))
+            time_position = np.full(time_table[:, 0].max() + 1, -1)
+            time_position[time_table[:, 0]] = np.arange(len(time_table))
+            scale = np.array([1 / 3600000. if row[4] == 'J' else 1. for row in dict_rows])
+            c.execute(
+                'SELECT ReportData.ReportDataDictionaryIndex, TimeIndex, Value '
+                'FROM ReportData INNER JOIN ReportDataDictionary ON '
+                'ReportData.ReportDataDictionaryIndex = '
+                'ReportDataDictionary.ReportDataDictionaryIndex '
+                'WHERE {}'.format(where), params)
+            while True:
+                chunk = c.fetchmany(HOURLY_FETCH_SIZE)
+                if len(chunk) == 0:
+                    break
+                chunk = np.array(chunk, dtype=float)
+                rows = row_position[chunk[:, 0].astype(int)]
+                times = chunk[:, 1].astype(int)
+                cols = np.full(len(times), -1)
+                known = times < len(time_position)
+                cols[known] = time_position[times[known]]
+                valid = cols >= 0
+                values[rows[valid], cols[valid]] = \
+                    chunk[valid, 2] * scale[rows[valid]]
+        values.flush()
+        del values
+
+        # write the times of each column and the output and key of each row
+        np.save(os.path.join(temp_folder, HourlyResults.TIME_FILE),
+                time_table[:, 1:].T.astype(np.int16))
+        series = [
+            {'output': row[3], 'key': row[2], 'group': row[1],
+             'units': 'kWh' if row[4] == 'J' else row[4]}
+            for row in dict_rows
+        ]
+        with open(os.path.join(temp_folder, HourlyResults.META_FILE), 'w') as f:
+            json.dump({'series': series}, f)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        os.replace(temp_folder, folder)
+    finally:
+        conn.close()  # ensure connection is always closed
+        shutil.rmtree(temp_folder, ignore_errors=True)
+    return HourlyResults(folder)
+
+
+class HourlyResults(object):
+    """Hourly values of EnergyPlus outputs that are memory-mapped from files on disk.
+
+    Only the list of outputs and keys is read when the object is created. The
+    array of values is memory-mapped the first time that it is used so only the
+    rows that are needed get paged in, and totals, monthly rollups, daily profiles
+    and data collections are only computed when they are requested.
+
+    Args:
+        folder: Path to a folder that was written by write_hourly_results.
+
+    Properties:
+        * folder
+        * output_names
+        * months
+        * days
+        * hours
+        * is_annual
+    """
+    VALUES_FILE = 'values.npy'
+    TIME_FILE = 'time.npy'
+    META_FILE = 'hourly.json'
+
+    def __init__(self, folder):
+        self._folder = os.path.abspath(str(folder))
+        with open(os.path.join(self._folder, self.META_FILE)) as f:
+            self._series = json.load(f)['series']
+        self._rows_by_name = {}  # output name to the first and last row plus one
+        for i, series in enumerate(self._series):
+            start, _ = self._rows_by_name.get(series['output'], (i, i))
+            self._rows_by_name[series['output']] = (start, i + 1)
+        self._values = None
+        self._times = None
+
+    @property
+    def folder(self):
+        """Get the path to the folder of the hourly results."""
+        return self._folder
+
+    @property
+    def output_names(self):
+        """Get a sorted list of the names of the outputs with hourly values."""
+        return sorted(self._rows_by_name)
+
+    @property
+    def months(self):
+        """Get an array of the month of each hour from 1 to 12."""
+        return self._time_table()[0]
+
+    @property
+    def days(self):
+        """Get an array of the day of the month of each hour."""
+        return self._time_table()[1]
+
+    @property
+    def hours(self):
+        """Get an array of the hour of the day of each hour from 0 to 23.
+
+        This is the hour at the start of the period of each value, while EnergyPlus
+        reports the hour at the end of it.
+        """
+        return self._time_table()[2] - 1
+
+    @property
+    def is_annual(self):
+        """Get a boolean for whether the values cover every hour of a year."""
+        return self._time_table().shape[1] in (8760, 8784)
+
+    def keys(self, output_name):
+        """Get a list of the keys (eg. zone names) of the rows of an output.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+        """
+        start, stop = self._rows_by_name.get(output_name, (0, 0))
+        return [series['key'] for series in self._series[start:stop]]
+
+    def array(self, output_name):
+        """Get a read-only array of the hourly values of an output with one row per key.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+        """
+        start, stop = self._rows_by_name.get(output_name, (0, 0))
+        return self._value_array()[start:stop]
+
+    def total(self, output_name):
+        """Get an array of the hourly values of an output summed over all keys.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+        """
+        return self.array(output_name).sum(axis=0, dtype=np.float64)
+
+    def monthly(self, output_name):
+        """Get an array of the monthly totals of an output summed over all keys.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+        """
+        return np.bincount(
+            self.months - 1, weights=self.total(output_name), minlength=12)
+
+    def daily(self, output_name):
+        """Get an array of the daily totals of an output summed over all keys.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+        """
+        return self.total(output_name).reshape(-1, 24).sum(axis=1)
+
+    def peak(self, output_name):
+        """Get the hour at which the total of an output over all keys is highest.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+
+        Returns:
+            A tuple with the month, day and hour (from 0 to 23) of the peak and
+            the value at the peak. None if the output has no values.
+        """
+        total = self.total(output_name)
+        if len(total) == 0:
+            return None
+        i = int(np.argmax(total))
+        return int(self.months[i]), int(self.days[i]), int(self.hours[i]), \
+            float(total[i])
+
+    def average_day(self, output_name, month=None):
+        """Get the average value of each hour of the day for an output.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+            month: An optional integer from 1 to 12 for the month to be averaged.
+                If None, all days are averaged. (Default: None).
+
+        Returns:
+            An array of 24 values with the average total over all keys for each
+            hour of the day.
+        """
+        total = self.total(output_name)
+        if month is not None:
+            total = total[self.months == month]
+        if len(total) == 0:
+            return np.zeros(24)
+        return total.reshape(-1, 24).mean(axis=0)
+
+    def data_collections(self, output_name):
+        """Get a list of HourlyContinuousCollections for each key of an output.
+
+        This is the only method that creates Python floats for every hour and it
+        is meant for charts that need ladybug data collections.
+
+        Args:
+            output_name: The name of an EnergyPlus output.
+        """
+        if not self.is_annual:
+            raise ValueError('Hourly data collections need values for a full year.')
+        start, stop = self._rows_by_name.get(output_name, (0, 0))
+        a_period = AnalysisPeriod(is_leap_year=self._time_table().shape[1] == 8784)
+        data_colls = []
+        for series, values in zip(self._series[start:stop], self.array(output_name)):
+            data_type, units = SQLiteResult._data_type_from_unit(
+                series['units'], output_name)
+            meta_data = {'type': output_name, series['group']: series['key']}
+            header = Header(data_type, units, a_period, meta_data)
+            data_colls.append(HourlyContinuousCollection(header, values.tolist()))
+        return data_colls
+
+    def _value_array(self):
+        """Get the memory-mapped array of values, opening it if it is not open."""
+        if self._values is None:
+            self._values = np.load(
+                os.path.join(self._folder, self.VALUES_FILE), mmap_mode='r')
+        return self._values
+
+    def _time_table(self):
+        """Get an array of the month, day and hour of each column of values."""
+        if self._times is None:
+            self._times = np.load(
+                os.path.join(self._folder, self.TIME_FILE)).astype(int)
+        return self._times
+
+    def __repr__(self):
+        return 'HourlyResults: {}'.format(self._folder)
+
+
+class EnergyResults(object):
+    """Monthly energy results of a simulation that are never changed once loaded.
+
+    The monthly values of each end use and load balance term are held as
+    read-only arrays in kWh/m2. Views of the results in the units, normalization
+    and COPs used for display are computed from these arrays the first time they
+    are requested and are reused after that, such that changing a display setting
+    back and forth only looks up a view.
+
+    Args:
+        load_terms: A list of MonthlyCollections for the EUI of each end use
+            in kWh/m2.
+        balance: A list of MonthlyCollections for the EUI of each term of the
+            load balance in kWh/m2.
+        floor_area: Number for the floor area of the model in square meters.
+        load_matrix: An optional LoadMatrix with the monthly energy use of each
+            Room, from which the room summary tables of the views are made.
+            (Default: None).
+        max_views: Integer for the maximum number of views that are kept in
+            memory. (Default: 16).
+
+    Properties:
+        * load_terms
+        * balance
+        * floor_area
+        * load_matrix
+        * end_uses
+        * balance_terms
+        * load_values
+        * balance_values
+    """
+
+    def __init__(self, load_terms, balance, floor_area, load_matrix=None,
+                 max_views=RESULTS_VIEW_CACHE_SIZE):
+        self._load_terms = tuple(load_terms)
+        self._balance = tuple(balance)
+        self._floor_area = float(floor_area)
+        self._load_matrix = load_matrix
+        self._max_views = int(max_views)
+        self._load_values = self._monthly_values(self._load_terms)
+        self._balance_values = self._monthly_values(self._balance)
+        self._load_values.setflags(write=False)
+        self._balance_values.setflags(write=False)
+        self._views = OrderedDict()
+
+    @property
+    def load_terms(self):
+        """Get a tuple of the MonthlyCollections of the EUI of each end use in kWh/m2."""
+        return self._load_terms
+
+    @property
+    def balance(self):
+        """Get a tuple of the MonthlyCollections of each balance term in kWh/m2."""
+        return self._balance
+
+    @property
+    def floor_area(self):
+        """Get the floor area of the model in square meters."""
+        return self._floor_area
+
+    @property
+    def load_matrix(self):
+        """Get the LoadMatrix of the energy use of each Room or None if it is not known."""
+        return self._load_matrix
+
+    @property
+    def end_uses(self):
+        """Get a list of the names of the end uses."""
+        return [data.header.metadata['type'] for data in self._load_terms]
+
+    @property
+    def balance_terms(self):
+        """Get a list of the names of the balance terms."""
+        return [data.header.metadata['type'] for data in self._balance]
+
+    @property
+    def load_values(self):
+        """Get a read-only array of the monthly EUI with the shape (end uses, months)."""
+        return self._load_values
+
+    @property
+    def balance_values(self):
+        """Get a read-only array of the monthly balance with the shape (terms, months)."""
+        return self._balance_values
+
+    def view(self, ip_units=False, normalize=True, heat_cop=1, cool_cop=1):
+        """Get a view of the results for a combination of display settings.
+
+        Args:
+            ip_units: Boolean to indicate whether IP units should be used.
+            normalize: Boolean to indicate whether the results should be
+                normalized by the floor area rather than totaled over it.
+            heat_cop: Number for the COP by which heating is divided.
+            cool_cop: Number for the COP by which cooling is divided.
+
+        Returns:
+            A ResultsView, which is shared by every call with the same settings
+            and so should not be changed.
+        """
+        key = (bool(ip_units), bool(normalize), float(heat_cop), float(cool_cop))
+        view = self._views.get(key)
+        if view is not None:
+            self._views.move_to_end(key)
+            return view
+        view = self._views[key] = ResultsView(self, *key)
+        while len(self._views) > self._max_views:
+            self._views.popitem(last=False)
+        return view
+
+    @staticmethod
+    def _monthly_values(data_colls):
+        """Get an array of the values of MonthlyCollections with one row per collection."""
+        if len(data_colls) == 0:
+            return np.zeros((0, 12))
+        return np.array([data.values for data in data_colls], dtype=float)
+
+    def __repr__(self):
+        return 'EnergyResults: {} end uses x {} balance terms'.format(
+            len(self._load_terms), len(self._balance))
+
+
+class ResultsView(object):
+    """The results of a simulation in the units, normalization and COPs of the display.
+
+    Args:
+        results: The EnergyResults from which the view is computed.
+        ip_units: Boolean to indicate whether IP units should be used.
+        normalize: Boolean to indicate whether the results should be
+            normalized by the floor area rather than totaled over it.
+        heat_cop: Number for the COP by which heating is divided.
+        cool_cop: Number for the COP by which cooling is divided.
+
+    Properties:
+        * ip_units
+        * normalize
+        * heat_cop
+        * cool_cop
+        * units
+        * end_uses
+        * load_terms
+        * balance
+        * load_values
+        * balance_values
+        * totals
+    """
+
+    def __init__(self, results, ip_units, normalize, heat_cop, cool_cop):
+        self._results = results
+        self._ip_units = ip_units
+        self._normalize = normalize
+        self._heat_cop = heat_cop
+        self._cool_cop = cool_cop
+        self._room_table = None
+
+        # scale the values of all terms at once to the display units
+        if normalize:
+            self._units = 'kBtu/ft2' if ip_units else 'kWh/m2'
+            factor, data_type = IP_INTENSITY if ip_units else 1, EnergyIntensity()
+        else:
+            self._units = 'kBtu' if ip_units else 'kWh'
+            factor = results.floor_area * (IP_ENERGY if ip_units else 1)
+            data_type = Energy()
+        cops = {'Cooling': cool_cop, 'Heating': heat_cop}
+        self._end_uses = results.end_uses
+        self._cop_factors = np.array(
+            [1 / cops.get(end_use, 1) for end_use in self._end_uses])
+        self._load_values = \
+            results.load_values * (factor * self._cop_factors)[:, None]
+        self._balance_values = results.balance_values * factor
+        self._totals = self._load_values.sum(axis=1)
+        for values in (self._load_values, self._balance_values, self._totals):
+            values.setflags(write=False)
+
+        # create new data collections such that the results are never changed
+        self._load_terms = self._collections(
+            results.load_terms, self._load_values, data_type)
+        self._balance = self._collections(
+            results.balance, self._balance_values, data_type)
+
+    @property
+    def ip_units(self):
+        """Get a boolean for whether the view is in IP units."""
+        return self._ip_units
+
+    @property
+    def normalize(self):
+        """Get a boolean for whether the view is normalized by the floor area."""
+        return self._normalize
+
+    @property
+    def heat_cop(self):
+        """Get the COP by which heating is divided."""
+        return self._heat_cop
+
+    @property
+    def cool_cop(self):
+        """Get the COP by which cooling is divided."""
+        return self._cool_cop
+
+    @property
+    def units(self):
+        """Get text for the units of the values of the view (eg. kWh/m2)."""
+        return self._units
+
+    @property
+    def end_uses(self):
+        """Get a list of the names of the end uses."""
+        return self._end_uses
+
+    @property
+    def load_terms(self):
+        """Get a tuple of the MonthlyCollections of each end use in the view units."""
+        return self._load_terms
+
+    @property
+    def balance(self):
+        """Get a tuple of the MonthlyCollections of each balance term in the view units."""
+        return self._balance
+
+    @property
+    def load_values(self):
+        """Get a read-only array of the monthly values with the shape (end uses, months)."""
+        return self._load_values
+
+    @property
+    def balance_values(self):
+        """Get a read-only array of the monthly balance with the shape (terms, months)."""
+        return self._balance_values
+
+    @property
+    def totals(self):
+        """Get a read-only array of the annual total of each end use."""
+        return self._totals
+
+    def room_table(self, sort_by=None, descending=True, top=None):
+        """Get a DataFrame with the annual energy use of each Room in the view units.
+
+        The table has a Room column, a column for each end use and a Total column.
+        It is computed for all Rooms with array operations the first time it is
+        requested and only sorted and filtered after that.
+
+        Args:
+            sort_by: Optional text for the name of the column by which the Rooms
+                are sorted. If None, the Rooms are in the order of the model.
+            descending: Boolean to note whether the Rooms are sorted from the
+                largest value to the smallest. (Default: True).
+            top: An optional integer for the number of Rooms to be returned,
+                which are the first Rooms after sorting. If None, all Rooms
+                are returned. (Default: None).
+        """
+        if self._room_table is None:
+            self._room_table = self._compute_room_table()
+        table = self._room_table
+        if sort_by is not None:
+            table = table.sort_values(sort_by, ascending=not descending, kind='stable')
+        if top is not None:
+            table = table.head(top)
+        return table
+
+    def _compute_room_table(self):
+        """Compute the table of the annual energy use of each Room."""
+        matrix = self._results.load_matrix
+        if matrix is None:
+            return pd.DataFrame(columns=['Room'] + self._end_uses + ['Total'])
+
+        # get the intensity of each room with floor area in the order of the end uses
+        rooms = matrix.floor_areas != 0
+        uses = [matrix.end_uses.index(end_use) if end_use in matrix.end_uses else -1
+                for end_use in self._end_uses]
+        uses = np.array(uses, dtype=int).reshape(-1)
+        values = np.where(
+            matrix.has_data[rooms][:, uses] & (uses >= 0),
+            matrix.room_intensity()[rooms][:, uses], 0.)
+
+        # convert the intensity to the view units and total it over the end uses
+        if self._normalize:
+            values = values * (self._cop_factors * (
+                IP_INTENSITY if self._ip_units else 1))
+        else:  # total over the floor area times the multiplier of each room
+            areas = matrix.floor_areas[rooms] * matrix.multipliers[rooms]
+            values = values * areas[:, None] * (self._cop_factors * (
+                IP_ENERGY if self._ip_units else 1))
+        table = pd.DataFrame(values, columns=self._end_uses, dtype=float)
+        table.insert(0, 'Room', pd.array(
+            [name for name, keep in zip(matrix.room_names, rooms) if keep],
+            dtype='string'))
+        table['Total'] = values.sum(axis=1)
+        return table
+
+    def _collections(self, base_collections, values, data_type):
+        """Get MonthlyCollections like the base collections with values in view units."""
+        data_colls = []
+        for data, vals in zip(base_collections, values):
+            header = Header(data_type, self._units, data.header.analysis_period,
+                            dict(data.header.metadata))
+            data_colls.append(MonthlyCollection(header, vals.tolist(), data.datetimes))
+        return tuple(data_colls)
+
+    def __repr__(self):
+        return 'ResultsView: {}'.format(self._units)
@@ -0,0 +1,467 @@
+"""Columnar store of the results of every simulation for fast queries across runs."""
+import os
+import json
+import time
+import operator
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Room Creation inputs that are stored with the results of each run
+RUN_PARAMETERS = (
+    'width', 'depth', 'height', 'orientation', 'wwr',
+    'hor_num', 'hor_depth', 'vert_num', 'vert_depth'
+)
+
+# number of runs and rooms that the columns can hold when the store is created,
+# which is doubled every time the store runs out of space
+INITIAL_CAPACITY = 1024
+
+# Version of the layout of the columns, which is checked when the store is opened
+STORE_VERSION = '1'
+
+OPERATORS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge
+}
+
+
+@st.cache_resource
+def results_store(target_folder):
+    """Get the store of simulation results shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+    """
+    return ResultsStore(os.path.join(str(target_folder), 'data', 'results_store'))
+
+
+class ResultsStore(object):
+    """A persistent, memory-mapped table of the results of every simulation.
+
+    Each column is a NumPy file that is memory-mapped such that opening the store
+    does not read the results and queries only touch the columns they use. Every
+    run has its room inputs, floor area, weather file and the monthly EUI of each
+    end use and balance term. The annual EUI of each room of the run is kept in a
+    separate table of rooms. Text values like the weather file and the room names
+    are stored as integer codes into lists in the metadata of the store.
+
+    Columns are allocated with spare rows that are filled as runs are added and
+    their size is doubled whenever they are full. The number of runs is only
+    written to the metadata after the rows of a run are written such that a store
+    that was interrupted while adding a run is never left with a partial run.
+
+    Args:
+        folder: Path to the folder of the store. It will be created if it
+            does not exist.
+
+    Properties:
+        * folder
+        * end_uses
+        * balance_terms
+        * locations
+    """
+    META_FILE = 'meta.json'
+
+    def __init__(self, folder):
+        self._folder = os.path.abspath(str(folder))
+        if not os.path.isdir(self._folder):
+            os.makedirs(self._folder)
+        self._lock = threading.Lock()
+        self._columns = {}  # column name to its memory-mapped array
+        self._meta = self._read_meta()
+        if self._meta is None or self._meta['version'] != STORE_VERSION:
+            self._meta = {
+                'version': STORE_VERSION, 'runs': 0, 'rooms': 0,
+                'capacity': INITIAL_CAPACITY, 'room_capacity': INITIAL_CAPACITY,
+                'end_uses': [], 'balance_terms': [], 'units': [],
+                'weather': [], 'room_names': []
+            }
+            for name in os.listdir(self._folder):
+                if name.endswith('.npy'):
+                    os.remove(os.path.join(self._folder, name))
+            self._write_meta()
+        self._index = None  # run ID to row, built the first time it is needed
+        self._codes = {}  # name of a list in the metadata to a dict of text to code
+
+    @property
+    def folder(self):
+        """Get the path to the folder of the store."""
+        return self._folder
+
+    @property
+    def end_uses(self):
+        """Get a list of the names of the end uses of the EUI columns."""
+        return list(self._meta['end_uses'])
+
+    @property
+    def balance_terms(self):
+        """Get a list of the names of the terms of the balance column."""
+        return list(self._meta['balance_terms'])
+
+    @property
+    def locations(self):
+        """Get a list of the city of each weather file in the store."""
+        return [weather['city'] for weather in self._meta['weather']]
+
+    def add(self, run_id, sql_results, params=None, weather_key=None, location=None):
+        """Add the results of a simulation to the store.
+
+        Results are never changed for a given run ID and so a run that is already
+        in the store is not added again.
+
+        Args:
+            run_id: Text for the unique ID of the run, which is typically the key
+                of the simulation in the simulation cache.
+            sql_results: A dictionary of results output from load_sql_data.
+            params: An optional dictionary of the room inputs of the simulated
+                model. Inputs that are not specified are stored as NaN.
+            weather_key: Text for the hash of the EPW file of the simulation.
+            location: An optional Ladybug Location of the EPW file, which is used
+                to query the runs by city.
+
+        Returns:
+            The row of the run in the store.
+        """
+        params = params or {}
+        with self._lock:
+            index = self._run_index()
+            if run_id in index:
+                return index[run_id]
+
+            # get the codes of the text values and any new end uses or terms
+            eui = {d.header.metadata['type']: np.asarray(d.values, dtype=np.float32)
+                   for d in sql_results['load_terms']}
+            balance = {d.header.metadata['type']: np.asarray(d.values, dtype=np.float32)
+                       for d in sql_results['balance']}
+            for end_use in eui:
+                self._code('end_uses', end_use)
+            for term in balance:
+                self._code('balance_terms', term)
+            weather_code = -1
+            if weather_key is not None:
+                weather_code = self._code('weather', weather_key, {
+                    'key': weather_key,
+                    'city': location.city if location is not None else '',
+                    'country': location.country if location is not None else '',
+                    'latitude': location.latitude if location is not None else None,
+                    'longitude': location.longitude if location is not None else None
+                })
+            units_code = self._code('units', params.get('units') or '')
+            load_matrix = sql_results['load_matrix']
+            room_codes = [self._code('room_names', name)
+                          for name in load_matrix.room_names]
+
+            # make space for the run and its rooms
+            row, room_start = self._meta['runs'], self._meta['rooms']
+            room_count = len(room_codes)
+            self._reserve(row + 1, room_start + room_count)
+
+            # write the columns of the run
+            col = self._column
+            col('id')[row] = run_id.encode('ascii')
+            for name in RUN_PARAMETERS:
+                col(name)[row] = float(params[name]) if name in params else np.nan
+            col('floor_area')[row] = sql_results['floor_area']
+            col('preview')[row] = sql_results['preview']
+            col('units')[row] = units_code
+            col('weather')[row] = weather_code
+            col('added')[row] = time.time()
+            col('room_start')[row] = room_start
+            col('room_count')[row] = room_count
+            monthly = np.full((12, len(self._meta['end_uses'])), np.nan, np.float32)
+            for end_use, values in eui.items():
+                monthly[:, self._meta['end_uses'].index(end_use)] = values
+            col('eui')[row] = monthly
+            col('annual')[row] = monthly.sum(axis=0)
+            terms = np.full((12, len(self._meta['balance_terms'])), np.nan, np.float32)
+            for term, values in balance.items():
+                terms[:, self._meta['balance_terms'].index(term)] = values
+            col('balance')[row] = terms
+
+            # write the rooms of the run
+            rooms = slice(room_start, room_start + room_count)
+            intensity = np.full((room_count, len(self._meta['end_uses'])), np.nan,
+                                np.float32)
+            uses = [self._meta['end_uses'].index(u) for u in load_matrix.end_uses]
+            room_eui = load_matrix.room_intensity()
+            intensity[:, uses] = np.where(load_matrix.has_data, room_eui, np.nan)
+            col('room_run')[rooms] = row
+            col('room_name')[rooms] = room_codes
+            col('room_floor_area')[rooms] = load_matrix.floor_areas
+            col('room_multiplier')[rooms] = load_matrix.multipliers
+            col('room_eui')[rooms] = intensity
+
+            # flush the rows before they are counted in the metadata
+            for array in self._columns.values():
+                array.flush()
+            self._meta['runs'], self._meta['rooms'] = row + 1, room_start + room_count
+            self._write_meta()
+            index[run_id] = row
+            return row
+
+    def query(self, conditions=(), location=None, sort_by=None, descending=False,
+              limit=None, include_preview=False):
+        """Get a table of the runs that match a set of conditions.
+
+        Args:
+            conditions: A list of (column, operator, value) tuples that must all be
+                True for a run to be selected (eg. [('wwr', '>', 0.5)]). Columns
+                can be any of the RUN_PARAMETERS, floor_area, the name of an end
+                use for its annual EUI or Total for the sum of all end uses.
+                Operators can be ==, !=, <, <=, > or >=.
+            location: Optional text that must be in the city of the weather file
+                of the runs, ignoring case (eg. Denver).
+            sort_by: Optional name of a column by which the runs are sorted.
+                Runs without a value for the column are last.
+            descending: Boolean to note whether the runs are sorted from the
+                largest value to the smallest. (Default: False).
+            limit: Optional integer for the maximum number of runs returned.
+            include_preview: Boolean to note whether the results of preview
+                simulations are included. (Default: False).
+
+        Returns:
+            A pandas DataFrame with one row for each run, which has the run ID,
+            the city, the units, the room inputs, the floor area and the annual
+            EUI of each end use along with the Total.
+        """
+        with self._lock:
+            count = self._meta['runs']
+            mask = np.ones(count, dtype=bool)
+            if not include_preview:
+                mask &= ~self._column('preview')[:count]
+            if location is not None:
+                codes = [i for i, weather in enumerate(self._meta['weather'])
+                         if location.lower() in weather['city'].lower()]
+                mask &= np.isin(self._column('weather')[:count], codes)
+            for name, op, value in conditions:
+                mask &= OPERATORS[op](self._values(name, count), value)
+            rows = np.flatnonzero(mask)
+            if sort_by is not None:
+                values = self._values(sort_by, count)[rows]
+                order = np.argsort(-values if descending else values, kind='stable')
+                rows = rows[order]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._table(rows)
+
+    def monthly(self, run_id):
+        """Get a DataFrame of the monthly EUI of each end use and balance term of a run.
+
+        Args:
+            run_id: Text for the ID of a run in the store.
+        """
+        with self._lock:
+            row = self._run_index()[run_id]
+            data = dict(zip(self._meta['end_uses'], self._column('eui')[row].T))
+            for term, values in zip(self._meta['balance_terms'],
+                                    self._column('balance')[row].T):
+                data['Balance {}'.format(term)] = values
+            return pd.DataFrame(data, index=range(1, 13))
+
+    def gather(self, run_ids):
+        """Get the monthly arrays of a list of runs in a single read of each column.
+
+        Args:
+            run_ids: A list of the IDs of runs, which do not need to be in the store.
+
+        Returns:
+            A tuple with three items.
+
+            -   rows: An array with the row of each run in the store, which is -1
+                for runs that are not in the store.
+
+            -   eui: An array of the monthly EUI of each end use with the shape
+                (runs in the store, 12, end uses) in the order of the run_ids.
+
+            -   balance: An array of the monthly EUI of each balance term with the
+                shape (runs in the store, 12, balance terms).
+        """
+        with self._lock:
+            index = self._run_index()
+            rows = np.array([index.get(run_id, -1) for run_id in run_ids], dtype=int)
+            found = rows[rows >= 0]
+            return rows, self._column('eui')[found], self._column('balance')[found]
+
+    def rooms(self, run_id):
+        """Get a DataFrame of the annual EUI of each end use for every room of a run.
+
+        Args:
+            run_id: Text for the ID of a run in the store.
+        """
+        with self._lock:
+            row = self._run_index()[run_id]
+            start = int(self._column('room_start')[row])
+            rooms = slice(start, start + int(self._column('room_count')[row]))
+            names = self._meta['room_names']
+            table = pd.DataFrame({
+                'Room': [names[c] for c in self._column('room_name')[rooms]],
+                'Floor Area': self._column('room_floor_area')[rooms],
+                'Multiplier': self._column('room_multiplier')[rooms]
+            })
+            room_eui = self._column('room_eui')[rooms]
+            for i, end_use in enumerate(self._meta['end_uses']):
+                table[end_use] = room_eui[:, i]
+            return table
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the store."""
+        size = sum(os.path.getsize(os.path.join(self._folder, f))
+                   for f in os.listdir(self._folder))
+        return {
+            'runs': self._meta['runs'],
+            'rooms': self._meta['rooms'],
+            'capacity': self._meta['capacity'],
+            'locations': len(self._meta['weather']),
+            'size': size
+        }
+
+    def _column_spec(self, name):
+        """Get the dtype, the table and the shape of each row of a column."""
+        end_uses = len(self._meta['end_uses'])
+        specs = {
+            'id': ('S64', 'runs', ()),
+            'floor_area': (np.float64, 'runs', ()),
+            'preview': (np.bool_, 'runs', ()),
+            'units': (np.int16, 'runs', ()),
+            'weather': (np.int32, 'runs', ()),
+            'added': (np.float64, 'runs', ()),
+            'room_start': (np.int64, 'runs', ()),
+            'room_count': (np.int32, 'runs', ()),
+            'eui': (np.float32, 'runs', (12, end_uses)),
+            'annual': (np.float32, 'runs', (end_uses,)),
+            'balance': (np.float32, 'runs', (12, len(self._meta['balance_terms']))),
+            'room_run': (np.int32, 'rooms', ()),
+            'room_name': (np.int32, 'rooms', ()),
+            'room_floor_area': (np.float64, 'rooms', ()),
+            'room_multiplier': (np.int32, 'rooms', ()),
+            'room_eui': (np.float32, 'rooms', (end_uses,))
+        }
+        if name in RUN_PARAMETERS:
+            return np.float64, 'runs', ()
+        return specs[name]
+
+    def _column(self, name):
+        """Get the memory-mapped array of a column, creating or resizing it if needed."""
+        dtype, table, row_shape = self._column_spec(name)
+        capacity = self._meta['capacity'] if table == 'runs' else \
+            self._meta['room_capacity']
+        shape = (capacity,) + row_shape
+        array = self._columns.get(name)
+        if array is not None and array.shape == shape:
+            return array
+        file_path = os.path.join(self._folder, name + '.npy')
+        if array is None and os.path.isfile(file_path):
+            array = np.lib.format.open_memmap(file_path, mode='r+')
+            if array.shape == shape:
+                self._columns[name] = array
+                return array
+
+        # write a new file for the column, copying the rows of the existing column
+        temp_file = '{}.{}.tmp'.format(file_path, os.getpid())
+        new_array = np.lib.format.open_memmap(temp_file, mode='w+', dtype=dtype,
+                                              shape=shape)
+        if np.issubdtype(new_array.dtype, np.floating):
+            new_array[:] = np.nan
+        if array is not None:
+            used = self._meta[table]
+            new_array[(slice(0, used),) + tuple(slice(0, s) for s in array.shape[1:])] = \
+                array[:used]
+        new_array.flush()
+        del new_array, array  # release the files before they are replaced
+        self._columns.pop(name, None)
+        os.replace(temp_file, file_path)
+        self._columns[name] = np.lib.format.open_memmap(file_path, mode='r+')
+        return self._columns[name]
+
+    def _reserve(self, runs, rooms):
+        """Double the capacity of the run and room tables until they fit a number of rows."""
+        while self._meta['capacity'] < runs:
+            self._meta['capacity'] *= 2
+        while self._meta['room_capacity'] < rooms:
+            self._meta['room_capacity'] *= 2
+
+    def _code(self, list_name, text, value=None):
+        """Get the integer code of text in a list of the metadata, adding it if it is new.
+
+        Args:
+            list_name: Text for the name of the list in the metadata.
+            text: Text to be encoded.
+            value: An optional dictionary to be added to the list instead of the
+                text, which must have the text under a "key" key.
+        """
+        codes = self._codes.get(list_name)
+        if codes is None:
+            codes = self._codes[list_name] = {
+                item['key'] if isinstance(item, dict) else item: i
+                for i, item in enumerate(self._meta[list_name])
+            }
+        if text not in codes:
+            codes[text] = len(self._meta[list_name])
+            self._meta[list_name].append(value if value is not None else text)
+        return codes[text]
+
+    def _run_index(self):
+        """Get a dictionary of the row of every run ID in the store."""
+        if self._index is None:
+            ids = self._column('id')[:self._meta['runs']]
+            self._index = {run_id.decode('ascii'): i for i, run_id in enumerate(ids)}
+        return self._index
+
+    def _values(self, name, count):
+        """Get an array of the values of a column that can be queried for every run."""
+        if name in RUN_PARAMETERS or name == 'floor_area':
+            return self._column(name)[:count]
+        if name == 'units':
+            return np.array(self._meta['units'], dtype=object)[
+                self._column('units')[:count]]
+        annual = self._column('annual')[:count]
+        if name == 'Total':
+            return np.nansum(annual, axis=1)
+        if name in self._meta['end_uses']:
+            return annual[:, self._meta['end_uses'].index(name)]
+        raise ValueError('"{}" is not a column that can be queried.'.format(name))
+
+    def _table(self, rows):
+        """Get a DataFrame of the runs at an array of rows."""
+        cities = np.array([w['city'] for w in self._meta['weather']] + [''],
+                          dtype=object)  # -1 codes for runs without weather
+        table = pd.DataFrame({
+            'Run': np.char.decode(self._column('id')[rows], 'ascii'),
+            'Location': cities[self._column('weather')[rows]],
+            'Units': np.array(self._meta['units'], dtype=object)[
+                self._column('units')[rows]]
+        })
+        for name in RUN_PARAMETERS:
+            table[name] = self._column(name)[rows]
+        table['floor_area'] = self._column('floor_area')[rows]
+        annual = self._column('annual')[rows]
+        for i, end_use in enumerate(self._meta['end_uses']):
+            table[end_use] = annual[:, i]
+        table['Total'] = np.nansum(annual, axis=1)
+        return table
+
+    def _read_meta(self):
+        """Read the metadata of the store or get None if it does not exist."""
+        try:
+            with open(os.path.join(self._folder, self.META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self):
+        """Write the metadata of the store through a temporary file."""
+        meta_file = os.path.join(self._folder, self.META_FILE)
+        temp_file = '{}.{}.tmp'.format(meta_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(self._meta, f)
+        os.replace(temp_file, meta_file)
+
+    def __len__(self):
+        return self._meta['runs']
+
+    def __repr__(self):
+        return 'ResultsStore: {} runs'.format(self._meta['runs'])
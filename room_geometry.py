@@ -0,0 +1,458 @@
+"""Functions for creating the Honeybee Model of a room from the Room Creation inputs."""
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+
+from ladybug_geometry.geometry2d import Vector2D
+from ladybug_geometry.geometry3d import Point3D, Mesh3D
+from honeybee.facetype import Floor
+from honeybee.room import Room
+from honeybee.model import Model
+from honeybee_radiance.properties.model import ModelRadianceProperties
+from honeybee_radiance.sensorgrid import SensorGrid
+
+from cache import ArtifactStore, content_hash
+from visualize_model import SceneCache
+
+# number of room models that are kept in memory by the GeometryCache
+GEOMETRY_CACHE_SIZE = 64
+# number of sensor grids that are kept in memory by the GridCache
+GRID_CACHE_SIZE = 64
+# dimension of the sensor grid cells and distance of the grid above the floor
+GRID_SPACING = 2
+GRID_OFFSET = 2.5
+
+
+@st.cache_resource
+def artifact_store(target_folder):
+    """Get the store of HBJSON and vtkjs files shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    return ArtifactStore(os.path.join(str(target_folder), 'data', 'models'))
+
+
+@st.cache_resource
+def geometry_cache(target_folder):
+    """Get the cache of room models shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    return GeometryCache(artifact_store(target_folder))
+
+
+def artifact_name(model, extension):
+    """Get the name of a file for a Model in the artifact store.
+
+    Each units system gets its own sub-folder since the Model identifier does
+    not include the units.
+
+    Args:
+        model: A Honeybee Model.
+        extension: Text for the file extension, including the dot (eg. ".vtkjs").
+    """
+    return '{}/{}{}'.format(model.units.lower(), model.identifier, extension)
+
+
+def model_identifier(width, depth, height, orientation, wwr, hor_num=0, hor_depth=0,
+                     vert_num=0, vert_depth=0):
+    """Get the identifier of the Model that is built from a set of room inputs."""
+    return 'model_{}_{}_{}_{}_{}_{}_{}_{}_{}'.format(
+        width, depth, height, wwr, orientation, hor_depth, hor_num,
+        vert_depth, vert_num)
+
+
+def floor_grid_mesh(geometry, x_dim, offset):
+    """Get a Mesh3D of grid cells that are offset above a floor Face3D.
+
+    This gives the same mesh as geometry.mesh_grid(x_dim, None, offset, True)
+    but rectangular floors are gridded with NumPy arrays since all of their
+    cells are inside the floor and none have to be tested and removed.
+
+    Args:
+        geometry: A Face3D of a floor, which points down.
+        x_dim: Number for the dimension of the grid cells.
+        offset: Number for the distance of the grid above the floor.
+    """
+    polygon = geometry.polygon2d
+    width, depth = polygon.max.x - polygon.min.x, polygon.max.y - polygon.min.y
+    if len(polygon.vertices) != 4 or \
+            abs(polygon.area - width * depth) > 1e-6 * width * depth:
+        return geometry.mesh_grid(x_dim, None, offset, True)
+
+    # vertices and cells are ordered along y and then x like Mesh2D.from_grid
+    num_x, num_y = max(int(width / x_dim), 1), max(int(depth / x_dim), 1)
+    dim_x, dim_y = width / num_x, depth / num_y
+    x = polygon.min.x + dim_x * np.arange(num_x + 1)
+    y = polygon.min.y + dim_y * np.arange(num_y + 1)
+    verts_2d = np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+    cent_2d = np.stack(np.meshgrid(x[:-1] + dim_x / 2, y[:-1] + dim_y / 2,
+                                   indexing='ij'), axis=-1).reshape(-1, 2)
+    start = (np.arange(num_x)[:, None] * (num_y + 1) + np.arange(num_y)).ravel()
+    faces = np.stack((start + 1, start + num_y + 2, start + num_y + 1, start), axis=1)
+
+    # move the grid above the floor and convert it to 3D coordinates
+    plane = geometry.plane.move(geometry.plane.n * -offset)
+    origin, axes = np.array(plane.o), np.array((plane.x, plane.y))
+    verts = verts_2d @ axes + origin
+    centroids = cent_2d @ axes + origin
+    mesh = Mesh3D(tuple(Point3D(*pt) for pt in verts.tolist()),
+                  tuple(tuple(face) for face in faces.tolist()))
+    mesh._face_areas = x_dim * x_dim
+    mesh._face_normals = geometry.plane.n.reverse()
+    mesh._vertex_normals = geometry.plane.n.reverse()
+    mesh._face_centroids = tuple(Point3D(*pt) for pt in centroids.tolist())
+    return mesh
+
+
+def room_sensor_grid(room, x_dim=GRID_SPACING, offset=GRID_OFFSET):
+    """Get a SensorGrid over the floors of a Room like Room.generate_grid.
+
+    The identifier of the grid is a hash of the floor geometry and the grid
+    inputs such that the same room always gets the same grid.
+
+    Args:
+        room: A Honeybee Room.
+        x_dim: Number for the dimension of the grid cells. (Default: 2).
+        offset: Number for the distance of the grid above the floor. (Default: 2.5).
+
+    Returns:
+        A SensorGrid or None if the Room has no floors that can be gridded.
+    """
+    floors = [face.geometry for face in room.faces if isinstance(face.type, Floor)]
+    meshes = []
+    for geometry in floors:
+        try:
+            meshes.append(floor_grid_mesh(geometry, x_dim, offset))
+        except AssertionError:  # grid tolerance not fine enough
+            pass
+    if len(meshes) == 0:
+        return None
+    mesh = meshes[0] if len(meshes) == 1 else Mesh3D.join_meshes(meshes)
+    identifier = 'Grid_{}'.format(grid_key(floors, x_dim, offset)[:16])
+    return SensorGrid.from_mesh3d(identifier, mesh)
+
+
+def grid_key(floors, x_dim, offset):
+    """Get a hash of the floor geometry and the inputs that are used to build a grid.
+
+    Args:
+        floors: A list of Face3D for the floors of a Room.
+        x_dim: Number for the dimension of the grid cells.
+        offset: Number for the distance of the grid above the floor.
+    """
+    vertices = [[pt.to_array() for pt in geometry.vertices] for geometry in floors]
+    return content_hash(json.dumps([vertices, float(x_dim), float(offset)]))
+
+
+def build_room_model(width, depth, height, orientation, wwr, hor_num=0, hor_depth=0,
+                     vert_num=0, vert_depth=0, units='Feet', grid_cache=None):
+    """Create a Model of a single shoebox Room with glazing, shading and a sensor grid.
+
+    Args:
+        width: Number for the width of the room.
+        depth: Number for the depth of the room.
+        height: Number for the floor-to-ceiling height of the room.
+        orientation: Number for the angle in degrees by which the room is
+            rotated clockwise in the XY plane.
+        wwr: Number between 0 and 1 for the window-to-wall ratio of the glazed wall.
+        hor_num: Integer for the number of horizontal overhangs over the window.
+            Zero means that no overhangs are added. (Default: 0).
+        hor_depth: Number for the depth of the horizontal overhangs. (Default: 0).
+        vert_num: Integer for the number of vertical fins over the window.
+            Zero means that no fins are added. (Default: 0).
+        vert_depth: Number for the depth of the vertical fins. (Default: 0).
+        units: Text for the units system of the model. (Default: Feet).
+        grid_cache: An optional GridCache from which the sensor grid is taken
+            so that it is not generated again for rooms with the same floor.
+    """
+    # create the room with a fixed identifier so that identical inputs produce
+    # an identical IDF and previous simulation results can be reused
+    room = Room.from_box(identifier='Room', width=width, depth=depth, height=height)
+    point_origin = Point3D(x=width / 2, y=depth / 2, z=0)
+    room.rotate_xy(-1 * orientation, point_origin)
+    grid = grid_cache.get(room) if grid_cache is not None else room_sensor_grid(room)
+
+    # add the glazing and the shading to the glazed wall
+    face = room.faces[1]
+    face.apertures_by_ratio(wwr)
+    aperture = face.apertures[0]
+    aperture_height = (aperture.max - aperture.min).z
+    aperture_width = (aperture.max.x - aperture.min.x)
+    if hor_num:
+        aperture.louvers_by_distance_between(
+            distance=aperture_height / hor_num, depth=hor_depth,
+            base_name='shade_hor', contour_vector=Vector2D(0, 1))
+    if vert_num:
+        aperture.louvers_by_distance_between(
+            distance=aperture_width / vert_num, depth=vert_depth,
+            contour_vector=Vector2D(1, 0), base_name='shade_vert')
+
+    # put everything together into a model
+    identifier = model_identifier(
+        width, depth, height, orientation, wwr, hor_num, hor_depth,
+        vert_num, vert_depth)
+    model = Model.from_objects(identifier=identifier, objects=[room], units=units)
+    model._properties._radiance = \
+        ModelRadianceProperties(model, [grid] if grid is not None else None)
+    return model
+
+
+def room_key(width, depth, height, orientation, wwr, hor_num=0, hor_depth=0,
+             vert_num=0, vert_depth=0, units='Feet'):
+    """Get a canonical hash of the room inputs that are used to build a Model.
+
+    Numbers are normalized such that inputs like 30 and 30.0 produce the same key.
+    """
+    params = {
+        'width': width, 'depth': depth, 'height': height,
+        'orientation': orientation, 'wwr': wwr, 'hor_num': hor_num,
+        'hor_depth': hor_depth, 'vert_num': vert_num, 'vert_depth': vert_depth
+    }
+    params = {name: float(value) for name, value in params.items()}
+    params['units'] = units
+    return content_hash(json.dumps(params, sort_keys=True))
+
+
+class GeometryCache(object):
+    """Cache of the Models built from room inputs and the files written for them.
+
+    The most recently used Models are held in memory such that a rerun of the
+    app with unchanged room inputs does not rebuild any geometry. The vtkjs
+    content of each Model is also held in memory so that the preview can be
+    redrawn without touching the disk and it is assembled from the layers of a
+    SceneCache so that a change to the shades does not rebuild the walls or
+    the sensor grid. Sensor grids are taken from a GridCache such that rooms
+    with the same floor share one grid. The HBJSON of each Model is only
+    written when it is requested and is not already in the artifact store.
+    Models returned by the cache are shared between sessions and should be
+    treated as read-only.
+
+    Args:
+        store: An ArtifactStore to which the HBJSON files will be written.
+        max_entries: Integer for the maximum number of Models kept in memory.
+            (Default: 64).
+
+    Properties:
+        * store
+        * scene_cache
+        * grid_cache
+        * max_entries
+        * hits
+        * misses
+    """
+
+    def __init__(self, store, max_entries=GEOMETRY_CACHE_SIZE):
+        self._store = store
+        self._max_entries = int(max_entries)
+        self._entries = OrderedDict()  # room key to Model
+        self._scenes = OrderedDict()  # Model units and identifier to vtkjs bytes
+        self._scene_cache = SceneCache(max_entries)
+        self._grid_cache = GridCache()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def store(self):
+        """Get the ArtifactStore to which the HBJSON files are written."""
+        return self._store
+
+    @property
+    def scene_cache(self):
+        """Get the SceneCache of the layers of the vtkjs previews."""
+        return self._scene_cache
+
+    @property
+    def grid_cache(self):
+        """Get the GridCache of the sensor grids of the Models."""
+        return self._grid_cache
+
+    @property
+    def max_entries(self):
+        """Get the maximum number of Models kept in memory."""
+        return self._max_entries
+
+    @property
+    def hits(self):
+        """Get the number of lookups that found a Model in memory."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of lookups that had to build a Model."""
+        return self._misses
+
+    def get(self, **params):
+        """Get the Model for a set of room inputs along with the path to its HBJSON.
+
+        Args:
+            params: Keyword arguments for build_room_model.
+
+        Returns:
+            A tuple with the Model and the path to its HBJSON file.
+        """
+        model = self.model(**params)
+        return model, self.hbjson(model)
+
+    def model(self, **params):
+        """Get the Model for a set of room inputs without writing any files.
+
+        Args:
+            params: Keyword arguments for build_room_model.
+        """
+        key = room_key(**params)
+        with self._lock:
+            model = self._entries.get(key)
+            if model is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        if model is None:
+            model = build_room_model(grid_cache=self._grid_cache, **params)
+            with self._lock:
+                self._entries[key] = model
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return model
+
+    def hbjson(self, model):
+        """Get the path to the HBJSON of a Model, writing it if it is not in the store.
+
+        Args:
+            model: A Model output from the model method.
+        """
+        name = artifact_name(model, '.hbjson')
+        hbjson_path = self._store.get(name)
+        if hbjson_path is None:  # never written or evicted from the store
+            hbjson_path = self._store.put(
+                name, lambda folder: model.to_hbjson(model.identifier, folder))
+        return hbjson_path
+
+    def vtkjs(self, model):
+        """Get the content of the vtkjs file of a Model, which is built in memory.
+
+        Args:
+            model: A Model output from the model method.
+
+        Returns:
+            The bytes of the vtkjs file of the Model.
+        """
+        key = (model.units, model.identifier)
+        with self._lock:
+            content = self._scenes.get(key)
+            if content is not None:
+                self._scenes.move_to_end(key)
+                return content
+        content = self._scene_cache.vtkjs(model)
+        with self._lock:
+            self._scenes[key] = content
+            while len(self._scenes) > self._max_entries:
+                self._scenes.popitem(last=False)
+        return content
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the cache."""
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries),
+            'scenes': len(self._scenes),
+            'layers': self._scene_cache.stats(),
+            'grids': self._grid_cache.stats(),
+            'max_entries': self._max_entries,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups != 0 else 0
+        }
+
+    def __repr__(self):
+        return 'GeometryCache: {} models'.format(len(self._entries))
+
+
+class GridCache(object):
+    """Cache of the sensor grids of rooms keyed by their floor geometry.
+
+    Rooms that only differ in their height, glazing or shading have the same
+    floor and reuse the same SensorGrid instead of generating it again. The
+    grids returned by the cache are shared between Models and should be
+    treated as read-only.
+
+    Args:
+        max_entries: Integer for the maximum number of grids kept in memory.
+            (Default: 64).
+
+    Properties:
+        * max_entries
+        * hits
+        * misses
+    """
+
+    def __init__(self, max_entries=GRID_CACHE_SIZE):
+        self._max_entries = int(max_entries)
+        self._entries = OrderedDict()  # grid key to SensorGrid
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def max_entries(self):
+        """Get the maximum number of grids kept in memory."""
+        return self._max_entries
+
+    @property
+    def hits(self):
+        """Get the number of lookups that found a grid in memory."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of lookups that had to generate a grid."""
+        return self._misses
+
+    def get(self, room, x_dim=GRID_SPACING, offset=GRID_OFFSET):
+        """Get the SensorGrid over the floors of a Room.
+
+        Args:
+            room: A Honeybee Room.
+            x_dim: Number for the dimension of the grid cells. (Default: 2).
+            offset: Number for the distance of the grid above the floor.
+                (Default: 2.5).
+
+        Returns:
+            A SensorGrid or None if the Room has no floors that can be gridded.
+        """
+        floors = [face.geometry for face in room.faces if isinstance(face.type, Floor)]
+        key = grid_key(floors, x_dim, offset)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+        grid = room_sensor_grid(room, x_dim, offset)
+        with self._lock:
+            self._entries[key] = grid
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return grid
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the cache."""
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self._max_entries,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups != 0 else 0
+        }
+
+    def __repr__(self):
+        return 'GridCache: {} grids'.format(len(self._entries))
@@ -0,0 +1,206 @@
+"""Cache of the outputs of study runs that are downloaded for the Results tab."""
+import os
+import shutil
+import zipfile
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+from honeybee_display.model import VisualizationSet
+from ladybug_vtk._extend_visualization_set import vs_to_vtkjs
+
+# number of runs whose parsed VisualizationSet and vtkjs are kept in memory
+RUN_RESULTS_CACHE_SIZE = 16
+
+
+@st.cache_resource
+def run_results_cache(target_folder):
+    """Get the cache of downloaded run outputs shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    return RunResultsCache(os.path.join(str(target_folder), 'data', 'results'))
+
+
+def extract_zip(zip_file, folder, chunk_size=1048576):
+    """Stream the members of a zip file into a folder without reading them into memory.
+
+    Args:
+        zip_file: A path or a file-like object of the zip file.
+        folder: Path to the folder into which the members are extracted.
+        chunk_size: Number of bytes that are copied at a time. (Default: 1 MB).
+    """
+    folder = os.path.abspath(folder)
+    with zipfile.ZipFile(zip_file) as zip_folder:
+        for member in zip_folder.infolist():
+            file_path = os.path.abspath(os.path.join(folder, member.filename))
+            if os.path.commonpath([folder, file_path]) != folder:
+                raise ValueError(
+                    'Zip member "{}" is outside of the folder.'.format(member.filename))
+            if member.is_dir():
+                os.makedirs(file_path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with zip_folder.open(member) as src, open(file_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, chunk_size)
+
+
+class RunResultsCache(object):
+    """Cache of the outputs of runs on disk and of their visualizations in memory.
+
+    Each output of a run is extracted into its own folder named after the ID of the
+    run, through a temporary folder such that a partially-extracted output is never
+    used. Since the outputs of a finished run never change, an output is downloaded
+    once and reopening a run only reads from disk or memory. The parsed
+    VisualizationSet and vtkjs bytes of the most recently used runs are kept in
+    memory so they are not parsed again.
+
+    Args:
+        folder: Path to the folder where the outputs of runs are extracted.
+            It will be created if it does not exist.
+        max_entries: Integer for the maximum number of runs whose visualizations
+            are kept in memory. (Default: 16).
+
+    Properties:
+        * folder
+        * max_entries
+        * downloads
+        * hits
+        * misses
+    """
+
+    def __init__(self, folder, max_entries=RUN_RESULTS_CACHE_SIZE):
+        self._folder = os.path.abspath(str(folder))
+        if not os.path.isdir(self._folder):
+            os.makedirs(self._folder)
+        self._max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        # run ID and output name to a tuple of the VisualizationSet and vtkjs bytes
+        self._visualizations = OrderedDict()
+        self._downloads = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def folder(self):
+        """Get the path to the folder where the outputs of runs are extracted."""
+        return self._folder
+
+    @property
+    def max_entries(self):
+        """Get the maximum number of runs whose visualizations are kept in memory."""
+        return self._max_entries
+
+    @property
+    def downloads(self):
+        """Get the number of outputs that have been downloaded."""
+        return self._downloads
+
+    @property
+    def hits(self):
+        """Get the number of visualizations that were found in memory."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of visualizations that had to be loaded."""
+        return self._misses
+
+    def output_folder(self, run_id, output_name, download):
+        """Get the folder of the extracted output of a run, downloading it if needed.
+
+        Args:
+            run_id: Text for the ID of the run.
+            output_name: Text for the name of the output of the run.
+            download: A function that returns the zipped output as a path or a
+                file-like object (eg. Run.download_zipped_output). It is only
+                called if the output has not been downloaded before.
+
+        Returns:
+            The path to the folder with the files of the output.
+        """
+        folder = os.path.join(self._folder, run_id, output_name)
+        if os.path.isdir(folder):
+            return folder
+        temp_folder = '{}.{}.{}.tmp'.format(folder, os.getpid(), threading.get_ident())
+        try:
+            extract_zip(download(), temp_folder)
+            with self._lock:
+                self._downloads += 1
+                if not os.path.isdir(folder):  # another session may have finished first
+                    os.replace(temp_folder, folder)
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+        return folder
+
+    def visualization(self, run_id, download, output_name='visualization'):
+        """Get the VisualizationSet and the vtkjs bytes of the output of a run.
+
+        Args:
+            run_id: Text for the ID of the run.
+            download: A function that returns the zipped output as a path or a
+                file-like object. It is only called if the output has not been
+                downloaded before.
+            output_name: Text for the name of the output with a VisualizationSet
+                file. (Default: visualization).
+
+        Returns:
+            A tuple with the VisualizationSet and the bytes of its vtkjs file.
+        """
+        key = (run_id, output_name)
+        with self._lock:
+            visualization = self._visualizations.get(key)
+            if visualization is not None:
+                self._visualizations.move_to_end(key)
+                self._hits += 1
+                return visualization
+            self._misses += 1
+        folder = self.output_folder(run_id, output_name, download)
+        vs = VisualizationSet.from_file(self._vsf_path(folder))
+        vtkjs_file = os.path.join(folder, '{}.vtkjs'.format(run_id))
+        if not os.path.isfile(vtkjs_file):
+            vs_to_vtkjs(vs, folder, run_id)
+        with open(vtkjs_file, 'rb') as f:
+            visualization = (vs, f.read())
+        with self._lock:
+            self._visualizations[key] = visualization
+            while len(self._visualizations) > self._max_entries:
+                self._visualizations.popitem(last=False)
+        return visualization
+
+    def vtkjs(self, run_id, download, output_name='visualization'):
+        """Get the bytes of the vtkjs file of the VisualizationSet output of a run.
+
+        Args:
+            run_id: Text for the ID of the run.
+            download: A function that returns the zipped output as a path or a
+                file-like object.
+            output_name: Text for the name of the output with a VisualizationSet
+                file. (Default: visualization).
+        """
+        return self.visualization(run_id, download, output_name)[1]
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the cache."""
+        lookups = self._hits + self._misses
+        return {
+            'visualizations': len(self._visualizations),
+            'max_entries': self._max_entries,
+            'downloads': self._downloads,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups != 0 else 0
+        }
+
+    @staticmethod
+    def _vsf_path(folder):
+        """Get the path to the VisualizationSet file in the folder of an output."""
+        for root, _, files in os.walk(folder):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(('.vsf', '.json')):
+                    return os.path.join(root, file_name)
+        raise ValueError('No VisualizationSet file was found in: {}'.format(folder))
+
+    def __repr__(self):
+        return 'RunResultsCache: {}'.format(self._folder)
@@ -0,0 +1,232 @@
+"""Scheduling of EnergyPlus simulations on a bounded pool of worker processes."""
+import os
+import time
+import uuid
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# a single pool is shared by all sessions of the app running in this server process
+_executor = None
+_executor_lock = threading.Lock()
+# number of seconds after which the directory of a run is removed even if it was
+# never cleaned up, such as the log of a failed run or a run of a closed session
+RUN_RETENTION = 7 * 24 * 3600
+
+
+def max_workers():
+    """Get the maximum number of simulations that can run at the same time."""
+    return os.cpu_count() or 1
+
+
+def get_executor():
+    """Get the process pool that runs simulations, creating it if it does not exist.
+
+    The pool has one worker per CPU core such that EnergyPlus processes never
+    oversubscribe the machine. Any simulations submitted while all of the
+    workers are busy are queued and started as soon as a worker is free.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn avoids forking the threads of the Streamlit server
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers(),
+                mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def run_directory(target_folder):
+    """Create a new directory that is used by a single simulation run.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+
+    Returns:
+        The full path to a new, empty directory inside the data/runs sub-folder
+        of the target_folder.
+    """
+    runs_folder = os.path.join(str(target_folder), 'data', 'runs')
+    prune_run_directories(runs_folder)
+    directory = os.path.join(runs_folder, uuid.uuid4().hex)
+    os.makedirs(directory)
+    return directory
+
+
+def clean_run_directory(directory, keep_log=False):
+    """Remove the directory of a run once its result has been used.
+
+    Args:
+        directory: Path to the directory of the run.
+        keep_log: Boolean to note whether the STDOUT log of the run should be
+            kept, which is useful to look into why a run failed. The log is
+            removed with the rest of the directory once it is older than
+            RUN_RETENTION. (Default: False).
+    """
+    if not keep_log:
+        shutil.rmtree(directory, ignore_errors=True)
+        return
+    try:
+        file_names = os.listdir(directory)
+    except OSError:  # the directory was already removed
+        return
+    for file_name in file_names:
+        if file_name != SimulationJob.LOG_FILE:
+            file_path = os.path.join(directory, file_name)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path, ignore_errors=True)
+            else:
+                os.remove(file_path)
+
+
+def prune_run_directories(runs_folder, max_age=RUN_RETENTION):
+    """Remove the directories of runs that have not been changed for a while.
+
+    Args:
+        runs_folder: Path to the folder with the directories of all runs.
+        max_age: Number of seconds since the last change of a directory after
+            which it is removed. (Default: 7 days).
+    """
+    try:
+        entries = list(os.scandir(runs_folder))
+    except OSError:  # no run has been created yet
+        return
+    oldest = time.time() - max_age
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < oldest:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:  # removed by another session
+            continue
+
+
+def submit(function, *args, **kwargs):
+    """Submit a function to the pool of simulation workers.
+
+    Args:
+        function: A function importable from a module of the app, which will be
+            called in a worker process.
+        args: Positional arguments to be passed to the function. These must
+            be picklable.
+        kwargs: Keyword arguments to be passed to the function. These must
+            be picklable.
+
+    Returns:
+        A concurrent.futures.Future for the result of the function.
+    """
+    return get_executor().submit(function, *args, **kwargs)
+
+
+class SimulationJob(object):
+    """A handle to a simulation that runs in the background on the worker pool.
+
+    The handle can be kept in the session state of the app and polled on each
+    rerun such that the app remains responsive while EnergyPlus runs.
+
+    Args:
+        future: A concurrent.futures.Future for the result of the simulation,
+            typically obtained from the submit function.
+        directory: Path to the directory in which the simulation runs.
+        key: Optional text for a key that identifies the simulation inputs,
+            such as the key of the simulation cache. (Default: None).
+        inputs: Optional dictionary of the inputs from which the simulation was
+            created, such as the Room Creation parameters. (Default: None).
+
+    Properties:
+        * future
+        * directory
+        * key
+        * inputs
+        * status
+        * log_path
+    """
+    LOG_FILE = 'stdout.log'
+
+    def __init__(self, future, directory, key=None, inputs=None):
+        self._future = future
+        self._directory = directory
+        self._key = key
+        self._inputs = inputs
+
+    @property
+    def future(self):
+        """Get the Future for the result of the simulation."""
+        return self._future
+
+    @property
+    def directory(self):
+        """Get the path to the directory in which the simulation runs."""
+        return self._directory
+
+    @property
+    def key(self):
+        """Get the key that identifies the simulation inputs."""
+        return self._key
+
+    @property
+    def inputs(self):
+        """Get the dictionary of inputs from which the simulation was created."""
+        return self._inputs
+
+    @property
+    def status(self):
+        """Get text for the status of the job.
+
+        This will be one of the following: Queued, Running, Cancelled, Failed,
+        Finished.
+        """
+        if self._future.cancelled():
+            return 'Cancelled'
+        if self._future.running():
+            return 'Running'
+        if not self._future.done():
+            return 'Queued'
+        return 'Failed' if self._future.exception() is not None else 'Finished'
+
+    @property
+    def log_path(self):
+        """Get the path to the file where the simulation writes its STDOUT."""
+        return os.path.join(self._directory, self.LOG_FILE)
+
+    def done(self):
+        """Get a boolean for whether the job is no longer queued or running."""
+        return self._future.done()
+
+    def result(self):
+        """Get the result of the job, raising any exception that occurred in it.
+
+        This blocks until the job is done so done() should be checked first.
+        """
+        return self._future.result()
+
+    def cancel(self):
+        """Cancel the job if it has not started running yet.
+
+        Returns:
+            True if the job was cancelled. False if it is already running or done.
+        """
+        return self._future.cancel()
+
+    def cleanup(self):
+        """Remove the directory of the job once it is done, keeping the log if it failed."""
+        if self._future.done():
+            clean_run_directory(self._directory, keep_log=self.status == 'Failed')
+
+    def log_tail(self, line_count=6):
+        """Get the last lines that the simulation has written to its STDOUT.
+
+        Args:
+            line_count: Integer for the maximum number of lines to return. (Default: 6).
+        """
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(f.tell() - 4096, 0))
+                lines = f.read().decode('utf-8', errors='replace').splitlines()
+        except OSError:  # the simulation has not started or was cleaned up
+            return []
+        return lines[-line_count:]
+
+    def __repr__(self):
+        return 'SimulationJob: {} [{}]'.format(self._directory, self.status)
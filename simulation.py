@@ -1,17 +1,25 @@
 """Functions for running the simulation and performing initial result postprocessing."""
 import os
+import re
+import calendar
+import datetime
 import subprocess
+from pathlib import Path
+
+import numpy as np
 
 from ladybug.futil import write_to_file_by_name
-from ladybug.sql import SQLiteResult
 from ladybug.datacollection import MonthlyCollection
 from ladybug.header import Header
 from ladybug.analysisperiod import AnalysisPeriod
+from ladybug.dt import Date
 from ladybug.datatype.energyintensity import EnergyIntensity
 from ladybug.color import Color
+from honeybee.model import Model
 from honeybee.units import conversion_factor_to_meters
-from honeybee_energy.result.loadbalance import LoadBalance
 from honeybee_energy.simulation.parameter import SimulationParameter
+from honeybee_energy.simulation.output import SimulationOutput
+from honeybee_energy.simulation.runperiod import RunPeriod
 from honeybee_energy.result.err import Err
 from honeybee_energy.run import prepare_idf_for_simulation, output_energyplus_files
 from honeybee_energy.writer import energyplus_idf_version
@@ -19,6 +27,15 @@ from honeybee_energy.config import folders as energy_folders
 
 import streamlit as st
 import shutil
+from streamlit_autorefresh import st_autorefresh
+
+from cache import DiskCache, content_hash, file_hash
+from results import BALANCE_OUTPUTS, BulkSQLResult, EnergyResults, LoadMatrix, \
+    load_balance_from_sql, write_hourly_results
+from results_store import results_store
+from scheduler import SimulationJob, run_directory, submit
+from surrogate import surrogate_model
+from weather import weather_cache
 
 # Names of EnergyPlus outputs that will be requested and parsed to make graphics
 cool_out = 'Zone Ideal Loads Supply Air Total Cooling Energy'
@@ -33,10 +50,90 @@ gl_el_equip_out = 'Zone Electric Equipment Total Heating Energy'
 gl_gas_equip_out = 'Zone Gas Equipment Total Heating Energy'
 gl1_shw_out = 'Water Use Equipment Zone Sensible Heat Gain Energy'
 gl2_shw_out = 'Water Use Equipment Zone Latent Gain Energy'
+ENERGY_OUTPUTS = (
+    cool_out, heat_out, light_out, el_equip_out, gas_equip_out,
+    process1_out, process2_out, shw_out
+)
+# Energy outputs that are also reported for every hour in hourly mode and their end use
+HOURLY_OUTPUTS = {
+    cool_out: 'Cooling', heat_out: 'Heating', light_out: 'Lighting',
+    el_equip_out: 'Electric Equipment', gas_equip_out: 'Gas Equipment',
+    shw_out: 'Service Hot Water'
+}
+
+# Milliseconds between updates of the app while a simulation runs in the background
+PROGRESS_INTERVAL = 1000
+
+# Version of the structure returned by load_sql_data, which is part of the cache key
+RESULTS_VERSION = '5'
+
+# First and last day of the representative week of each month used in preview mode
+PREVIEW_DAYS = (8, 14)
+# Year of the run periods written by honeybee, used to get the days of each month
+RUN_PERIOD_YEAR = 2017
+
+
+@st.cache_resource
+def simulation_cache(target_folder):
+    """Get the on-disk cache of simulation results shared by all app sessions.
+
+    The hourly results of a simulation are removed along with its entry in the
+    cache such that they are bounded by the size of the cache.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+    """
+    def remove_hourly_folder(sim_key):
+        shutil.rmtree(hourly_results_folder(target_folder, sim_key), ignore_errors=True)
+
+    cache = DiskCache(os.path.join(str(target_folder), 'data', 'cache', 'simulation'),
+                      on_evict=remove_hourly_folder)
+    prune_hourly_folders(target_folder, cache)
+    return cache
+
+
+def hourly_results_folder(target_folder, sim_key):
+    """Get the path to the folder of the hourly results of a simulation.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        sim_key: Text for the simulation_key of the hourly simulation.
+    """
+    return os.path.join(str(target_folder), 'data', 'hourly', sim_key)
+
+
+def prune_hourly_folders(target_folder, cache):
+    """Remove the folders of hourly results that have no entry in the simulation cache.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        cache: The DiskCache of the simulation results.
+    """
+    hourly_folder = os.path.join(str(target_folder), 'data', 'hourly')
+    if not os.path.isdir(hourly_folder):
+        return
+    for entry in os.scandir(hourly_folder):
+        if entry.is_dir() and entry.name not in cache:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def simulation_key(idf_str, epw_path, ddy_path):
+    """Get a key that uniquely identifies the results of an EnergyPlus simulation.
+
+    Args:
+        idf_str: The full text of the IDF to be simulated.
+        epw_path: Path to the EPW file to be used in the simulation.
+        ddy_path: Path to the DDY file to be used in the simulation.
+    """
+    return content_hash(
+        RESULTS_VERSION, idf_str, file_hash(epw_path), file_hash(ddy_path))
 
 
 def simulate_idf(idf_file_path, epw_file_path=None, expand_objects=True):
-    """Run an IDF file through EnergyPlus and report the STDOUT in the app.
+    """Run an IDF file through EnergyPlus.
+
+    The STDOUT of EnergyPlus is written to a log file next to the IDF file,
+    which can be read while the simulation runs.
 
     Args:
         idf_file_path: The full path to an IDF file.
@@ -59,213 +156,588 @@ def simulate_idf(idf_file_path, epw_file_path=None, expand_objects=True):
         cmds.append(os.path.abspath(epw_file_path))
     if expand_objects:
         cmds.append('-x')
-    process = subprocess.Popen(cmds, cwd=directory, stdout=subprocess.PIPE)
-
-    # print the stdout in the app
-    stdout_style = '<style> .std {font-size: 1rem ; margin: 0rem ; ' \
-        'padding: 0rem ; color: white ; background-color: black ;} </style>'
-    st.markdown(stdout_style, unsafe_allow_html=True)
-    with st.empty():
-        current_stdout = []
-        for line in iter(lambda: process.stdout.readline(), b""):
-            std_line = line.decode("utf-8")
-            current_stdout.append(std_line)
-            stdout_lines = ['<p class="std">{}</p>'.format(li) for li in current_stdout]
-            st.markdown(''.join(stdout_lines), unsafe_allow_html=True)
-            if len(current_stdout) == 6:
-                current_stdout.pop(0)
-        st.write('')  # clear the EnergyPlus stdout
+    with open(os.path.join(directory, SimulationJob.LOG_FILE), 'wb') as log:
+        subprocess.run(cmds, cwd=directory, stdout=log)
 
     # output the simulation files
     return output_energyplus_files(directory)
 
 
-def data_to_load_intensity(room_dict, data_colls, floor_area, data_type, mults=None):
-    """Convert data collections from EnergyPlus to a single load intensity collection.
+class EnergyPlusProgress(object):
+    """Incremental parser of the EnergyPlus STDOUT log that estimates percent complete.
+
+    Each call to update() only reads the part of the log that was written since
+    the previous call such that the log can be polled cheaply while the
+    simulation runs. The phases of the simulation are weighted as follows:
+
+    * Initializing - 0 to 5 percent
+    * Sizing - 5 to 15 percent
+    * Warmup - 15 to 20 percent
+    * Simulating - 20 to 95 percent, in proportion to the simulated day of the year
+    * Reporting - 95 to 100 percent
 
     Args:
-        data_colls: A list of monthly data collections for an energy term.
+        log_path: Path to the log file to which EnergyPlus writes its STDOUT.
+
+    Properties:
+        * log_path
+        * phase
+        * percent
+        * message
+    """
+    SIM_DATE = re.compile(r'(?:Starting|Continuing) Simulation at (\d+)/(\d+)')
+    WARMUP_DAY = re.compile(r'Warming up \{(\d+)\}')
+    MONTH_START_DAYS = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+
+    def __init__(self, log_path):
+        self._log_path = log_path
+        self._offset = 0
+        self._partial_line = b''
+        self._phase = 'Queued'
+        self._percent = 0
+        self._message = ''
+
+    @property
+    def log_path(self):
+        """Get the path to the log file to which EnergyPlus writes its STDOUT."""
+        return self._log_path
+
+    @property
+    def phase(self):
+        """Get text for the current phase of the simulation."""
+        return self._phase
+
+    @property
+    def percent(self):
+        """Get an integer between 0 and 100 for the estimated percent complete."""
+        return self._percent
+
+    @property
+    def message(self):
+        """Get the last line of the log that was used to estimate the progress."""
+        return self._message
+
+    def update(self):
+        """Parse any new lines of the log file and update the progress."""
+        try:
+            with open(self._log_path, 'rb') as f:
+                f.seek(self._offset)
+                new_data = f.read()
+        except OSError:  # the simulation has not started or was cleaned up
+            return
+        self._offset += len(new_data)
+        lines = (self._partial_line + new_data).split(b'\n')
+        self._partial_line = lines.pop()  # the last line may not be complete yet
+        for line in lines:
+            self.parse_line(line.decode('utf-8', errors='replace').strip())
+
+    def parse_line(self, line):
+        """Update the phase and percent complete from a single line of STDOUT."""
+        if not line:
+            return
+        phase, percent = None, None
+        sim_date = self.SIM_DATE.search(line)
+        if sim_date is not None:
+            month, day = int(sim_date.group(1)), int(sim_date.group(2))
+            doy = self.MONTH_START_DAYS[min(max(month, 1), 12) - 1] + day
+            phase, percent = 'Simulating', 20 + int(75 * (doy - 1) / 365)
+        elif 'Completed Successfully' in line or 'Terminated' in line:
+            phase, percent = 'Completed', 100
+        elif line.startswith('Writing'):
+            phase, percent = 'Reporting', 95
+        elif 'Primary Simulation' in line:
+            phase, percent = 'Warmup', 15
+        elif line.startswith('Warming up'):
+            if self._phase == 'Sizing':  # warmup days of the sizing periods
+                phase, percent = 'Sizing', self._percent
+            else:
+                warmup_day = self.WARMUP_DAY.search(line)
+                warmup_day = int(warmup_day.group(1)) if warmup_day else 1
+                phase, percent = 'Warmup', 15 + min(warmup_day - 1, 5)
+        elif 'Sizing' in line or 'sizing' in line:
+            phase, percent = 'Sizing', min(max(self._percent, 5) + 2, 14)
+        elif self._phase == 'Queued':
+            phase, percent = 'Initializing', 0
+        if phase is not None:
+            self._phase = phase
+            self._percent = max(self._percent, percent)  # never move backwards
+            self._message = line
+
+    def __repr__(self):
+        return 'EnergyPlusProgress: {} {}%'.format(self._phase, self._percent)
+
+
+def simulate_model(directory, idf_str, epw_path, model_dict, month_scale=None,
+                   hourly_folder=None):
+    """Simulate an IDF string in its own directory and load the results.
+
+    This function is intended to be run in one of the worker processes of the
+    scheduler and so it only accepts and returns picklable objects.
+
+    Args:
+        directory: Path to a directory used only by this simulation.
+        idf_str: The full text of the IDF to be simulated.
+        epw_path: Text for the path to an EPW file to be used in the simulation.
+        model_dict: A dictionary of the Honeybee Model used to create the IDF,
+            which is needed to post-process the results.
+        month_scale: An optional list of 12 factors by which the monthly results
+            are multiplied, which is used to scale up the results of a preview
+            simulation to full months. (Default: None).
+        hourly_folder: An optional path to a folder into which the hourly values
+            of the HOURLY_OUTPUTS are written as memory-mapped arrays. This
+            requires an IDF from hourly_idf_string. (Default: None).
+
+    Returns:
+        The dictionary of results output from load_sql_data, with the path to
+        the hourly_folder under the "hourly" key. None if the simulation did
+        not produce an SQL file.
+    """
+    # write the final string into an IDF
+    idf = os.path.join(directory, 'in.idf')
+    write_to_file_by_name(directory, 'in.idf', idf_str, True)
+
+    # run the IDF through EnergyPlus
+    sql, zsz, rdd, html, err = simulate_idf(idf, epw_path)
+    if html is None and err is not None:  # something went wrong; parse the errors
+        err_obj = Err(err)
+        print(err_obj.file_contents)
+        for error in err_obj.fatal_errors:
+            raise Exception(error)
+    if sql is None or not os.path.isfile(sql):
+        return None
+    sql_results = load_sql_data(sql, Model.from_dict(model_dict), month_scale)
+    if hourly_folder is not None:  # hourly values stay on disk rather than in memory
+        write_hourly_results(sql, list(HOURLY_OUTPUTS), hourly_folder)
+        sql_results['hourly'] = hourly_folder
+
+    # results are in memory now so only the raw STDOUT log is kept
+    for file_name in os.listdir(directory):
+        if file_name != SimulationJob.LOG_FILE:
+            file_path = os.path.join(directory, file_name)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path, ignore_errors=True)
+            else:
+                os.remove(file_path)
+    return sql_results
+
+
+def data_to_load_intensity(load_matrix, monthly_data, floor_area, data_type,
+                           use_mults=False):
+    """Add monthly EnergyPlus results to a LoadMatrix and get a total load intensity.
+
+    Args:
+        load_matrix: A LoadMatrix for the rooms of the model, to which the results
+            will be added under the data_type end use.
+        monthly_data: A tuple of keys, groups and values for an energy term, which
+            is typically the output of BulkSQLResult.monthly_array.
         floor_area: The total floor area of the rooms, used to compute EUI.
         data_type: Text for the data type of the collections (eg. "Cooling").
-        mults: An optional dictionary of Room identifiers and integers for
-            the multipliers of the honeybee Rooms.
+        use_mults: Boolean to note whether the multipliers of the honeybee Rooms
+            should be applied to the zone-level results in the total. (Default: False).
     """
-    if len(data_colls) != 0:
-        # first try adding the data to the room dictionary
-        rel_key = 'Zone' if 'Zone' in data_colls[0].header.metadata else 'System'
-        for dat in data_colls:
-            try:
-                z_id = dat.header.metadata[rel_key]
-                if rel_key == 'Zone':
-                    r_prop = room_dict[z_id]
-                elif ' IDEAL LOADS AIR SYSTEM' in z_id:  # E+ HVAC Templates
-                    r_prop = room_dict[z_id.split(' IDEAL LOADS AIR SYSTEM')[0]]
-                elif '..' in z_id:  # convention used for service hot water
-                    r_prop = room_dict[z_id.split('..')[-1]]
-                else:
-                    r_prop = room_dict[z_id]
-                r_prop[-1][data_type] = (dat.total * r_prop[2]) / r_prop[1]
-            except KeyError:  # no results of this type for the Room
-                pass
-        # next, build up the monthly collection of total values
-        if mults is not None:
-            if rel_key == 'Zone':
-                rel_mults = [mults[data.header.metadata['Zone']] for data in data_colls]
-                data_colls = [dat * mul for dat, mul in zip(data_colls, rel_mults)]
-        total_vals = [sum(month_vals) / floor_area for month_vals in zip(*data_colls)]
-    else:  # just make a "filler" collection of 0 values
-        total_vals = [0] * 12
+    keys, groups, values = monthly_data
+    room_indices = load_matrix.room_indices(keys, groups)
+    load_matrix.add_end_use(data_type, room_indices, values)
+    if use_mults and len(keys) != 0:
+        zone_rows = (np.array(groups) == 'Zone') & (room_indices >= 0)
+        key_mults = np.ones(len(keys))
+        key_mults[zone_rows] = load_matrix.multipliers[room_indices[zone_rows]]
+        values = values * key_mults[:, None]
+    total_vals = values.sum(axis=0) / floor_area
     meta_dat = {'type': data_type}
     total_head = Header(EnergyIntensity(), 'kWh/m2', AnalysisPeriod(), meta_dat)
-    return MonthlyCollection(total_head, total_vals, range(12))
+    return MonthlyCollection(total_head, total_vals.tolist(), range(12))
 
 
-def load_sql_data(sql_path, model):
+def load_sql_data(sql_path, model, month_scale=None):
     """Load and process the SQL data from the simulation and store it in memory.
 
     Args:
         sql_path: Path to the SQLite file output from an EnergyPlus simulation.
         model: The honeybee model object used to create the SQL results.
+        month_scale: An optional list of 12 factors by which the monthly results
+            are multiplied. When specified, the results are marked as a preview
+            that only simulated part of each month. (Default: None).
     """
     # load up the floor area, get the model units, and the room multipliers
     con_fac = conversion_factor_to_meters(model.units) ** 2
-    floor_areas, rd = [], {}
-    for room in model.rooms:
-        if not room.exclude_floor_area:
-            fa = room.floor_area * room.multiplier * con_fac
-            floor_areas.append(fa)
-            rd[room.identifier.upper()] = [room.display_name, fa, room.multiplier, {}]
-    floor_area = sum(floor_areas)
+    load_matrix = LoadMatrix(
+        [room.identifier.upper() for room in model.rooms],
+        [room.display_name for room in model.rooms],
+        [0 if room.exclude_floor_area else room.floor_area * room.multiplier * con_fac
+         for room in model.rooms],
+        [room.multiplier for room in model.rooms])
+    floor_area = float(load_matrix.floor_areas.sum())
     assert floor_area != 0, 'Model has no floors with which to compute EUI.'
-    mults = {rm.identifier.upper(): rm.multiplier for rm in model.rooms}
-    mults = None if all(mul == 1 for mul in mults.values()) else mults
-
-    # get data collections for each energy use term
-    sql_obj = SQLiteResult(sql_path)
-    cool_init = sql_obj.data_collections_by_output_name(cool_out)
-    heat_init = sql_obj.data_collections_by_output_name(heat_out)
-    light_init = sql_obj.data_collections_by_output_name(light_out)
-    elec_eq_init = sql_obj.data_collections_by_output_name(el_equip_out)
-    gas_equip_init = sql_obj.data_collections_by_output_name(gas_equip_out)
-    process1_init = sql_obj.data_collections_by_output_name(process1_out)
-    process2_init = sql_obj.data_collections_by_output_name(process2_out)
-    shw_init = sql_obj.data_collections_by_output_name(shw_out)
+
+    # load all energy use terms and load balance terms in a single pass over the SQL
+    sql_obj = BulkSQLResult(
+        sql_path, ENERGY_OUTPUTS + BALANCE_OUTPUTS, month_scale, 'Monthly')
+    gas_equip_init = sql_obj.monthly_array(gas_equip_out)
+    process_init = sql_obj.monthly_array((process1_out, process2_out))
+    shw_init = sql_obj.monthly_array(shw_out)
 
     # convert the results to a single monthly EUI data collection
-    cooling = data_to_load_intensity(rd, cool_init, floor_area, 'Cooling')
-    heating = data_to_load_intensity(rd, heat_init, floor_area, 'Heating')
-    lighting = data_to_load_intensity(rd, light_init, floor_area, 'Lighting', mults)
+    cooling = data_to_load_intensity(
+        load_matrix, sql_obj.monthly_array(cool_out), floor_area, 'Cooling')
+    heating = data_to_load_intensity(
+        load_matrix, sql_obj.monthly_array(heat_out), floor_area, 'Heating')
+    lighting = data_to_load_intensity(
+        load_matrix, sql_obj.monthly_array(light_out), floor_area, 'Lighting', True)
     equip = data_to_load_intensity(
-        rd, elec_eq_init, floor_area, 'Electric Equipment', mults)
+        load_matrix, sql_obj.monthly_array(el_equip_out), floor_area,
+        'Electric Equipment', True)
     load_terms = [cooling, heating, lighting, equip]
     load_colors = [
         Color(4, 25, 145), Color(153, 16, 0), Color(255, 255, 0), Color(255, 121, 0)
     ]
 
     # add gas equipment if it is there
-    if len(gas_equip_init) != 0:
+    if len(gas_equip_init[0]) != 0:
         gas_equip = data_to_load_intensity(
-            rd, gas_equip_init, floor_area, 'Gas Equipment', mults)
+            load_matrix, gas_equip_init, floor_area, 'Gas Equipment', True)
         load_terms.append(gas_equip)
         load_colors.append(Color(255, 219, 128))
     # add process load if it is there
-    process = []
-    if len(process1_init) != 0:
-        process1 = data_to_load_intensity(
-            rd, process1_init, floor_area, 'Process', mults)
-        process2 = data_to_load_intensity(
-            rd, process2_init, floor_area, 'Process', mults)
-        process = process1 + process2
+    if len(process_init[0]) != 0:
+        process = data_to_load_intensity(
+            load_matrix, process_init, floor_area, 'Process', True)
         load_terms.append(process)
         load_colors.append(Color(135, 135, 135))
     # add hot water if it is there
-    hot_water = []
-    if len(shw_init) != 0:
+    if len(shw_init[0]) != 0:
         hot_water = data_to_load_intensity(
-            rd, shw_init, floor_area, 'Service Hot Water', mults)
+            load_matrix, shw_init, floor_area, 'Service Hot Water', True)
         load_terms.append(hot_water)
         load_colors.append(Color(255, 0, 0))
 
     # create a monthly load balance
-    bal_obj = LoadBalance.from_sql_file(model, sql_path)
+    bal_obj = load_balance_from_sql(model, sql_obj)
     balance = bal_obj.load_balance_terms(True, True)
 
     # return a dictionary containing all relevant results of the simulation
     return {
-        'room_results': rd,
+        'room_results': load_matrix.room_results(),
+        'load_matrix': load_matrix,
         'floor_area': floor_area,
         'load_terms': load_terms,
         'load_colors': load_colors,
-        'balance': balance
+        'balance': balance,
+        'results': EnergyResults(load_terms, balance, floor_area, load_matrix),
+        'preview': month_scale is not None
     }
 
 
-def run_energy_simulation(target_folder, hb_model, epw_path, ddy_path, north):
+def energy_idf_string(hb_model, ddy_path, north):
+    """Get the full IDF string to simulate a Model with the app's simulation settings.
+
+    Args:
+        hb_model: A Honeybee Model object to be simulated.
+        ddy_path: Path to a DDY file with the design days of the simulation.
+        north: Integer for the angle from the Y-axis where North is.
+    """
+    # create simulation parameters for the coarsest/fastest E+ sim possible
+    sim_par = SimulationParameter()
+    sim_par.timestep = 1
+    sim_par.shadow_calculation.solar_distribution = 'FullExterior'
+    sim_par.output.add_zone_energy_use()
+    sim_par.output.reporting_frequency = 'Monthly'
+    sim_par.output.add_output(gl_el_equip_out)
+    sim_par.output.add_output(gl_gas_equip_out)
+    sim_par.output.add_output(gl1_shw_out)
+    sim_par.output.add_output(gl2_shw_out)
+    sim_par.output.add_gains_and_losses('Total')
+    sim_par.output.add_surface_energy_flow()
+    sim_par.north_angle = float(north)
+
+    # assign design days to the simulation parameters
+    sim_par.sizing_parameter.add_from_ddy(Path(ddy_path).as_posix())
+
+    # create the strings for simulation parameters and model
+    ver_str = energyplus_idf_version() if energy_folders.energyplus_version \
+        is not None else ''
+    sim_par_str = sim_par.to_idf()
+    model_str = hb_model.to.idf(hb_model, patch_missing_adjacencies=True)
+    return '\n\n'.join([ver_str, sim_par_str, model_str])
+
+
+def preview_idf_string(idf_str):
+    """Convert the IDF of an annual simulation into an IDF for a preview simulation.
+
+    The annual run period is replaced with one run period for the representative
+    week of each month, which is defined by PREVIEW_DAYS.
+
+    Args:
+        idf_str: The full text of an IDF output from energy_idf_string.
+    """
+    annual_period = RunPeriod().to_idf()[0]
+    assert annual_period in idf_str, 'IDF does not have an annual run period.'
+    run_periods = []
+    for month in range(1, 13):
+        start = datetime.date(RUN_PERIOD_YEAR, month, PREVIEW_DAYS[0])
+        run_period = RunPeriod(
+            Date(month, PREVIEW_DAYS[0]), Date(month, PREVIEW_DAYS[1]),
+            start.strftime('%A'))
+        name = 'PreviewWeek{}'.format(month)
+        run_periods.append(run_period.to_idf()[0].replace(
+            'CustomRunPeriod,', '{},'.format(name).ljust(16), 1))
+    return idf_str.replace(annual_period, '\n\n'.join(run_periods))
+
+
+def hourly_idf_string(idf_str):
+    """Add hourly outputs to the IDF of an annual simulation for the hourly results.
+
+    The monthly outputs are kept such that the hourly simulation produces the
+    same monthly results as the annual simulation.
+
+    Args:
+        idf_str: The full text of an IDF output from energy_idf_string.
+    """
+    hourly_output = SimulationOutput(reporting_frequency='Hourly')
+    for output_name in HOURLY_OUTPUTS:
+        hourly_output.add_output(output_name)
+    return '\n\n'.join([idf_str] + hourly_output.to_idf()[1])
+
+
+def preview_month_scale():
+    """Get factors that scale the representative weeks up to their full months."""
+    week_days = PREVIEW_DAYS[1] - PREVIEW_DAYS[0] + 1
+    return [calendar.monthrange(RUN_PERIOD_YEAR, month)[1] / week_days
+            for month in range(1, 13)]
+
+
+def preview_error(preview_results, annual_results):
+    """Get the error of the EUI of a preview simulation relative to the annual one.
+
+    Args:
+        preview_results: A dictionary of results output from load_sql_data for
+            a preview simulation.
+        annual_results: A dictionary of results output from load_sql_data for
+            an annual simulation of the same model.
+
+    Returns:
+        A dictionary with the EUI of each end use and the Total. Each value is a
+        tuple with the preview EUI, the annual EUI and the relative error of the
+        preview, which is None when the annual EUI is zero.
+    """
+    preview_eui = {data.header.metadata['type']: data.total
+                   for data in preview_results['load_terms']}
+    annual_eui = {data.header.metadata['type']: data.total
+                  for data in annual_results['load_terms']}
+    preview_eui['Total'] = sum(preview_eui.values())
+    annual_eui['Total'] = sum(annual_eui.values())
+    errors = {}
+    for end_use, annual in annual_eui.items():
+        preview = preview_eui.get(end_use, 0)
+        error = (preview - annual) / annual if annual != 0 else None
+        errors[end_use] = (preview, annual, error)
+    return errors
+
+
+def poll_simulation_job(target_folder, job):
+    """Report the progress of a background simulation and load its results when done.
+
+    While the job is running, the app is scheduled to rerun every PROGRESS_INTERVAL
+    such that the job is polled again without blocking any other widget interaction.
+    The progress is parsed from the STDOUT log of the job and so the app is only
+    updated once per interval rather than once per line that EnergyPlus prints.
+
+    Args:
+        target_folder: Text for the target folder out of which the simulation runs.
+        job: A SimulationJob for a simulation submitted by run_energy_simulation.
+    """
+    if not job.done():
+        progress = st.session_state.sim_progress
+        if progress is None or progress.log_path != job.log_path:
+            progress = st.session_state.sim_progress = EnergyPlusProgress(job.log_path)
+        progress.update()
+        if job.status == 'Queued':
+            text = 'EnergyPlus simulation is queued...'
+        else:
+            text = 'EnergyPlus {}... {}%'.format(progress.phase.lower(), progress.percent)
+        st.progress(progress.percent / 100, text=text)
+        st_autorefresh(interval=PROGRESS_INTERVAL, key='sim_job_refresh')
+        return
+
+    # the job is done; load the results and add them to the cache
+    st.session_state.sim_job = None
+    st.session_state.sim_progress = None
+    try:
+        sql_results = job.result()
+    finally:  # the results are in memory now so the run directory is not needed
+        job.cleanup()
+    if sql_results is not None:
+        simulation_cache(target_folder).set(job.key, sql_results)
+        if job.inputs['room_params'] == st.session_state.room_params:
+            load_simulation_results(target_folder, sql_results, job.inputs)
+        else:  # the room changed during the run; only keep results for later
+            add_simulation_results(target_folder, sql_results, job.inputs)
+
+
+def load_simulation_results(target_folder, sql_results, inputs):
+    """Show the results of a simulation and use them to improve future estimates.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        sql_results: A dictionary of results output from load_sql_data.
+        inputs: A dictionary of the inputs of the simulation, which is described
+            in add_simulation_results.
+    """
+    st.session_state.sql_results = sql_results
+    add_simulation_results(target_folder, sql_results, inputs)
+
+
+def add_simulation_results(target_folder, sql_results, inputs):
+    """Use the results of a simulation to improve future estimates without showing them.
+
+    The results are added to the results store and annual results are added to
+    the surrogate model. If the same model was simulated both in preview mode and
+    for the full year, the error of the preview relative to the full year is
+    added to the results.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        sql_results: A dictionary of results output from load_sql_data.
+        inputs: A dictionary of the inputs of the simulation with the room_params
+            used to build the model (or None), the weather_key and location of the
+            EPW file, the key of the simulation in the simulation cache and the
+            compare_key for the results of the same model in the other
+            simulation mode.
+    """
+    results_store(target_folder).add(
+        inputs['key'], sql_results, inputs['room_params'], inputs['weather_key'],
+        inputs['location'])
+    if not sql_results['preview'] and inputs['room_params'] is not None:
+        surrogate_model(target_folder).add_sample(
+            inputs['room_params'], inputs['weather_key'], sql_results)
+    other_results = simulation_cache(target_folder).get(inputs['compare_key'])
+    if other_results is not None:
+        preview, annual = (sql_results, other_results) if sql_results['preview'] \
+            else (other_results, sql_results)
+        sql_results['preview_error'] = preview_error(preview, annual)
+
+
+def preview_energy_use(target_folder, room_params, weather_key):
+    """Show an instant estimate of the EUI from the surrogate model of past simulations.
+
+    The estimate is only shown when the surrogate model is confident in it.
+    Otherwise, the user is asked to run EnergyPlus, which also adds a sample
+    that makes the following estimates more accurate.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+        room_params: A dictionary of the room inputs for build_room_model.
+        weather_key: Text for the hash of the EPW file to be simulated.
+    """
+    estimate = surrogate_model(target_folder).predict(room_params, weather_key)
+    if estimate is None or not estimate.confident:
+        st.caption('Not enough similar simulations for an instant estimate. '
+                   'Run EnergyPlus to get the EUI of this room.')
+        return
+    st.caption('Estimated EUI: {:.1f} \u00b1 {:.1f} kWh/m2 from {} simulations'.format(
+        estimate.total, estimate.total_uncertainty, estimate.sample_count))
+    eui_cols = st.columns(len(estimate.values))
+    for (end_use, value), col in zip(estimate.values.items(), eui_cols):
+        col.metric(end_use, '{:.1f}'.format(value),
+                   '\u00b1 {:.1f}'.format(estimate.uncertainties[end_use]),
+                   delta_color='off')
+
+
+def run_energy_simulation(target_folder, hb_model, epw_path, ddy_path, north,
+                          room_params=None):
     """Build the IDF file from a Model and run it through EnergyPlus.
 
     Args:
-        target_folder: Text for the target folder out of which the simulation will run.
-        user_id: A unique user ID for the session, which will be used to ensure
-            other simulations do not overwrite this one.
+        target_folder: Text for the target folder out of which the simulation will
+            run. Each simulation gets its own sub-folder so that the simulations
+            of other sessions do not overwrite this one.
         hb_model: A Honeybee Model object to be simulated.
         epw_path: Path to an EPW file to be used in the simulation.
         ddy_path: Path to a DDY file to be used in the simulation.
         north: Integer for the angle from the Y-axis where North is.
+        room_params: An optional dictionary of the room inputs from which the
+            Model was built. When specified, an instant estimate of the EUI is
+            shown before the simulation is run and the results of the simulation
+            are used to train the surrogate model. (Default: None).
     """
 
     # check to be sure there is a model
-    if not hb_model or not epw_path or not ddy_path or \
-            st.session_state.sql_results is not None:
+    if not hb_model or not epw_path or not ddy_path:
         return
 
+    # check on any simulation that is already running in the background
+    if st.session_state.sim_job is not None:
+        poll_simulation_job(target_folder, st.session_state.sim_job)
+        return
+
+    # only preview results can be followed by another simulation of the same model
+    sql_results = st.session_state.sql_results
+    if sql_results is not None and not sql_results['preview']:
+        return
+
+    # show an instant estimate of the results from the previous simulations
+    weather = weather_cache(target_folder).get(epw_path)
+    weather_key = weather.key
+    hourly_help = 'Also save the hourly energy use of each zone to see peak hours ' \
+        'and daily profiles. The hourly values are kept on disk and are only ' \
+        'read when they are charted.'
+    if sql_results is None:
+        if room_params is not None:
+            preview_energy_use(target_folder, room_params, weather_key)
+        preview = st.checkbox(
+            'Preview Mode', key='sim_preview',
+            help='Simulate one representative week of each month and scale it up '
+            'to the full year. This is several times faster than the annual '
+            'simulation and is meant for quick iteration rather than final numbers.')
+        hourly = not preview and \
+            st.checkbox('Hourly Results', key='sim_hourly', help=hourly_help)
+        label = 'Run Energy Simulation'
+    else:  # the preview is shown and the full year can be run for final numbers
+        preview, label = False, 'Run Full Year Simulation'
+        hourly = st.checkbox('Hourly Results', key='sim_hourly', help=hourly_help)
+
     # simulate the model if the button is pressed
     button_holder = st.empty()
-    if button_holder.button('Run Energy Simulation'):
+    if button_holder.button(label):
 
         # check to be sure that the Model has Rooms
         assert len(hb_model.rooms) != 0, \
             'Model has no Rooms and cannot be simulated in EnergyPlus.'
 
-        # create simulation parameters for the coarsest/fastest E+ sim possible
-        sim_par = SimulationParameter()
-        sim_par.timestep = 1
-        sim_par.shadow_calculation.solar_distribution = 'FullExterior'
-        sim_par.output.add_zone_energy_use()
-        sim_par.output.reporting_frequency = 'Monthly'
-        sim_par.output.add_output(gl_el_equip_out)
-        sim_par.output.add_output(gl_gas_equip_out)
-        sim_par.output.add_output(gl1_shw_out)
-        sim_par.output.add_output(gl2_shw_out)
-        sim_par.output.add_gains_and_losses('Total')
-        sim_par.output.add_surface_energy_flow()
-        sim_par.north_angle = float(north)
-
-        # assign design days to the simulation parameters
-        sim_par.sizing_parameter.add_from_ddy(ddy_path.as_posix())
-
-        # create the strings for simulation parameters and model
-        ver_str = energyplus_idf_version() if energy_folders.energyplus_version \
-            is not None else ''
-        sim_par_str = sim_par.to_idf()
-        model_str = hb_model.to.idf(hb_model, patch_missing_adjacencies=True)
-        idf_str = '\n\n'.join([ver_str, sim_par_str, model_str])
-
-        # write the final string into an IDF
-        directory = os.path.join(target_folder, 'data')#, user_id)
-        idf = os.path.join(directory, 'in.idf')
-        write_to_file_by_name(directory, 'in.idf', idf_str, True)
-
-        # idf = os.path.join(directory, '20240224_EPmodel_CASE_Step5_window control.idf')
-        # write_to_file_by_name(directory, '20240224_EPmodel_CASE_Step5_window control.idf', idf_str, True)
-        # epw_path = 'C:/Users/user/Documents/GitHub/Room-Box/data/denver.epw'
-
-        # run the IDF through EnergyPlus
-        sql, zsz, rdd, html, err = simulate_idf(idf, epw_path.as_posix())
-        if html is None and err is not None:  # something went wrong; parse the errors
-            err_obj = Err(err)
-            print(err_obj.file_contents)
-            for error in err_obj.fatal_errors:
-                raise Exception(error)
-        if sql is not None and os.path.isfile(sql):
-            st.session_state.sql_results = load_sql_data(sql, hb_model)
-            button_holder.write('')
\ No newline at end of file
+        # create the IDF strings for the model in both simulation modes
+        annual_idf = energy_idf_string(hb_model, ddy_path, north)
+        preview_idf = preview_idf_string(annual_idf)
+        annual_key = simulation_key(annual_idf, epw_path, ddy_path)
+        preview_key = simulation_key(preview_idf, epw_path, ddy_path)
+        hourly_folder = None
+        if preview:
+            idf_str, sim_key, month_scale = \
+                preview_idf, preview_key, preview_month_scale()
+        elif hourly:
+            idf_str, month_scale = hourly_idf_string(annual_idf), None
+            sim_key = simulation_key(idf_str, epw_path, ddy_path)
+            hourly_folder = hourly_results_folder(target_folder, sim_key)
+        else:
+            idf_str, sim_key, month_scale = annual_idf, annual_key, None
+        inputs = {  # hourly runs have the same monthly results as the annual run
+            'room_params': room_params, 'weather_key': weather_key,
+            'location': weather.location, 'key': preview_key if preview else annual_key,
+            'compare_key': annual_key if preview else preview_key
+        }
+
+        # return the results of any identical simulation that was run before
+        st.session_state.sql_results = None
+        sql_results = simulation_cache(target_folder).get(sim_key)
+        if sql_results is not None:
+            load_simulation_results(target_folder, sql_results, inputs)
+            button_holder.write('')
+            return
+
+        # submit the IDF to the worker pool and check on it with each rerun
+        directory = run_directory(target_folder)
+        future = submit(
+            simulate_model, directory, idf_str, Path(epw_path).as_posix(),
+            hb_model.to_dict(), month_scale, hourly_folder)
+        st.session_state.sim_job = SimulationJob(future, directory, sim_key, inputs)
+        button_holder.write('')
+        poll_simulation_job(target_folder, st.session_state.sim_job)
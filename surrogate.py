@@ -0,0 +1,251 @@
+"""Surrogate model that estimates the EUI of a room from previous simulation results."""
+import os
+import threading
+
+import numpy as np
+import streamlit as st
+
+from cache import DiskCache, content_hash
+
+# Room Creation inputs used as features with the distance that counts as one unit
+# of difference between rooms, which is roughly the range of each input in the App
+PARAMETER_SCALES = {
+    'width': 45.0,
+    'depth': 45.0,
+    'height': 20.0,
+    'orientation': 1.0,  # compared through the sine and cosine of the angle
+    'wwr': 0.85,
+    'hor_num': 5.0,
+    'hor_depth': 6.0,
+    'vert_num': 5.0,
+    'vert_depth': 6.0
+}
+
+# number of nearest simulations that are blended into each estimate
+NEIGHBOR_COUNT = 6
+# smallest number of simulations needed before any estimate is made
+MIN_SAMPLES = 3
+# largest uncertainty relative to the total EUI for which an estimate is trusted
+MAX_UNCERTAINTY = 0.15
+# fraction of the estimate added to the uncertainty per unit of distance, which
+# accounts for inputs that do not vary among the nearest samples
+DISTANCE_PENALTY = 0.25
+
+
+@st.cache_resource
+def surrogate_model(target_folder):
+    """Get the surrogate model shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder out of which simulations run.
+    """
+    return SurrogateModel(
+        DiskCache(os.path.join(str(target_folder), 'data', 'cache', 'surrogate')))
+
+
+def room_features(params):
+    """Get an array of scaled features from a dictionary of Room Creation inputs.
+
+    The orientation is represented by the sine and cosine of the angle such that
+    rooms at 355 and 5 degrees are as close as rooms at 0 and 10 degrees.
+
+    Args:
+        params: A dictionary of room inputs for build_room_model.
+    """
+    features = []
+    for name, scale in PARAMETER_SCALES.items():
+        value = float(params.get(name, 0))
+        if name == 'orientation':
+            angle = np.radians(value)
+            features.extend((np.sin(angle) / 2, np.cos(angle) / 2))
+        else:
+            features.append(value / scale)
+    return np.array(features)
+
+
+class EUIEstimate(object):
+    """An estimate of the EUI of each end use with an uncertainty band.
+
+    Args:
+        values: A dictionary of estimated EUI in kWh/m2 for each end use.
+        uncertainties: A dictionary of the uncertainty of the EUI in kWh/m2
+            for each end use, which is the half-width of the band around the value.
+        total_uncertainty: Number for the uncertainty of the total EUI in kWh/m2.
+        sample_count: Integer for the number of simulations used for the estimate.
+
+    Properties:
+        * values
+        * uncertainties
+        * total
+        * total_uncertainty
+        * sample_count
+        * confident
+    """
+
+    def __init__(self, values, uncertainties, total_uncertainty, sample_count):
+        self._values = values
+        self._uncertainties = uncertainties
+        self._total_uncertainty = total_uncertainty
+        self._sample_count = sample_count
+
+    @property
+    def values(self):
+        """Get a dictionary of the estimated EUI of each end use."""
+        return self._values
+
+    @property
+    def uncertainties(self):
+        """Get a dictionary of the uncertainty of the EUI of each end use."""
+        return self._uncertainties
+
+    @property
+    def total(self):
+        """Get the estimated total EUI of all end uses."""
+        return sum(self._values.values())
+
+    @property
+    def total_uncertainty(self):
+        """Get the uncertainty of the total EUI."""
+        return self._total_uncertainty
+
+    @property
+    def sample_count(self):
+        """Get the number of simulations that were used for the estimate."""
+        return self._sample_count
+
+    @property
+    def confident(self):
+        """Get a boolean for whether the estimate is close enough to be trusted.
+
+        When this is False, the room should be simulated with EnergyPlus.
+        """
+        if self.total == 0:
+            return self._total_uncertainty == 0
+        return self._total_uncertainty / abs(self.total) <= MAX_UNCERTAINTY
+
+    def __repr__(self):
+        return 'EUIEstimate: {:.1f} +/- {:.1f} kWh/m2'.format(
+            self.total, self._total_uncertainty)
+
+
+class SurrogateModel(object):
+    """Kernel-weighted nearest-neighbor model trained on previous simulation results.
+
+    Each simulation that finishes is added as a sample and estimates for new
+    room inputs are made by blending the results of the nearest samples that
+    were simulated with the same weather file and units. Samples are stored in
+    a DiskCache so that the model keeps improving across restarts of the app.
+
+    Args:
+        cache: A DiskCache in which the samples of the model are stored.
+
+    Properties:
+        * cache
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        """Get the DiskCache in which the samples of the model are stored."""
+        return self._cache
+
+    @staticmethod
+    def sample_key(weather_key, units):
+        """Get the key of the group of samples for a weather file and units system.
+
+        Args:
+            weather_key: Text for the hash of the EPW file of the simulations.
+            units: Text for the units system of the room inputs.
+        """
+        return content_hash('surrogate', weather_key, units)
+
+    def sample_count(self, weather_key, units):
+        """Get the number of samples for a weather file and units system."""
+        return len(self._load(self.sample_key(weather_key, units))['features'])
+
+    def add_sample(self, params, weather_key, sql_results):
+        """Add the results of a simulation to the samples of the model.
+
+        Any existing sample with the same room inputs is replaced.
+
+        Args:
+            params: A dictionary of the room inputs of the simulated model.
+            weather_key: Text for the hash of the EPW file of the simulation.
+            sql_results: A dictionary of results output from load_sql_data.
+        """
+        key = self.sample_key(weather_key, params.get('units'))
+        eui = {data.header.metadata['type']: data.total
+               for data in sql_results['load_terms']}
+        features = room_features(params)
+        with self._lock:
+            samples = self._load(key)
+            end_uses = samples['end_uses'] + \
+                [use for use in eui if use not in samples['end_uses']]
+            values = np.zeros((len(samples['values']), len(end_uses)))
+            values[:, :len(samples['end_uses'])] = samples['values']
+            row = np.array([[eui.get(use, 0) for use in end_uses]])
+            keep = ~np.all(np.isclose(samples['features'], features), axis=1)
+            samples = {
+                'features': np.vstack((samples['features'][keep], features)),
+                'end_uses': end_uses,
+                'values': np.vstack((values[keep], row))
+            }
+            self._samples[key] = samples
+            self._cache.set(key, samples)
+
+    def predict(self, params, weather_key):
+        """Estimate the EUI of each end use for a set of room inputs.
+
+        Args:
+            params: A dictionary of room inputs for build_room_model.
+            weather_key: Text for the hash of the EPW file to be simulated.
+
+        Returns:
+            An EUIEstimate or None if there are not yet enough samples for
+            the weather file and units system.
+        """
+        samples = self._load(self.sample_key(weather_key, params.get('units')))
+        if len(samples['features']) < MIN_SAMPLES:
+            return None
+
+        # find the nearest samples and weight them with a Gaussian kernel
+        dist = np.linalg.norm(samples['features'] - room_features(params), axis=1)
+        count = min(NEIGHBOR_COUNT, len(dist))
+        nearest = np.argsort(dist)[:count]
+        dist, values = dist[nearest], samples['values'][nearest]
+        values = np.column_stack((values, values.sum(axis=1)))  # add the total
+        if dist[0] < 1e-9:  # the room was already simulated
+            weights = (dist < 1e-9).astype(float)
+        else:
+            weights = np.exp(-0.5 * (dist / dist[-1]) ** 2)
+        weights = weights / weights.sum()
+
+        # the uncertainty is how much the values change over the distance to the
+        # nearest sample, using the local slope between the neighboring samples
+        mean = weights @ values
+        features = samples['features'][nearest]
+        step = np.linalg.norm(features[1:] - features[0], axis=1)
+        slopes = np.abs(values[1:] - values[0]) / np.maximum(step, 1e-9)[:, None]
+        slope = weights[1:] @ slopes / max(weights[1:].sum(), 1e-9)
+        uncertainty = dist[0] * (slope + DISTANCE_PENALTY * np.abs(mean))
+        return EUIEstimate(
+            dict(zip(samples['end_uses'], mean[:-1].tolist())),
+            dict(zip(samples['end_uses'], uncertainty[:-1].tolist())),
+            float(uncertainty[-1]), count)
+
+    def _load(self, key):
+        """Get the samples of a group from memory or from the cache."""
+        if key not in self._samples:
+            self._samples[key] = self._cache.get(key) or {
+                'features': np.zeros((0, len(PARAMETER_SCALES) + 1)),
+                'end_uses': [],
+                'values': np.zeros((0, 0))
+            }
+        return self._samples[key]
+
+    def __repr__(self):
+        return 'SurrogateModel: {} weather groups'.format(len(self._samples))
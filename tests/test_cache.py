@@ -0,0 +1,58 @@
+"""Test the pins of the ArtifactStore."""
+import os
+
+import pytest
+
+import cache
+from cache import ArtifactStore
+
+
+def write_artifact(store, name, size):
+    """Write an artifact of a given number of bytes to the store."""
+    def write(folder):
+        file_path = os.path.join(folder, name)
+        with open(file_path, 'wb') as f:
+            f.write(b'0' * size)
+        return file_path
+    return store.put(name, write)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_pin_expires(tmp_path, clock):
+    """Test that the pins of an owner that is no longer seen are dropped."""
+    store = ArtifactStore(tmp_path, max_size=250, pin_ttl=60)
+    model = write_artifact(store, 'model.hbjson', 100)
+    store.pin(model, 'session')
+    write_artifact(store, 'a.vtkjs', 100)
+    write_artifact(store, 'b.vtkjs', 100)
+    assert os.path.isfile(model)
+    assert store.pinned == [model]
+
+    clock[0] += 61
+    write_artifact(store, 'c.vtkjs', 100)
+    assert not os.path.isfile(model)
+    assert store.pinned == []
+
+
+def test_touch(tmp_path, clock):
+    """Test that touching an owner keeps its pins and restores expired pins."""
+    store = ArtifactStore(tmp_path, pin_ttl=60)
+    model = write_artifact(store, 'model.hbjson', 100)
+    store.pin(model, 'session')
+    clock[0] += 50
+    store.touch('session')
+    clock[0] += 50
+    assert store.pinned == [model]
+
+    clock[0] += 61
+    assert store.pinned == []
+    store.touch('session', [model])
+    assert store.pinned == [model]
+    store.unpin(model, 'session')
+    assert store.pinned == []
@@ -0,0 +1,119 @@
+"""Tests of the deduplicated, concurrent uploads against the local job backend."""
+import os
+import json
+
+import pytest
+
+import uploads
+from jobs import LocalClient, LocalNewJob
+from uploads import ArtifactUploader, UploadManifest
+
+
+class FlakyNewJob(LocalNewJob):
+    """A LocalNewJob whose uploads of some files fail a number of times."""
+
+    def __init__(self, *args, failures=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = dict(failures or {})  # file name to number of failures
+        self.calls = []
+
+    def upload_artifact(self, fp, target_folder=''):
+        self.calls.append(fp.name)
+        if self.failures.get(fp.name, 0) > 0:
+            self.failures[fp.name] -= 1
+            raise ConnectionError('Upload of {} failed.'.format(fp.name))
+        return super().upload_artifact(fp, target_folder)
+
+
+@pytest.fixture
+def client(tmp_path):
+    return LocalClient(str(tmp_path / 'server'))
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / 'uploads' / 'manifest.json')
+
+
+def write_files(folder, contents):
+    """Write files with the given names and contents and get their paths."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for name, content in contents.items():
+        path = os.path.join(folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+
+def new_job(client, **kwargs):
+    return FlakyNewJob('ladybug-tools', 'demo', None, client=client, **kwargs)
+
+
+def test_same_content_with_different_names_is_uploaded_once(tmp_path, client,
+                                                             manifest_path):
+    paths = write_files(str(tmp_path / 'models'), {
+        'a.hbjson': 'room', 'b.hbjson': 'room', 'c.hbjson': 'other room'})
+    uploader = ArtifactUploader(UploadManifest(manifest_path))
+    job = new_job(client)
+
+    project_paths = uploader.upload(job, paths, 'streamlit-job', client.host)
+
+    assert len(job.calls) == 2
+    assert project_paths[0] == project_paths[1] != project_paths[2]
+    assert uploader.uploaded == 2 and uploader.skipped == 1
+    for path in project_paths:
+        assert os.path.isfile(os.path.join(
+            client.project_folder('ladybug-tools', 'demo'), path))
+
+
+def test_uploaded_content_is_not_uploaded_again(tmp_path, client, manifest_path):
+    first = write_files(str(tmp_path / 'first'), {'model.hbjson': 'room'})
+    second = write_files(str(tmp_path / 'second'), {'renamed.hbjson': 'room'})
+    uploader = ArtifactUploader(UploadManifest(manifest_path))
+    progress = []
+
+    first_paths = uploader.upload(new_job(client), first, host=client.host)
+    job = new_job(client)
+    second_paths = uploader.upload(
+        job, second, host=client.host,
+        progress=lambda done, total: progress.append((done, total)))
+
+    assert job.calls == []
+    assert second_paths == first_paths
+    assert progress == [(1, 1)]
+
+
+def test_failed_uploads_are_retried_with_backoff(tmp_path, client, manifest_path,
+                                                 monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(uploads.time, 'sleep', sleeps.append)
+    paths = write_files(str(tmp_path / 'models'), {'model.hbjson': 'room'})
+    uploader = ArtifactUploader(UploadManifest(manifest_path), attempts=3, backoff=1)
+    job = new_job(client, failures={'model.hbjson': 2})
+
+    project_paths = uploader.upload(job, paths, host=client.host)
+
+    assert job.calls == ['model.hbjson'] * 3
+    assert sleeps == [1, 2]
+    assert len(project_paths) == 1
+
+
+def test_manifest_keeps_progress_after_a_failure(tmp_path, client, manifest_path,
+                                                 monkeypatch):
+    monkeypatch.setattr(uploads.time, 'sleep', lambda seconds: None)
+    paths = write_files(str(tmp_path / 'models'), {
+        'a.hbjson': 'room a', 'b.hbjson': 'room b', 'bad.hbjson': 'room c'})
+    uploader = ArtifactUploader(UploadManifest(manifest_path), max_workers=1, attempts=2)
+
+    with pytest.raises(ConnectionError):
+        uploader.upload(new_job(client, failures={'bad.hbjson': 2}), paths,
+                        host=client.host)
+
+    with open(manifest_path) as f:
+        assert len(json.load(f)) == 2
+    job = new_job(client)
+    resumed = ArtifactUploader(UploadManifest(manifest_path))
+    resumed.upload(job, paths, host=client.host)
+    assert job.calls == ['bad.hbjson']
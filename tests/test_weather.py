@@ -0,0 +1,136 @@
+"""Test the weather caches, with the DownloadCache against a local HTTP server."""
+import io
+import os
+import time
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from weather import DownloadCache, WeatherCache, write_upload
+
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+def zip_bytes(files):
+    """Get the bytes of a zip file with a dictionary of file names and contents."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        for name, content in files.items():
+            zip_file.writestr(name, content)
+    return buffer.getvalue()
+
+
+class WeatherHandler(BaseHTTPRequestHandler):
+    """Serve the files of the server, answering revalidation requests with 304."""
+
+    def do_GET(self):
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+        body = self.server.files[self.path]
+        etag = '"{}"'.format(len(body))
+        self.server.requests.append((self.path, self.headers.get('If-None-Match'),
+                                     self.headers.get('If-Modified-Since')))
+        if self.headers.get('If-None-Match') == etag or \
+                self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), WeatherHandler)
+    httpd.files, httpd.requests = {}, []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def test_revalidation(server, tmp_path):
+    """Test that an expired download is revalidated with its ETag and Last-Modified."""
+    server.files['/weather.zip'] = zip_bytes({'weather.epw': 'LOCATION'})
+    cache = DownloadCache(tmp_path, max_age=0)
+    epw = cache.epw_path(url(server, '/weather.zip'))
+    assert os.path.basename(epw) == 'weather.epw'
+    assert cache.epw_path(url(server, '/weather.zip')) == epw
+    assert server.requests == [
+        ('/weather.zip', None, None),
+        ('/weather.zip', '"{}"'.format(len(server.files['/weather.zip'])), LAST_MODIFIED)
+    ]
+
+    fresh = DownloadCache(tmp_path, max_age=3600)
+    assert fresh.epw_path(url(server, '/weather.zip')) == epw
+    assert len(server.requests) == 2
+
+
+def test_zip_slip(server, tmp_path):
+    """Test that a zip file with a path outside of its folder is rejected."""
+    server.files['/unsafe.zip'] = zip_bytes({'../unsafe.epw': 'LOCATION'})
+    cache = DownloadCache(tmp_path)
+    with pytest.raises(ValueError, match='unsafe path'):
+        cache.get(url(server, '/unsafe.zip'))
+    assert not os.path.exists(os.path.join(tmp_path, 'files', 'unsafe.epw'))
+    assert os.listdir(os.path.join(tmp_path, 'files')) == []
+
+
+def test_size_eviction(server, tmp_path):
+    """Test that the least recently used folders are removed above max_size."""
+    for i in range(3):
+        server.files['/{}.epw'.format(i)] = str(i).encode() * 100
+    cache = DownloadCache(tmp_path, max_size=250)
+    folders = [cache.get(url(server, '/{}.epw'.format(i))) for i in range(3)]
+    assert not os.path.isdir(folders[0])
+    assert os.path.isdir(folders[1]) and os.path.isdir(folders[2])
+    assert cache.size == 200
+
+
+class Upload(object):
+    """An uploaded file like the UploadedFile of st.file_uploader."""
+
+    def __init__(self, file_id, name, data):
+        self.file_id, self.name, self._data = file_id, name, data
+
+    def getvalue(self):
+        return self._data
+
+
+def test_write_upload(tmp_path):
+    """Test that an upload is only written again if it changed."""
+    epw_path = write_upload(Upload('1', 'weather.epw', b'LOCATION'), tmp_path)
+    modified = os.stat(epw_path).st_mtime_ns
+    time.sleep(0.01)
+    assert write_upload(Upload('1', 'weather.epw', b'LOCATION'), tmp_path) == epw_path
+    assert os.stat(epw_path).st_mtime_ns == modified
+
+    write_upload(Upload('2', 'weather.epw', b'OTHER'), tmp_path)
+    with open(epw_path, 'rb') as f:
+        assert f.read() == b'OTHER'
+
+
+def test_weather_key(tmp_path):
+    """Test that only the hash of the latest version of each file is kept."""
+    epw_path = tmp_path / 'weather.epw'
+    epw_path.write_bytes(b'LOCATION')
+    cache = WeatherCache(tmp_path / 'cache')
+    first_key = cache.key(epw_path)
+    epw_path.write_bytes(b'OTHER LOCATION')
+    assert cache.key(epw_path) != first_key
+    assert len(cache._hashes) == 1
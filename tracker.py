@@ -0,0 +1,264 @@
+"""Tracking of the status of jobs by a background thread shared by all app sessions."""
+import time
+import threading
+
+import streamlit as st
+from queenbee.job.job import JobStatusEnum
+
+# number of seconds between the first checks of the status of a job
+TRACKER_MIN_INTERVAL = 2
+# maximum number of seconds between checks of a job whose status does not change
+TRACKER_MAX_INTERVAL = 60
+# number of seconds after which a job that no session has looked at is dropped
+TRACKER_EXPIRY = 3600
+
+FINISHED_STATUSES = (
+    JobStatusEnum.completed, JobStatusEnum.failed, JobStatusEnum.cancelled
+)
+
+
+@st.cache_resource
+def job_tracker():
+    """Get the tracker of job statuses shared by all sessions of this server process."""
+    return JobTracker()
+
+
+class TrackedJob(object):
+    """The last known status of a job that is tracked by a JobTracker.
+
+    Args:
+        job: A Job (or LocalJob) with a refresh method and a status property.
+
+    Properties:
+        * job
+        * status
+        * error
+        * checked
+        * interval
+        * finished
+    """
+
+    def __init__(self, job):
+        self._job = job
+        self._status = None
+        self._error = None
+        self._checked = None
+        self._interval = 0
+        self._next_check = time.time()
+        self._last_read = time.time()
+
+    @property
+    def job(self):
+        """Get the Job that is tracked."""
+        return self._job
+
+    @property
+    def status(self):
+        """Get the queenbee JobStatus from the last check or None if it was not checked."""
+        return self._status
+
+    @property
+    def error(self):
+        """Get text for the error of the last check or None if it succeeded."""
+        return self._error
+
+    @property
+    def checked(self):
+        """Get the time of the last check of the job or None if it was not checked."""
+        return self._checked
+
+    @property
+    def interval(self):
+        """Get the number of seconds until the status of the job is checked again."""
+        return self._interval
+
+    @property
+    def finished(self):
+        """Get a boolean for whether the job is finished and no longer checked."""
+        return self._status is not None and self._status.status in FINISHED_STATUSES
+
+    def __repr__(self):
+        status = self._status.status.value if self._status is not None else 'Unknown'
+        return 'TrackedJob: {} ({})'.format(self._job.id, status)
+
+
+class JobTracker(object):
+    """Check the status of jobs in a background thread and keep it in memory.
+
+    Sessions read the status of jobs from memory such that the API is called once
+    per job no matter how many sessions are watching it. A job is checked again
+    after min_interval and the interval is doubled every time its status has not
+    changed, up to max_interval. Jobs stop being checked once they are finished
+    and they are dropped once no session has read them for the expiry time.
+
+    Args:
+        min_interval: Number of seconds between checks of a job right after it is
+            tracked or its status changed. (Default: 2).
+        max_interval: Maximum number of seconds between checks of a job.
+            (Default: 60).
+        expiry: Number of seconds after which a job that was not read is
+            dropped. (Default: 3600).
+
+    Properties:
+        * min_interval
+        * max_interval
+        * expiry
+        * checks
+        * errors
+    """
+
+    def __init__(self, min_interval=TRACKER_MIN_INTERVAL,
+                 max_interval=TRACKER_MAX_INTERVAL, expiry=TRACKER_EXPIRY):
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._expiry = expiry
+        self._jobs = {}  # key of each job to its TrackedJob
+        self._condition = threading.Condition()
+        self._thread = None
+        self._checks = 0
+        self._errors = 0
+
+    @property
+    def min_interval(self):
+        """Get the number of seconds between the first checks of a job."""
+        return self._min_interval
+
+    @property
+    def max_interval(self):
+        """Get the maximum number of seconds between checks of a job."""
+        return self._max_interval
+
+    @property
+    def expiry(self):
+        """Get the number of seconds after which a job that was not read is dropped."""
+        return self._expiry
+
+    @property
+    def checks(self):
+        """Get the number of times the status of a job has been checked."""
+        return self._checks
+
+    @property
+    def errors(self):
+        """Get the number of checks that failed."""
+        return self._errors
+
+    @staticmethod
+    def key(owner, project, job_id, host=''):
+        """Get the key of a job in the tracker.
+
+        Args:
+            owner: Text for the owner of the project of the job.
+            project: Text for the name of the project of the job.
+            job_id: Text for the ID of the job.
+            host: Text for the host of the project (eg. the URL of the API).
+        """
+        return (host, owner, project, job_id)
+
+    def track(self, job, host=''):
+        """Start tracking a job, checking its status right away if it is new.
+
+        Args:
+            job: A Job (or LocalJob) with a refresh method and a status property.
+            host: Text for the host of the project of the job.
+
+        Returns:
+            The key of the job, which is used to read its status.
+        """
+        key = self.key(job.owner, job.project, job.id, host)
+        with self._condition:
+            tracked = self._jobs.get(key)
+            if tracked is not None:
+                tracked._last_read = time.time()
+                return key
+            tracked = self._jobs[key] = TrackedJob(job)
+        self._check(tracked)
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='job-tracker', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return key
+
+    def get(self, key):
+        """Get the TrackedJob of a key or None if the job is not tracked.
+
+        Args:
+            key: The key of the job from the track method.
+        """
+        with self._condition:
+            tracked = self._jobs.get(key)
+            if tracked is not None:
+                tracked._last_read = time.time()
+            return tracked
+
+    def status(self, key):
+        """Get the last known queenbee JobStatus of a job or None if it is not known.
+
+        Args:
+            key: The key of the job from the track method.
+        """
+        tracked = self.get(key)
+        return tracked.status if tracked is not None else None
+
+    def active(self, keys):
+        """Get a list of the keys of jobs that are tracked and not finished.
+
+        Args:
+            keys: A list of the keys of jobs from the track method.
+        """
+        with self._condition:
+            return [key for key in keys
+                    if key in self._jobs and not self._jobs[key].finished]
+
+    def stats(self):
+        """Get a dictionary summarizing the jobs that are tracked."""
+        with self._condition:
+            active = sum(1 for tracked in self._jobs.values() if not tracked.finished)
+            return {
+                'jobs': len(self._jobs),
+                'active': active,
+                'checks': self._checks,
+                'errors': self._errors
+            }
+
+    def _check(self, tracked):
+        """Check the status of a job and schedule its next check."""
+        try:
+            tracked.job.refresh()
+            status, error = tracked.job.status, None
+        except Exception as e:  # keep the last known status and try again later
+            status, error = tracked.status, str(e)
+        with self._condition:
+            self._checks += 1
+            if error is not None:
+                self._errors += 1
+            changed = error is None and (
+                tracked.status is None or status.dict() != tracked.status.dict())
+            tracked._interval = self._min_interval if changed else \
+                min(max(tracked._interval * 2, self._min_interval), self._max_interval)
+            tracked._status, tracked._error = status, error
+            tracked._checked = time.time()
+            tracked._next_check = tracked._checked + tracked._interval
+
+    def _run(self):
+        """Check every job that is due and wait until the next one is due."""
+        while True:
+            with self._condition:
+                now = time.time()
+                for key, tracked in list(self._jobs.items()):
+                    if now - tracked._last_read > self._expiry:
+                        del self._jobs[key]
+                due = [tracked for tracked in self._jobs.values()
+                       if not tracked.finished and tracked._next_check <= now]
+                if not due:
+                    waiting = [tracked._next_check - now for tracked in self._jobs.values()
+                               if not tracked.finished]
+                    self._condition.wait(min(waiting) if waiting else self._expiry)
+                    continue
+            for tracked in due:
+                self._check(tracked)
+
+    def __repr__(self):
+        return 'JobTracker: {} jobs'.format(len(self._jobs))
@@ -0,0 +1,271 @@
+"""Deduplicated, concurrent uploads of the artifacts of studies to a project."""
+import os
+import json
+import time
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+
+from cache import content_hash, file_hash
+
+# number of artifacts that are uploaded at the same time
+UPLOAD_WORKERS = 8
+# number of times an upload is attempted before it fails
+UPLOAD_ATTEMPTS = 3
+
+
+@st.cache_resource
+def artifact_uploader(target_folder):
+    """Get the uploader of study artifacts shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    manifest = UploadManifest(
+        os.path.join(str(target_folder), 'data', 'uploads', 'manifest.json'))
+    return ArtifactUploader(manifest)
+
+
+class UploadManifest(object):
+    """A JSON file of the artifacts that were uploaded to each project.
+
+    Entries are keyed by the host, owner and project the artifact was uploaded to
+    and by the hash of the content of the artifact such that a file with the same
+    content is never uploaded to the same project twice, regardless of its name
+    or location on this machine.
+
+    Args:
+        file_path: Path to the JSON file of the manifest. It will be created with
+            its folder when the first entry is saved.
+
+    Properties:
+        * file_path
+    """
+
+    def __init__(self, file_path):
+        self._file_path = os.path.abspath(str(file_path))
+        self._lock = threading.Lock()
+        try:
+            with open(self._file_path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @property
+    def file_path(self):
+        """Get the path to the JSON file of the manifest."""
+        return self._file_path
+
+    @staticmethod
+    def key(host, owner, project, digest):
+        """Get the key of an artifact in the manifest.
+
+        Args:
+            host: Text for the host of the project (eg. the URL of the API).
+            owner: Text for the owner of the project.
+            project: Text for the name of the project.
+            digest: Text for the SHA-256 hash of the content of the artifact.
+        """
+        return content_hash(host, owner, project, digest)
+
+    def get(self, key):
+        """Get the path of an uploaded artifact in its project or None if it is not uploaded.
+
+        Args:
+            key: Text for the key of the artifact from the key method.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry['path'] if entry is not None else None
+
+    def add(self, entries):
+        """Add uploaded artifacts to the manifest and save it.
+
+        Args:
+            entries: A dictionary with the key of each artifact and a dictionary
+                with its host, owner, project and path in the project.
+        """
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[key] = dict(entry, uploaded=time.time())
+            self._save()
+
+    def forget(self, host, owner, project):
+        """Remove all artifacts of a project such that they are uploaded again.
+
+        This is needed when files are deleted from the project on the host.
+
+        Args:
+            host: Text for the host of the project.
+            owner: Text for the owner of the project.
+            project: Text for the name of the project.
+        """
+        with self._lock:
+            self._entries = {
+                key: entry for key, entry in self._entries.items()
+                if (entry['host'], entry['owner'], entry['project']) !=
+                (host, owner, project)
+            }
+            self._save()
+
+    def _save(self):
+        """Write the manifest to its file through a temporary file."""
+        folder = os.path.dirname(self._file_path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp_file = '{}.{}.tmp'.format(self._file_path, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_file, self._file_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'UploadManifest: {} artifacts'.format(len(self._entries))
+
+
+class ArtifactUploader(object):
+    """Upload the artifacts of studies concurrently, skipping any that were uploaded.
+
+    Artifacts are uploaded into a sub-folder named after the hash of their content
+    so two different files with the same name never overwrite one another in the
+    project. Failed uploads are retried with an exponential backoff.
+
+    Args:
+        manifest: An UploadManifest of the artifacts that were already uploaded.
+        max_workers: Integer for the number of artifacts that are uploaded at
+            the same time. (Default: 8).
+        attempts: Integer for the number of times an upload is attempted
+            before it fails. (Default: 3).
+        backoff: Number of seconds to wait before the first retry of an upload,
+            which is doubled for every following retry. (Default: 1).
+
+    Properties:
+        * manifest
+        * max_workers
+        * attempts
+        * uploaded
+        * skipped
+    """
+
+    def __init__(self, manifest, max_workers=UPLOAD_WORKERS, attempts=UPLOAD_ATTEMPTS,
+                 backoff=1):
+        self._manifest = manifest
+        self._max_workers = int(max_workers)
+        self._attempts = max(int(attempts), 1)
+        self._backoff = backoff
+        self._uploaded = 0
+        self._skipped = 0
+
+    @property
+    def manifest(self):
+        """Get the UploadManifest of the artifacts that were already uploaded."""
+        return self._manifest
+
+    @property
+    def max_workers(self):
+        """Get the number of artifacts that are uploaded at the same time."""
+        return self._max_workers
+
+    @property
+    def attempts(self):
+        """Get the number of times an upload is attempted before it fails."""
+        return self._attempts
+
+    @property
+    def uploaded(self):
+        """Get the number of artifacts that have been uploaded."""
+        return self._uploaded
+
+    @property
+    def skipped(self):
+        """Get the number of artifacts that did not need to be uploaded."""
+        return self._skipped
+
+    def upload(self, new_job, file_paths, target_folder='', host='', progress=None):
+        """Upload files to the project of a job, reusing any that were uploaded.
+
+        Args:
+            new_job: A NewJob (or LocalNewJob) with an upload_artifact method,
+                whose owner and project the files are uploaded to.
+            file_paths: A list of paths to the files to be uploaded.
+            target_folder: Text for the folder in the project to which the
+                files are uploaded. (Default: '').
+            host: Text for the host of the project, which keeps the artifacts
+                of projects with the same name on different hosts separate.
+            progress: An optional function that is called with the number of
+                files that are done and the total number of files. It is called
+                from the thread that called this method.
+
+        Returns:
+            A list with the path of each file in the project, which can be used as
+            the value of an artifact input.
+        """
+        file_paths = [pathlib.Path(fp) for fp in file_paths]
+        digests = [file_hash(fp) for fp in file_paths]
+        keys = [self._manifest.key(host, new_job.owner, new_job.project, digest)
+                for digest in digests]
+        paths, pending = {}, {}  # files with the same content are uploaded once
+        for fp, digest, key in zip(file_paths, digests, keys):
+            path = self._manifest.get(key)
+            if path is not None:
+                paths[key] = path
+            elif key not in pending:
+                pending[key] = (fp, '/'.join(p for p in (target_folder, digest[:16]) if p))
+        self._skipped += len(file_paths) - len(pending)
+
+        total, done = len(file_paths), sum(1 for key in keys if key in paths)
+        if progress is not None:
+            progress(done, total)
+        entries = {}
+        if pending:
+            workers = min(self._max_workers, len(pending))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._upload_artifact, new_job, fp, folder): key
+                    for key, (fp, folder) in pending.items()
+                }
+                try:
+                    for future in as_completed(futures):
+                        key = futures[future]
+                        paths[key] = future.result()
+                        entries[key] = {
+                            'host': host, 'owner': new_job.owner,
+                            'project': new_job.project, 'path': paths[key]
+                        }
+                        self._uploaded += 1
+                        done += keys.count(key)
+                        if progress is not None:
+                            progress(done, total)
+                finally:  # keep whatever was uploaded before any failure
+                    for future in futures:
+                        future.cancel()
+                    if entries:
+                        self._manifest.add(entries)
+        return [paths[key] for key in keys]
+
+    def stats(self):
+        """Get a dictionary summarizing the uploads."""
+        requested = self._uploaded + self._skipped
+        return {
+            'artifacts': len(self._manifest),
+            'uploaded': self._uploaded,
+            'skipped': self._skipped,
+            'skip_rate': self._skipped / requested if requested != 0 else 0
+        }
+
+    def _upload_artifact(self, new_job, file_path, target_folder):
+        """Upload a single file, retrying it with an exponential backoff if it fails."""
+        for attempt in range(self._attempts):
+            try:
+                return new_job.upload_artifact(file_path, target_folder)
+            except Exception:
+                if attempt == self._attempts - 1:
+                    raise
+                time.sleep(self._backoff * 2 ** attempt)
+
+    def __repr__(self):
+        return 'ArtifactUploader: {} workers'.format(self._max_workers)
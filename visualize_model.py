@@ -1,23 +1,295 @@
-import os
-from pathlib import Path
+import io
+import json
+import threading
+import zipfile
+from collections import OrderedDict
 import streamlit as st
+import vtk
 from honeybee.model import Model
-from honeybee_vtk.model import Model as VTKModel
+from honeybee.shade import Shade
+from honeybee_vtk.model import Model as VTKModel, DATA_SETS
+from honeybee_vtk.to_vtk import convert_face_3d, convert_sensor_grid
+from honeybee_vtk.types import JoinedPolyData, ModelDataSet
+from honeybee_vtk.vtkjs.schema import IndexJSON, SensorGridOptions
 from pollination_streamlit_viewer import viewer
 
+from cache import content_hash
+
+# number of versions of each layer of the room preview that are kept in memory
+SCENE_CACHE_SIZE = 64
+
+# datasets in each layer of the room preview, which are rebuilt independently
+SCENE_LAYERS = OrderedDict([
+    ('shell', ('Wall', 'Floor', 'RoofCeiling', 'AirBoundary', 'Door')),
+    ('apertures', ('Aperture',)),
+    ('shades', ('Shade',)),
+    ('grid', ('Grid',))
+])
+
+
+class _MemoryArchive(object):
+    """Archive that vtkPythonArchiver uses to keep the files of a dataset in memory.
+
+    Args:
+        folder: Text for the folder of the dataset inside the vtkjs file.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.files = OrderedDict()
+
+    def OpenArchive(self, vtkself):
+        pass
+
+    def CloseArchive(self, vtkself):
+        pass
+
+    def InsertIntoArchive(self, vtkself, relative_path, data, size):
+        self.files['{}/{}'.format(self.folder, relative_path)] = data
+
+    def Contains(self, vtkself, relative_path):
+        return '{}/{}'.format(self.folder, relative_path) in self.files
+
+
+def _data_set_files(data_set):
+    """Get a dictionary of the files of a ModelDataSet in a vtkjs file.
+
+    This is what ModelDataSet.to_folder writes to disk but without any files.
+    """
+    polydata = data_set.data[0] if len(data_set.data) == 1 \
+        else JoinedPolyData.from_polydata(data_set.data)
+    archive = _MemoryArchive(data_set.name)
+    archiver = vtk.vtkPythonArchiver()
+    archiver.SetPythonObject(archive)
+    writer = vtk.vtkJSONDataSetWriter()
+    writer.SetArchiver(archiver)
+    if isinstance(polydata, vtk.vtkPolyData):
+        writer.SetInputData(polydata)
+    else:
+        writer.SetInputConnection(polydata.GetOutputPort())
+    writer.Write()
+    return archive.files
+
+
+def _vtkjs_content(files, scene):
+    """Zip the files of the datasets and the index of a scene into vtkjs bytes."""
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for path, data in files.items():
+            zip_file.writestr(path, data)
+        index_json = IndexJSON()
+        index_json.scene = scene
+        zip_file.writestr('index.json', json.dumps(index_json.dict()))
+    return content.getvalue()
+
+
+def model_to_vtkjs(hb_model: Model, grid_options=SensorGridOptions.Sensors):
+    """Get the content of a vtkjs file for a Model without writing any files.
+
+    The Model is converted to VTK in memory and every dataset is serialized
+    straight into a zip file in memory instead of writing the HBJSON, reading
+    it back and zipping a folder of the datasets like VTKModel.to_vtkjs does.
+
+    Args:
+        hb_model: A Honeybee Model, which is not modified.
+        grid_options: A SensorGridOptions for how the sensor grids of the
+            Model are displayed. (Default: Sensors).
+
+    Returns:
+        The bytes of the vtkjs file, which can be passed to a viewer as content.
+    """
+    vtk_model = VTKModel(hb_model, grid_options)
+    data_sets = [getattr(vtk_model, name) for name in DATA_SETS.values()]
+    data_sets.append(vtk_model.sensor_grids)
+    files, scene = OrderedDict(), []
+    for data_set in data_sets:
+        if len(data_set.data) == 0:  # empty dataset
+            continue
+        files.update(_data_set_files(data_set))
+        scene.append(data_set.as_data_set())
+    return _vtkjs_content(files, scene)
+
+
+def _add_polydata(data, hb_obj, geometry):
+    """Convert a Face, Aperture, Door or Shade and add it to its list of PolyData."""
+    polydata = convert_face_3d(geometry)
+    polydata._add_metadata(polydata._get_metadata(hb_obj))
+    data[polydata.type].append(polydata)
+
+
+def _object_key(hb_obj, vertices):
+    """Get a list of everything about an object that ends up in the vtkjs file."""
+    key = [
+        hb_obj.display_name,
+        hb_obj.properties.energy.construction.display_name,
+        hb_obj.properties.radiance.modifier.display_name,
+        [pt.to_array() for pt in vertices]
+    ]
+    if not isinstance(hb_obj, Shade):
+        key.append(str(hb_obj.boundary_condition))
+    return key
+
+
+def scene_layers(hb_model):
+    """Get the key and the conversion function of each layer of the preview of a Model.
+
+    Objects are converted the same way VTKModel converts the objects of Rooms
+    such that the datasets match the ones written by model_to_vtkjs. The key
+    of each layer is a hash of everything that ends up in its datasets so
+    that a layer is only converted again when it looks different.
+
+    Args:
+        hb_model: A Honeybee Model of Rooms.
+
+    Returns:
+        A list of tuples with the name of the layer, its key and a function that
+        returns a dictionary of PolyData lists for each dataset of the layer.
+    """
+    faces, apertures, shades = [], [], []
+    for room in hb_model.rooms:
+        for face in room.faces:
+            faces.append(face)
+            for aperture in face.apertures:
+                apertures.append(aperture)
+                shades.extend(aperture.outdoor_shades + aperture.indoor_shades)
+        shades.extend(room.indoor_shades + room.outdoor_shades)
+    grids = hb_model.properties.radiance.sensor_grids
+
+    def shell():
+        data = OrderedDict((name, []) for name in SCENE_LAYERS['shell'])
+        for face in faces:
+            _add_polydata(data, face, face.punched_geometry)
+            for door in face.doors:
+                _add_polydata(data, door, door.geometry)
+        return data
+
+    def apertures_layer():
+        data = {'Aperture': []}
+        for aperture in apertures:
+            _add_polydata(data, aperture, aperture.geometry)
+        return data
+
+    def shades_layer():
+        data = {'Shade': []}
+        for shade in shades:
+            _add_polydata(data, shade, shade.geometry)
+        return data
+
+    def grid():
+        return {'Grid': [convert_sensor_grid(g, SensorGridOptions.Sensors)
+                         for g in grids]}
+
+    shell_key = [_object_key(f, f.punched_vertices) for f in faces] + \
+        [_object_key(d, d.vertices) for f in faces for d in f.doors]
+    return [
+        ('shell', shell_key, shell),
+        ('apertures', [_object_key(a, a.vertices) for a in apertures], apertures_layer),
+        ('shades', [_object_key(s, s.vertices) for s in shades], shades_layer),
+        ('grid', [[s.pos for s in g.sensors] for g in grids], grid)
+    ]
+
+
+class SceneCache(object):
+    """Cache of the layers of the vtkjs preview of room Models.
+
+    The preview is split into the room shell, the apertures, the shades and the
+    sensor grid, which are converted to VTK and serialized separately. When
+    only some inputs of a room change, like the depth of the overhangs, only
+    the layers that look different are rebuilt and the rest are reused when
+    the vtkjs file is assembled.
+
+    Args:
+        max_entries: Integer for the maximum number of versions of each layer
+            that are kept in memory. (Default: 64).
+
+    Properties:
+        * max_entries
+        * hits
+        * misses
+    """
+
+    def __init__(self, max_entries=SCENE_CACHE_SIZE):
+        self._max_entries = int(max_entries)
+        # layer name and key to a tuple of the dataset files and vtkjs DataSets
+        self._layers = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def max_entries(self):
+        """Get the maximum number of versions of each layer kept in memory."""
+        return self._max_entries
+
+    @property
+    def hits(self):
+        """Get the number of layers that were reused from memory."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Get the number of layers that had to be converted."""
+        return self._misses
+
+    def vtkjs(self, hb_model):
+        """Get the content of the vtkjs file of a Model from its cached layers.
+
+        Args:
+            hb_model: A Honeybee Model of Rooms, which is not modified.
+
+        Returns:
+            The bytes of the vtkjs file of the Model.
+        """
+        files, scene = OrderedDict(), []
+        for name, key, convert in scene_layers(hb_model):
+            layer_files, layer_scene = self._layer(name, key, convert)
+            files.update(layer_files)
+            scene.extend(layer_scene)
+        return _vtkjs_content(files, scene)
+
+    def stats(self):
+        """Get a dictionary summarizing the current state of the cache."""
+        lookups = self._hits + self._misses
+        return {
+            'layers': len(self._layers),
+            'max_entries': self._max_entries,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups != 0 else 0
+        }
+
+    def _layer(self, name, key, convert):
+        """Get the files and DataSets of a layer, converting it if it is not cached."""
+        key = (name, content_hash(json.dumps(key)))
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is not None:
+                self._layers.move_to_end(key)
+                self._hits += 1
+                return layer
+            self._misses += 1
+        files, scene = OrderedDict(), []
+        for data_name, data in convert().items():
+            if len(data) == 0:  # empty dataset
+                continue
+            data_set = ModelDataSet(
+                data_name, data, color=VTKModel.get_default_color(data_name))
+            files.update(_data_set_files(data_set))
+            scene.append(data_set.as_data_set())
+        layer = (files, scene)
+        with self._lock:
+            self._layers[key] = layer
+            while len(self._layers) > self._max_entries * len(SCENE_LAYERS):
+                self._layers.popitem(last=False)
+        return layer
+
+    def __repr__(self):
+        return 'SceneCache: {} layers'.format(len(self._layers))
+
+
 def generate_vtk_model(hb_model: Model, container):
     """Generate a VTK preview of an input model."""
-    if not st.session_state.vtk_path:
-        directory = os.path.join(
-            st.session_state.target_folder.as_posix(),
-            'data'#, st.session_state.user_id
-        )
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        hbjson_path = hb_model.to_hbjson(hb_model.identifier, directory)
-        vtk_model = VTKModel.from_hbjson(hbjson_path)
-        vtk_path = vtk_model.to_vtkjs(folder=directory, name=hb_model.identifier)
-        st.session_state.vtk_path = vtk_path
-    vtk_path = st.session_state.vtk_path
+    if not st.session_state.vtk_content:
+        st.session_state.vtk_content = model_to_vtkjs(hb_model)
     with container:
-        viewer(content=Path(vtk_path).read_bytes(), key='vtk_preview_model')
\ No newline at end of file
+        viewer(content=st.session_state.vtk_content, key='vtk_preview_model')
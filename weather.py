@@ -0,0 +1,476 @@
+"""Caches of downloaded and parsed EPW weather files and the files derived from them."""
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import threading
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+
+import numpy as np
+import streamlit as st
+
+from ladybug.epw import EPW
+from ladybug.location import Location
+
+from cache import content_hash, file_hash
+
+# Hourly fields of the EPW that are stored in the cache as arrays
+HOURLY_FIELDS = (
+    'dry_bulb_temperature', 'dew_point_temperature', 'relative_humidity',
+    'atmospheric_station_pressure', 'direct_normal_radiation',
+    'diffuse_horizontal_radiation', 'global_horizontal_radiation',
+    'wind_direction', 'wind_speed', 'total_sky_cover'
+)
+
+
+@st.cache_resource
+def download_cache(target_folder):
+    """Get the cache of downloaded weather files shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    return DownloadCache(os.path.join(str(target_folder), 'data', 'cache', 'epw'))
+
+
+@st.cache_resource
+def weather_cache(target_folder):
+    """Get the cache of parsed weather files shared by all app sessions.
+
+    Args:
+        target_folder: Text for the target folder of the app.
+    """
+    return WeatherCache(os.path.join(str(target_folder), 'data', 'cache', 'weather'))
+
+
+def write_upload(upload, folder):
+    """Write an uploaded EPW file into a folder unless it was already written.
+
+    Streamlit returns the same upload on every rerun and writing it again would
+    change the modified time of the file, which makes the WeatherCache hash it
+    again. The session remembers the upload and the file it wrote such that
+    the file is only written again if it is a new upload or it was replaced.
+
+    Args:
+        upload: The UploadedFile of an EPW from st.file_uploader.
+        folder: Path to the folder into which the EPW is written.
+
+    Returns:
+        The path to the EPW file.
+    """
+    epw_path = os.path.abspath(os.path.join(str(folder), upload.name))
+    # the ID is file_id in newer releases of streamlit and id in older ones
+    upload_id = getattr(upload, 'file_id', None) or getattr(upload, 'id', None)
+    written = st.session_state.setdefault('epw_uploads', {})
+    try:
+        stat = os.stat(epw_path)
+        file_id = (upload_id, stat.st_mtime_ns, stat.st_size)
+    except OSError:  # the file was never written or it was removed
+        file_id = None
+    if file_id is None or written.get(epw_path) != file_id:
+        os.makedirs(os.path.dirname(epw_path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(epw_path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(upload.getvalue())
+        os.replace(temp_path, epw_path)  # other sessions never read a partial file
+        stat = os.stat(epw_path)
+        written[epw_path] = (upload_id, stat.st_mtime_ns, stat.st_size)
+    return epw_path
+
+
+class WeatherData(object):
+    """The parsed contents of an EPW file along with its derived DDY and Wea files.
+
+    Args:
+        folder: Path to the folder of the cache entry, which contains a copy of
+            the EPW, the DDY and Wea derived from it, the location as JSON and
+            the hourly data as a compressed NumPy archive.
+
+    Properties:
+        * key
+        * folder
+        * location
+        * epw_path
+        * ddy_path
+        * wea_path
+    """
+    EPW_FILE = 'weather.epw'
+    DDY_FILE = 'weather.ddy'
+    WEA_FILE = 'weather.wea'
+    LOCATION_FILE = 'location.json'
+    HOURLY_FILE = 'hourly.npz'
+
+    def __init__(self, folder):
+        self._folder = folder
+        with open(os.path.join(folder, self.LOCATION_FILE)) as f:
+            self._location = Location.from_dict(json.load(f))
+        self._hourly = None  # loaded the first time it is requested
+
+    @property
+    def key(self):
+        """Get the content hash of the EPW file."""
+        return os.path.basename(self._folder)
+
+    @property
+    def folder(self):
+        """Get the path to the folder of the cache entry."""
+        return self._folder
+
+    @property
+    def location(self):
+        """Get the Ladybug Location of the weather file."""
+        return self._location
+
+    @property
+    def epw_path(self):
+        """Get the path to the copy of the EPW file in the cache."""
+        return os.path.join(self._folder, self.EPW_FILE)
+
+    @property
+    def ddy_path(self):
+        """Get the path to the DDY file derived from the EPW."""
+        return os.path.join(self._folder, self.DDY_FILE)
+
+    @property
+    def wea_path(self):
+        """Get the path to the Wea file derived from the EPW."""
+        return os.path.join(self._folder, self.WEA_FILE)
+
+    def hourly(self, field):
+        """Get a float32 array with the hourly values of an EPW field.
+
+        Args:
+            field: Text for the name of one of the HOURLY_FIELDS.
+        """
+        if self._hourly is None:
+            with np.load(os.path.join(self._folder, self.HOURLY_FILE)) as data:
+                self._hourly = {name: data[name] for name in data.files}
+        return self._hourly[field]
+
+    @classmethod
+    def from_epw(cls, epw_path, folder):
+        """Parse an EPW file and write a complete cache entry to a folder.
+
+        The entry is written to a temporary folder and then moved into place
+        so that other sessions never see a partially-written entry.
+
+        Args:
+            epw_path: Path to the EPW file to be parsed.
+            folder: Path to the folder of the cache entry.
+        """
+        temp_folder = '{}.{}.{}.tmp'.format(
+            folder, os.getpid(), threading.get_ident())
+        os.makedirs(temp_folder)
+        try:
+            shutil.copyfile(str(epw_path), os.path.join(temp_folder, cls.EPW_FILE))
+            epw = EPW(os.path.join(temp_folder, cls.EPW_FILE))
+            with open(os.path.join(temp_folder, cls.LOCATION_FILE), 'w') as f:
+                json.dump(epw.location.to_dict(), f)
+            np.savez_compressed(
+                os.path.join(temp_folder, cls.HOURLY_FILE),
+                **{name: np.array(getattr(epw, name).values, dtype=np.float32)
+                   for name in HOURLY_FIELDS})
+            epw.to_ddy(os.path.join(temp_folder, cls.DDY_FILE))
+            epw.to_wea(os.path.join(temp_folder, cls.WEA_FILE))
+            try:
+                os.replace(temp_folder, folder)
+            except OSError:  # another session finished the same entry first
+                pass
+        finally:
+            if os.path.isdir(temp_folder):
+                shutil.rmtree(temp_folder, ignore_errors=True)
+        return cls(folder)
+
+    def __repr__(self):
+        return 'WeatherData: {}'.format(self._location.city)
+
+
+class WeatherCache(object):
+    """Cache of parsed weather files keyed by the content hash of the EPW.
+
+    Parsing an EPW and deriving its DDY and Wea files only happens the first
+    time that a given weather file is seen. After that, the parsed data is
+    held in memory and the hash of the file is only recomputed if its size or
+    modified time changes, so a rerun of the app with the same weather file
+    does not read the EPW at all. Only the latest hash of each path is kept.
+
+    Args:
+        folder: Path to a folder where the cache entries will be written.
+            It will be created if it does not exist.
+
+    Properties:
+        * folder
+    """
+
+    def __init__(self, folder):
+        self._folder = os.path.abspath(str(folder))
+        if not os.path.isdir(self._folder):
+            os.makedirs(self._folder)
+        self._hashes = {}  # path to its (modified time, size) and content hash
+        self._entries = {}  # content hash to WeatherData
+        self._lock = threading.Lock()
+
+    @property
+    def folder(self):
+        """Get the path to the folder where the cache entries are written."""
+        return self._folder
+
+    def key(self, epw_path):
+        """Get the content hash of an EPW file, reusing it if the file is unchanged.
+
+        Args:
+            epw_path: Path to an EPW file.
+        """
+        epw_path = os.path.abspath(str(epw_path))
+        stat = os.stat(epw_path)
+        file_id = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known_id, key = self._hashes.get(epw_path, (None, None))
+        if known_id != file_id:  # replace the hash of any older version of the file
+            key = file_hash(epw_path)
+            with self._lock:
+                self._hashes[epw_path] = (file_id, key)
+        return key
+
+    def get(self, epw_path):
+        """Get the WeatherData of an EPW file, parsing it only if it is not cached.
+
+        Args:
+            epw_path: Path to an EPW file.
+        """
+        key = self.key(epw_path)
+        with self._lock:
+            if key not in self._entries:
+                folder = os.path.join(self._folder, key)
+                if os.path.isfile(os.path.join(folder, WeatherData.LOCATION_FILE)):
+                    self._entries[key] = WeatherData(folder)
+                else:
+                    self._entries[key] = WeatherData.from_epw(epw_path, folder)
+            return self._entries[key]
+
+    def __repr__(self):
+        return 'WeatherCache: {}'.format(self._folder)
+
+
+class DownloadCache(object):
+    """A size-bounded cache of weather files downloaded from URLs.
+
+    Each URL has a metadata file with the ETag and Last-Modified headers of the
+    response, which are used to revalidate the download once it is older than
+    max_age. The downloaded files are unzipped into a folder named after the
+    hash of their content, so URLs that serve identical files share one folder.
+    Folders are unzipped to a temporary location and moved into place such that
+    a partially-extracted folder is never used. The least recently used folders
+    are removed once all folders exceed max_size. Each URL is downloaded by one
+    thread at a time without blocking the lookups of other URLs.
+
+    Args:
+        folder: Path to a folder where the downloads will be written.
+            It will be created if it does not exist.
+        max_size: Integer for the maximum number of bytes that all of the
+            unzipped folders can occupy on disk. (Default: 200 MB).
+        max_age: Number of seconds after which a download is revalidated with
+            the server. (Default: 86400, one day).
+        timeout: Number of seconds to wait for the server. (Default: 30).
+
+    Properties:
+        * folder
+        * max_size
+        * max_age
+        * size
+    """
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, folder, max_size=200000000, max_age=86400, timeout=30):
+        self._folder = os.path.abspath(str(folder))
+        self._url_folder = os.path.join(self._folder, 'urls')
+        self._file_folder = os.path.join(self._folder, 'files')
+        for fold in (self._url_folder, self._file_folder):
+            if not os.path.isdir(fold):
+                os.makedirs(fold)
+        self._max_size = int(max_size)
+        self._max_age = max_age
+        self._timeout = timeout
+        self._lock = threading.Lock()  # guards the shared folders of the cache
+        self._url_locks = {}  # URL to a lock held while it is checked or downloaded
+
+    @property
+    def folder(self):
+        """Get the path to the folder where the downloads are written."""
+        return self._folder
+
+    @property
+    def max_size(self):
+        """Get the maximum number of bytes that the unzipped folders can occupy."""
+        return self._max_size
+
+    @property
+    def max_age(self):
+        """Get the number of seconds after which a download is revalidated."""
+        return self._max_age
+
+    @property
+    def size(self):
+        """Get the number of bytes currently occupied by the unzipped folders."""
+        return sum(self._folder_size(fp) for fp in self._file_folders())
+
+    def get(self, url):
+        """Get the folder with the unzipped contents of a URL, downloading it if needed.
+
+        Args:
+            url: Text for the URL of a zip file or an EPW file.
+
+        Returns:
+            The path to a folder that contains the files of the download.
+        """
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            meta = self._read_meta(url)
+            if meta is not None and os.path.isdir(self._entry_path(meta['hash'])):
+                if time.time() - meta['checked'] < self._max_age:
+                    os.utime(self._entry_path(meta['hash']))  # most recently used
+                    return self._entry_path(meta['hash'])
+            else:
+                meta = None
+            meta = self._download(url, meta)
+            with self._lock:
+                self._evict(keep=meta['hash'])
+            return self._entry_path(meta['hash'])
+
+    def epw_path(self, url):
+        """Get the path to the EPW file downloaded from a URL.
+
+        Args:
+            url: Text for the URL of a zip file that contains an EPW or an EPW file.
+        """
+        folder = self.get(url)
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.lower().endswith('.epw'):
+                return os.path.join(folder, file_name)
+        raise ValueError('No EPW file was found at the URL: {}'.format(url))
+
+    def _download(self, url, meta):
+        """Download a URL into the cache, revalidating any existing metadata."""
+        request = urllib.request.Request(url)
+        if meta is not None:
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+        temp_file = os.path.join(
+            self._folder, '{}.{}.download'.format(content_hash(url), os.getpid()))
+        try:
+            try:
+                response = urllib.request.urlopen(request, timeout=self._timeout)
+            except HTTPError as e:
+                if e.code == 304 and meta is not None:  # the download is up to date
+                    meta['checked'] = time.time()
+                    self._write_meta(url, meta)
+                    return meta
+                raise
+            sha = hashlib.sha256()
+            with response, open(temp_file, 'wb') as f:
+                for chunk in iter(lambda: response.read(self.CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    f.write(chunk)
+                headers = response.headers
+            meta = {
+                'url': url,
+                'hash': sha.hexdigest(),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'size': os.path.getsize(temp_file),
+                'checked': time.time()
+            }
+            if not os.path.isdir(self._entry_path(meta['hash'])):
+                self._extract(url, temp_file, self._entry_path(meta['hash']))
+        finally:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+        self._write_meta(url, meta)
+        return meta
+
+    def _extract(self, url, file_path, folder):
+        """Extract a downloaded file into a folder through a temporary folder."""
+        temp_folder = '{}.{}.{}.tmp'.format(folder, os.getpid(), threading.get_ident())
+        os.makedirs(temp_folder)
+        try:
+            if zipfile.is_zipfile(file_path):
+                with zipfile.ZipFile(file_path) as zip_file:
+                    for name in zip_file.namelist():
+                        target = os.path.abspath(os.path.join(temp_folder, name))
+                        if not target.startswith(temp_folder + os.sep):
+                            raise ValueError(
+                                'Zip file at {} has an unsafe path: {}'.format(url, name))
+                    zip_file.extractall(temp_folder)
+            elif urlparse(url).path.lower().endswith('.epw'):
+                file_name = os.path.basename(urlparse(url).path)
+                shutil.copyfile(file_path, os.path.join(temp_folder, file_name))
+            else:
+                raise ValueError(
+                    'Download from {} is not a zip or EPW file.'.format(url))
+            with self._lock:  # another URL with the same content may have finished first
+                if not os.path.isdir(folder):
+                    os.replace(temp_folder, folder)
+        finally:
+            if os.path.isdir(temp_folder):
+                shutil.rmtree(temp_folder, ignore_errors=True)
+
+    def _meta_path(self, url):
+        """Get the path to the metadata file of a URL."""
+        return os.path.join(self._url_folder, content_hash(url) + '.json')
+
+    def _entry_path(self, download_hash):
+        """Get the path to the folder of the unzipped contents of a download."""
+        return os.path.join(self._file_folder, download_hash)
+
+    def _read_meta(self, url):
+        """Get the metadata of a URL or None if it has not been downloaded."""
+        try:
+            with open(self._meta_path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, url, meta):
+        """Write the metadata of a URL atomically."""
+        temp_file = '{}.{}.tmp'.format(self._meta_path(url), os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_file, self._meta_path(url))
+
+    def _file_folders(self):
+        """Get a list of the paths to all unzipped folders in the cache."""
+        return [
+            os.path.join(self._file_folder, f) for f in os.listdir(self._file_folder)
+            if not f.endswith('.tmp')
+        ]
+
+    @staticmethod
+    def _folder_size(folder):
+        """Get the number of bytes of all files in a folder."""
+        return sum(
+            os.path.getsize(os.path.join(root, f))
+            for root, _, files in os.walk(folder) for f in files
+        )
+
+    def _evict(self, keep=None):
+        """Remove the least recently used folders until the cache fits in max_size."""
+        folders = sorted(self._file_folders(), key=os.path.getmtime)
+        sizes = {fold: self._folder_size(fold) for fold in folders}
+        total = sum(sizes.values())
+        for fold in folders:
+            if total <= self._max_size:
+                break
+            if os.path.basename(fold) == keep:
+                continue
+            shutil.rmtree(fold, ignore_errors=True)
+            total -= sizes[fold]
+
+    def __repr__(self):
+        return 'DownloadCache: {}'.format(self._folder)